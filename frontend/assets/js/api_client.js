@@ -78,6 +78,31 @@ class VeevaAPIClient {
         }
     }
 
+    /**
+     * 批量查询工单状态
+     * @param {string[]} jiraTickets Jira工单号列表
+     * @returns {Promise} API响应
+     */
+    async checkJiraStatusBatch(jiraTickets) {
+        try {
+            const response = await fetch(`${this.baseURL}/api/check-jira-status/batch`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({ jira_tickets: jiraTickets })
+            });
+            
+            return await response.json();
+        } catch (error) {
+            console.error('批量查询工单状态失败:', error);
+            return {
+                success: false,
+                message: `查询失败: ${error.message}`
+            };
+        }
+    }
+
     /**
      * 下载文件
      * @param {string} filename 文件名
@@ -102,12 +127,16 @@ class VeevaAPIClient {
     /**
      * 分析Excel文件
      * @param {File} file 要分析的Excel文件
+     * @param {string} [requirement] 分析需求，不传时统计各客户数据量排名
      * @returns {Promise} API响应
      */
-    async analyzeFile(file) {
+    async analyzeFile(file, requirement) {
         try {
             const formData = new FormData();
             formData.append('file', file);
+            if (requirement) {
+                formData.append('requirement', requirement);
+            }
             
             const response = await fetch(`${this.baseURL}/api/analyze-file`, {
                 method: 'POST',
@@ -1,31 +1,42 @@
 import os
 import re
-import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Optional
 from pathlib import Path
 
 import httpx
 import pandas as pd
-import matplotlib
-matplotlib.use('Agg') # Use the Agg backend for non-interactive plotting
-import matplotlib.pyplot as plt
 import io
-from urllib.parse import urljoin
+from urllib.parse import unquote, urljoin
 from dotenv import load_dotenv
 from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain.tools import tool
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
+from llm_clients import ainvoke_chain, get_llm, invoke_chain
+from sql_cache import sql_cache
+from table_selector import TableSelector
+from schema_catalog import SchemaCatalog
+from sql_validator import SqlValidator
+from llm_analysis import analyze_with_llm
+from report_analysis import ANALYSIS_NARRATIVE_SUMMARY, compute_customer_ranking_from_workbook, ranking_to_csv
 from playwright.async_api import (Browser, BrowserContext, Locator, Page,
-                                  expect, async_playwright, Playwright)
+                                  expect, Playwright)
 import asyncio # 新增或确保存在
 
-# Global variables to hold the Playwright instances
-_playwright_instance: Optional[Playwright] = None
-_browser_instance: Optional[Browser] = None
-_context_instance: Optional[BrowserContext] = None
-_app_page_instance: Optional[Page] = None
+from browser_profile import apply_request_blocking, get_launch_options
+from browser_service import get_browser_service_client
+from browser_pool import BrowserContextPool, cookies_expired
+from report_store import file_sha256, report_store
+from chart_renderer import render_bar_chart
+from columnar_cache import columnar_cache
+from task_logging import map_in_context
+from pegasus_client import (PegasusStatusClient, build_auth_headers, build_download_url, extract_statuses,
+                            find_record, find_record_list, get_http_client, learn_download_template, learn_status_keys,
+                            load_storage_state_cookies, save_endpoints)
+
+# 浏览器上下文池，供并发的浏览器操作使用；登录由池在会话失效时通过 _relogin_for_pool 完成
+_browser_pool: Optional[BrowserContextPool] = None
 
 # 定义会话状态文件路径
 SESSION_STATE_PATH = Path("./playwright_session_state.json")
@@ -47,213 +58,161 @@ try:
 except Exception as e:
     jira = None
     print(f"❌ 错误: Jira 客户端初始化失败: {e}")
+# 同一 issue 的附件并发上传数
+JIRA_UPLOAD_CONCURRENCY = int(os.getenv("JIRA_UPLOAD_CONCURRENCY", "4"))
+
+# 记录附件内容哈希的 issue 属性 {附件ID: sha256}，上传时写入，比较时无需下载附件内容
+ATTACHMENT_HASH_PROPERTY = "chatbot.attachment-sha256"
 
-def add_attachment(issue_key: str, file_path: str, replace_existing: bool = True) -> bool:
+def _load_attachment_hashes(issue) -> dict:
     """
-    为指定的Jira issue添加附件。
+    (内部辅助函数) 读取上传时记录的附件哈希，属性不存在或读取失败时返回空字典。
+    """
+    try:
+        return dict(jira.issue_property(issue.key, ATTACHMENT_HASH_PROPERTY).value or {})
+    except Exception:
+        return {}
+
+def _same_content(attachment, file_path: str, sha256: str, recorded_hashes: dict) -> bool:
+    """
+    (内部辅助函数) 大小相同且上传时记录的哈希一致才视为内容相同；没有记录哈希的附件视为不同，重新上传。
+    """
+    if getattr(attachment, 'size', None) != os.path.getsize(file_path):
+        return False
+    return recorded_hashes.get(str(attachment.id)) == sha256
+
+def add_attachments(issue_key: str, files: list, replace_existing: bool = True) -> dict:
+    """
+    为指定的Jira issue批量添加附件：只获取一次 issue，并发上传所有文件。
+    已有同名且内容相同的附件时跳过上传（按大小和上传时记录在 issue 属性中的哈希比较，不下载附件内容）；
+    内容不同时先上传新附件再删除旧附件，附件不会出现缺失的窗口。
 
     Args:
         issue_key (str): Jira issue的key，例如 'ORI-120579'
-        file_path (str): 要上传的文件路径
+        files (list): [(文件路径, 附件文件名或None)]，文件名为None时使用文件路径的文件名
         replace_existing (bool): 如果存在同名附件是否替换，默认True
 
     Returns:
-        bool: 上传成功返回True，失败返回False
+        dict: {附件文件名: 是否成功}，内容未变化而跳过的附件也视为成功
     """
+    entries = [(file_path, filename or os.path.basename(file_path)) for file_path, filename in files]
     if not jira:
         print("❌ Jira 功能不可用，无法上传附件。")
-        return False
+        return {filename: False for _, filename in entries}
     try:
-        issue = jira.issue(issue_key)
+        issue = jira.issue(issue_key, fields="summary,attachment")
         print(f"   -> 找到Jira issue: {issue.key} ({issue.fields.summary})")
-
-        if not os.path.exists(file_path):
-            print(f"   -> ❌ 错误: 文件不存在 - {file_path}")
-            return False
-
-        filename = os.path.basename(file_path)
-
-        if replace_existing:
-            for attachment in issue.fields.attachment or []:
-                if attachment.filename == filename:
-                    print(f"   -> 发现同名附件，正在删除: {filename}")
-                    jira.delete_attachment(attachment.id)
-                    break
-
-        print(f"   -> 正在上传新附件: {filename}...")
-        attachment = jira.add_attachment(issue=issue, attachment=file_path)
-        print(f"   -> ✅ 附件上传成功: {attachment.filename}")
-        return True
-
     except Exception as e:
-        print(f"   -> ❌ 上传附件到Jira时出错: {e}")
-        return False
-
-async def get_browser_session() -> Tuple[Page, BrowserContext, Browser]:
-    global _playwright_instance, _browser_instance, _context_instance, _app_page_instance
-
-    async def is_session_truly_connected() -> bool:
+        print(f"   -> ❌ 获取Jira issue时出错: {e}")
+        return {filename: False for _, filename in entries}
+    existing = {}
+    for attachment in issue.fields.attachment or []:
+        existing.setdefault(attachment.filename, []).append(attachment)
+    recorded_hashes = _load_attachment_hashes(issue) if replace_existing and existing else {}
+    uploaded_hashes = {}
+    deleted_ids = set()
+
+    def _upload(file_path: str, filename: str) -> bool:
         try:
-            # Check if all global instances are not None
-            if not all([_playwright_instance, _browser_instance, _context_instance, _app_page_instance]):
-                print("DEBUG: One or more global Playwright instances are None. Cannot reuse session.")
-                # Log which specific instance is None
-                if _playwright_instance is None: print("DEBUG: _playwright_instance is None")
-                if _browser_instance is None: print("DEBUG: _browser_instance is None")
-                if _context_instance is None: print("DEBUG: _context_instance is None")
-                if _app_page_instance is None: print("DEBUG: _app_page_instance is None")
+            if not os.path.exists(file_path):
+                print(f"   -> ❌ 错误: 文件不存在 - {file_path}")
                 return False
-
-            # Check if they are indeed Playwright objects and are connected
-            is_playwright_instance = isinstance(_playwright_instance, Playwright)
-            is_browser_instance = isinstance(_browser_instance, Browser)
-            is_context_instance = isinstance(_context_instance, BrowserContext)
-            is_page_instance = isinstance(_app_page_instance, Page)
-
-            browser_connected = False
-            page_connected = False
-            page_functional = False # New flag for page functionality
-
-            if is_browser_instance: 
-                try:
-                    browser_connected = _browser_instance.is_connected()
-                    print(f"DEBUG: _browser_instance.is_connected() returned: {browser_connected}")
-                except Exception as e:
-                    print(f"❌ Error calling _browser_instance.is_connected(): {e}")
-                    browser_connected = False
-            else:
-                print(f"DEBUG: _browser_instance is not a Browser instance (Type: {type(_browser_instance)}).")
-
-            if is_page_instance: 
-                try:
-                    # Removed direct call to _app_page_instance.is_connected() due to AttributeError
-                    # Relying on page_functional check below for actual page health
-                    page_connected = True # Assume connected if it's a Page instance
-
-                    # Additional check: Try a simple operation to ensure the page is functional
-                    try:
-                        await _app_page_instance.evaluate("1 + 1") # Simple JS evaluation to check functionality
-                        page_functional = True
-                        print("DEBUG: _app_page_instance is functional.")
-                    except Exception as e:
-                        print(f"❌ Error evaluating simple JS on _app_page_instance: {e}. Page not functional.")
-                        page_functional = False
-                except Exception as e:
-                    # This block now primarily catches errors from the evaluate call itself, not is_connected()
-                    print(f"❌ Error during page functionality check (evaluating 1+1): {e}")
-                    page_functional = False # Mark as not functional if any error occurs here
-            else:
-                print(f"DEBUG: _app_page_instance is not a Page instance (Type: {type(_app_page_instance)}). Marking as not functional.")
-                page_functional = False
-
-            if (is_playwright_instance and
-                is_browser_instance and
-                is_context_instance and
-                is_page_instance and
-                browser_connected and
-                page_functional): # Rely solely on page_functional for page's validity
-                print("DEBUG: All Playwright instances are valid and connected.")
+            previous = existing.get(filename, []) if replace_existing else []
+            sha256 = file_sha256(Path(file_path))
+            if any(_same_content(attachment, file_path, sha256, recorded_hashes) for attachment in previous):
+                print(f"   -> ⏭️ 附件内容未变化，跳过上传: {filename}")
                 return True
-            else:
-                print("DEBUG: Playwright instances are not of expected types or reported as not connected (Detail above). Force re-initialization.")
-                return False
+            print(f"   -> 正在上传新附件: {filename}...")
+            attachment = jira.add_attachment(issue=issue, attachment=file_path, filename=filename)
+            print(f"   -> ✅ 附件上传成功: {attachment.filename}")
+            uploaded_hashes[str(attachment.id)] = sha256
+            for old in previous:
+                print(f"   -> 删除旧的同名附件: {filename} (ID: {old.id})")
+                jira.delete_attachment(old.id)
+                deleted_ids.add(str(old.id))
+            return True
         except Exception as e:
-            # Catch any exception during the connection check, including AttributeError
-            print(f"❌ Error during browser session validation (is_session_truly_connected): {e}")
+            print(f"   -> ❌ 上传附件 {filename} 到Jira时出错: {e}")
             return False
 
-    if await is_session_truly_connected():
-        print("💡 Reusing existing browser session.")
-        return _app_page_instance, _context_instance, _browser_instance
-    else:
-        print("⚠️ Existing browser session is invalid or not fully connected, re-initializing.")
-        # Ensure full cleanup before re-initialization
-        await close_browser_session()
-
-    # Re-initialization logic
-    # 尝试从保存的状态加载，而不是重新登录
-    if SESSION_STATE_PATH.exists():
-        print("Attempting to load browser session from saved state...")
+    with ThreadPoolExecutor(max_workers=max(1, min(len(entries), JIRA_UPLOAD_CONCURRENCY))) as executor:
+        results = map_in_context(executor, lambda entry: _upload(*entry), entries)
+    if uploaded_hashes:
+        hashes = {attachment_id: sha256 for attachment_id, sha256 in recorded_hashes.items()
+                  if attachment_id not in deleted_ids}
+        hashes.update(uploaded_hashes)
         try:
-            _playwright_instance = await async_playwright().start()
-            _browser_instance = await _playwright_instance.chromium.launch(headless=False)
-            _context_instance = await _browser_instance.new_context(storage_state=SESSION_STATE_PATH)
-            _app_page_instance = await _context_instance.new_page()
-            
-            # NEW: Navigate to the expected application URL to ensure the page is active and ready
-            veeva_initial_logged_in_page_url = 'https://pegasus-prod.veevasfa.com/environment/list'
-            print(f"DEBUG: Navigating to {veeva_initial_logged_in_page_url} after loading session state.")
-            await _app_page_instance.goto(veeva_initial_logged_in_page_url, timeout=60000)
-            await _app_page_instance.wait_for_load_state('networkidle', timeout=60000)
-            
-            # After loading, immediately validate the session
-            if await is_session_truly_connected(): # Re-validate loaded session
-                print("✅ Browser session loaded from saved state and validated.")
-                return _app_page_instance, _context_instance, _browser_instance
-            else:
-                print("❌ Loaded browser session is invalid or not functional, falling back to full login.")
-                await close_browser_session() # Clean up invalid loaded session
-                # Fall through to full login
+            jira.add_issue_property(issue.key, ATTACHMENT_HASH_PROPERTY, hashes)
         except Exception as e:
-            print(f"❌ Failed to load browser session from saved state: {e}. Falling back to full login.")
-            # Clean up potentially partially initialized instances
-            await close_browser_session()
-            # Do not re-raise here, let it fall through to full login
+            print(f"   -> ⚠️ 记录附件哈希失败，下次将重新上传: {e}")
+    return {filename: result for (_, filename), result in zip(entries, results)}
 
+def add_attachment(issue_key: str, file_path: str, replace_existing: bool = True, filename: Optional[str] = None) -> bool:
+    """
+    为指定的Jira issue添加附件。
+
+    Args:
+        issue_key (str): Jira issue的key，例如 'ORI-120579'
+        file_path (str): 要上传的文件路径
+        replace_existing (bool): 如果存在同名附件是否替换，默认True
+        filename (str): 附件在Jira上显示的文件名，默认使用file_path的文件名
+
+    Returns:
+        bool: 上传成功返回True，失败返回False
+    """
+    results = add_attachments(issue_key, [(file_path, filename)], replace_existing=replace_existing)
+    return all(results.values())
+
+async def _relogin_for_pool(browser: Browser):
+    """
+    (内部辅助函数) 上下文池发现会话状态缺失或失效时调用：在池自己的浏览器中用一个临时上下文完整登录一次，
+    保存会话状态后关闭该上下文，不再另外启动一个全局浏览器。
+    """
     username = os.getenv("VEEVA_USERNAME")
     password = os.getenv("VEEVA_PASSWORD")
-    okta_push = os.getenv("OKTA_PUSH")
-
     if not username or not password:
         raise ValueError("错误：VEEVA_USERNAME 或 VEEVA_PASSWORD 环境变量未设置。")
-
-    print("🚀 Initializing new browser session and logging in...")
+    if SESSION_STATE_PATH.exists():
+        SESSION_STATE_PATH.unlink()
+    _, context, _ = await _login_pegasus(None, os.getenv("OKTA_PUSH"), username, password, browser=browser)
     try:
-        _playwright_instance = await async_playwright().start()
-        _app_page_instance, _context_instance, _browser_instance = await _login_pegasus(_playwright_instance, okta_push, username, password)
-        
-        # 在成功登录后保存会话状态
-        await _context_instance.storage_state(path=SESSION_STATE_PATH)
-        print(f"✅ New browser session initialized and logged in. Session state saved to {SESSION_STATE_PATH}.")
-        
-        return _app_page_instance, _context_instance, _browser_instance
-    except Exception as e:
-        print(f"❌ Failed to initialize new browser session or login: {e}")
-        # Ensure cleanup if login fails
-        await close_browser_session() # This is critical to reset globals on failed login
-        raise # Re-raise the exception after cleanup
+        await context.storage_state(path=SESSION_STATE_PATH)
+        print(f"✅ 上下文池已重新登录，会话状态已保存到 {SESSION_STATE_PATH}。")
+    finally:
+        await context.close()
+
+def get_browser_pool() -> BrowserContextPool:
+    global _browser_pool
+    if _browser_pool is None:
+        _browser_pool = BrowserContextPool(SESSION_STATE_PATH, relogin=_relogin_for_pool)
+    return _browser_pool
+
+async def close_browser_pool():
+    global _browser_pool
+    if _browser_pool is not None:
+        await _browser_pool.close()
+        _browser_pool = None
 
 async def close_browser_session():
-    global _playwright_instance, _browser_instance, _context_instance, _app_page_instance
-    print("🚪 Closing browser session...")
-    try:
-        if _browser_instance and _browser_instance.is_connected():
-            print("   -> Browser is connected, closing.")
-            await _browser_instance.close()
-        elif _browser_instance:
-            print("   -> Browser instance exists but not connected, no explicit close needed.")
-        if _playwright_instance:
-            print("   -> Stopping Playwright instance.")
-            await _playwright_instance.stop()
-    except Exception as e:
-        print(f"❌ Error during browser session close: {e}")
-    finally:
-        # Always ensure global instances are nulled out
-        _playwright_instance = None
-        _browser_instance = None
-        _context_instance = None
-        _app_page_instance = None
-        print("🚪 Browser session globals cleared.")
+    """
+    关闭浏览器会话。浏览器和登录状态都由上下文池持有，关闭池即可。
+    """
+    await close_browser_pool()
 
 # --- 模块 1: 核心业务逻辑 ---
-async def _login_pegasus(p: Playwright, okta_push: str, username: str, password: str):
+async def _login_pegasus(p: Optional[Playwright], okta_push: str, username: str, password: str,
+                         browser: Optional[Browser] = None):
+    """
+    传入 browser 时在该浏览器中新建上下文登录（登录失败只关闭该上下文），否则用 p 启动一个新的浏览器。
+    """
     if okta_push and okta_push.lower() == 'true':
-       return await _login_and_get_app_page(p,username,password)
+       return await _login_and_get_app_page(p,username,password,browser=browser)
     else:
-        return await _login_and_get_app_page_no_okta_push(p,username,password)
+        return await _login_and_get_app_page_no_okta_push(p,username,password,browser=browser)
 
 
-async def _login_and_get_app_page_no_okta_push(p: Playwright, username: str, password: str) -> Tuple[Page, BrowserContext, Browser]:
+async def _login_and_get_app_page_no_okta_push(p: Optional[Playwright], username: str, password: str,
+                                               browser: Optional[Browser] = None) -> Tuple[Page, BrowserContext, Browser]:
     """
     使用 Playwright 登录 Veeva 系统并返回页面、上下文和浏览器实例。
     此函数处理通过 Okta 的登录流程，并假定用户名已预先填充或由 SSO 处理。
@@ -261,9 +220,12 @@ async def _login_and_get_app_page_no_okta_push(p: Playwright, username: str, pas
     Returns: 一个元组，包含成功登录后的 Page, BrowserContext, 和 Browser 对象。
     """
     print("🚀 开始登录流程...")
-    # 以非无头模式启动浏览器，便于调试
-    browser = await p.chromium.launch(headless=False, timeout=60000)
+    owns_browser = browser is None
+    if owns_browser:
+        # 是否无头由 BROWSER_HEADLESS 控制，本地调试时可关闭无头模式
+        browser = await p.chromium.launch(**get_launch_options(timeout=60000))
     context: BrowserContext = await browser.new_context()
+    await apply_request_blocking(context)
     app_page: Page = await context.new_page()
 
     veeva_initial_login_url = 'https://pegasus-prod.veevasfa.com/login'
@@ -310,19 +272,36 @@ async def _login_and_get_app_page_no_okta_push(p: Playwright, username: str, pas
         screenshot_path = "playwright_login_error.png"
         await app_page.screenshot(path=screenshot_path)
         print(f"已保存错误截图至: {screenshot_path}")
-        # 关闭浏览器以释放资源
-        await browser.close()
+        # 关闭浏览器（使用传入的浏览器时只关闭登录用的上下文）以释放资源
+        if owns_browser:
+            await browser.close()
+        else:
+            await context.close()
         # 重新抛出异常，以便上层调用者知道登录失败
         raise
 
 
-async def _login_and_get_app_page(p: Playwright, username: str, password: str) -> tuple[Page, BrowserContext, Browser]:
+async def _login_and_get_app_page(p: Optional[Playwright], username: str, password: str,
+                                  browser: Optional[Browser] = None) -> tuple[Page, BrowserContext, Browser]:
     """
     (内部辅助函数) 封装了完整的Web登录流程，并返回成功登录后的应用程序页面对象。
     """
     print("🚀 开始登录流程...")
-    browser = await p.chromium.launch(headless=False, timeout=60000)
+    owns_browser = browser is None
+    if owns_browser:
+        browser = await p.chromium.launch(**get_launch_options(timeout=60000))
     context: BrowserContext = await browser.new_context()
+    try:
+        return await _okta_push_login(context, username, password), context, browser
+    except Exception:
+        # 使用传入的浏览器时，登录失败要关闭登录用的上下文
+        if not owns_browser:
+            await context.close()
+        raise
+
+
+async def _okta_push_login(context: BrowserContext, username: str, password: str) -> Page:
+    await apply_request_blocking(context)
     page: Page = await context.new_page()
 
     login_url = "https://veevasys.okta.com/"
@@ -350,34 +329,47 @@ async def _login_and_get_app_page(p: Playwright, username: str, password: str) -
     print(f"✅ 登录成功! 当前页面 URL: {app_page.url}")
     await app_page.wait_for_load_state("networkidle", timeout=60000)
 
-    return app_page, context, browser
+    return app_page
 
 # --- 模块 1.2: SQL 和表单逻辑 ---
-def _load_all_schemas(file_path: str = "schemas.json") -> dict:
+# 解析后的 Schema 目录（列、类型、外键、关联图），schemas.json 修改后自动重新加载
+schema_catalog = SchemaCatalog()
+ALL_SCHEMAS = schema_catalog.raw
+# schema 内容的指纹，schema 变化后 SQL 缓存自动失效
+SCHEMA_VERSION = schema_catalog.version
+# 启动时建立一次的本地表索引，用于在不调用 LLM 的情况下选表
+_table_selector = TableSelector(ALL_SCHEMAS)
+# 提交前的本地 SQL 校验（内存 SQLite 试运行），未通过时把错误反馈给生成器重试
+sql_validator = SqlValidator(schema_catalog)
+SQL_VALIDATION_MAX_RETRIES = int(os.getenv("SQL_VALIDATION_MAX_RETRIES", "2"))
+
+def _refresh_schemas():
     """
-    (内部辅助函数) 从指定的JSON文件中加载所有表结构。
+    (内部辅助函数) schemas.json 变化时同步更新表索引和 schema 版本。
     """
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    absolute_file_path = os.path.join(script_dir, file_path)
-    
-    try:
-        with open(absolute_file_path, 'r', encoding='utf-8') as f:
-            schemas = json.load(f)
-            return schemas
-    except FileNotFoundError:
-        print(f"❌ 错误: Schema文件 '{absolute_file_path}' 未找到。")
-        return {}
-    except json.JSONDecodeError:
-        print(f"❌ 错误: Schema文件 '{absolute_file_path}' 不是一个有效的JSON格式。")
-        return {}
-
-ALL_SCHEMAS = _load_all_schemas()
+    global ALL_SCHEMAS, SCHEMA_VERSION, _table_selector
+    if schema_catalog.reload_if_changed():
+        ALL_SCHEMAS = schema_catalog.raw
+        SCHEMA_VERSION = schema_catalog.version
+        _table_selector = TableSelector(ALL_SCHEMAS)
 
-def _select_relevant_tables(natural_language_query: str) -> list[str]:
+async def _select_relevant_tables(natural_language_query: str) -> list[str]:
     """
-    (内部辅助函数) 使用LLM根据自然语言问题，从所有可用表中选择相关的表。
+    (内部辅助函数) 根据自然语言问题，从所有可用表中选择相关的表。
+    优先使用本地 BM25 索引，置信度不足时才调用LLM。
     """
     print("🤖 正在进行第一步: 选择相关表...")
+    selected_tables, confident = _table_selector.select(natural_language_query)
+    if confident:
+        print(f"✅ 第一步完成 (本地索引). 选择的表: {selected_tables}")
+        return selected_tables
+    print("ℹ️ 本地索引置信度不足，改用 LLM 选择相关表...")
+    return await _select_relevant_tables_with_llm(natural_language_query)
+
+async def _select_relevant_tables_with_llm(natural_language_query: str) -> list[str]:
+    """
+    (内部辅助函数) 使用LLM根据自然语言问题，从所有可用表中选择相关的表。
+    """
     table_selection_prompt = ChatPromptTemplate.from_messages([
         ("system", f"""
 # 角色和目标
@@ -399,10 +391,9 @@ def _select_relevant_tables(natural_language_query: str) -> list[str]:
         ("user", "{query}")
     ])
 
-    table_selection_llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0,
-                                                 google_api_key=os.getenv("GOOGLE_API_KEY"))
+    table_selection_llm = get_llm("gemini-2.5-flash", temperature=0)
     chain = table_selection_prompt | table_selection_llm | StrOutputParser()
-    response = chain.invoke({"query": natural_language_query})
+    response = await ainvoke_chain(chain, {"query": natural_language_query})
     selected_tables = [table.strip() for table in response.split(',') if table.strip() in ALL_SCHEMAS]
     if not selected_tables:
         print("⚠️ 未能识别出任何相关表，将默认使用所有表。")
@@ -410,13 +401,20 @@ def _select_relevant_tables(natural_language_query: str) -> list[str]:
     print(f"✅ 第一步完成. 选择的表: {selected_tables}")
     return selected_tables
 
-def generate_sql_query(natural_language_query: str) -> str:
+async def generate_sql_query(natural_language_query: str) -> str:
     """
     (内部函数) 根据用户提供的自然语言问题，动态选择相关表结构，然后生成精确的SQL查询语句。
     """
     print(f"🤖 调用SQL生成流程，自然语言问题: '{natural_language_query}'")
-    relevant_tables = _select_relevant_tables(natural_language_query)
-    dynamic_schema_prompt_part = "\n".join([ALL_SCHEMAS[table] for table in relevant_tables])
+    _refresh_schemas()
+    cached = sql_cache.get(natural_language_query, SCHEMA_VERSION)
+    if cached:
+        print(f"⚡ 命中SQL缓存 ({cached['tier']}, 相似度 {cached['score']:.2f}, 原问题: '{cached['query']}')")
+        return cached['sql']
+    relevant_tables = await _select_relevant_tables(natural_language_query)
+    # 补充关联路径上的中间表，渲染紧凑的 schema 片段（按表集合缓存）
+    relevant_tables = schema_catalog.expand_with_join_path(relevant_tables)
+    dynamic_schema_prompt_part = schema_catalog.render_prompt(relevant_tables)
     print(f"📋 正在为SQL生成构建动态Schema:\n---\n{dynamic_schema_prompt_part}\n---")
 
     # --- Start of Updated Prompt ---
@@ -461,14 +459,28 @@ def generate_sql_query(natural_language_query: str) -> str:
     ])
     # --- End of Updated Prompt ---
 
-    sql_llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
+    sql_llm = get_llm("gemini-2.5-flash", temperature=0)
     chain = sql_generation_prompt | sql_llm | StrOutputParser()
-    generated_sql = chain.invoke({"schema": dynamic_schema_prompt_part, "query": natural_language_query})
-    cleaned_sql = re.sub(r"```sql\n|```", "", generated_sql).strip()
-    if "SELECT" not in cleaned_sql.upper():
-         print(f"❌ SQL生成失败，返回的不是有效的查询语句。")
-         return f"错误: 未能生成有效的SQL查询。LLM返回: {cleaned_sql}"
+    query_with_feedback = natural_language_query
+    for attempt in range(SQL_VALIDATION_MAX_RETRIES + 1):
+        generated_sql = await ainvoke_chain(chain, {"schema": dynamic_schema_prompt_part, "query": query_with_feedback})
+        cleaned_sql = re.sub(r"```sql\n|```", "", generated_sql).strip()
+        validation = sql_validator.validate(cleaned_sql)
+        if validation.ok:
+            break
+        print(f"⚠️ 生成的SQL未通过本地校验 (第 {attempt + 1} 次):\n{validation.feedback()}")
+        query_with_feedback = (
+            f"{natural_language_query}\n\n"
+            f"上一次生成的SQL:\n{cleaned_sql}\n\n"
+            f"本地校验发现以下问题，请修正后重新生成:\n{validation.feedback()}"
+        )
+    else:
+        print(f"❌ SQL生成失败，{SQL_VALIDATION_MAX_RETRIES + 1} 次生成均未通过本地校验。")
+        return f"错误: 未能生成有效的SQL查询。LLM返回: {cleaned_sql}\n校验结果:\n{validation.feedback()}"
+    for warning in validation.warnings:
+        print(f"ℹ️ {warning}")
     print(f"✅ 内部SQL生成成功:\n---\n{cleaned_sql}\n---")
+    await sql_cache.aput(natural_language_query, SCHEMA_VERSION, cleaned_sql)
     return cleaned_sql
 
 async def fill_form_and_submit(page: Page, approver: str, jira_ticket: str, reason: str, sql_query: str, **kwargs) -> str:
@@ -505,46 +517,188 @@ async def fill_form_and_submit(page: Page, approver: str, jira_ticket: str, reas
     return {"success": True, "message": "表单提交成功！"}
 
 # --- 模块 1.3: 下载和状态检查逻辑 ---
-async def download_file_from_veeva(url: str, headers: dict, output_filename: str) -> str:
+# 下载中断后的最大尝试次数（每次从已下载的位置用 Range 续传）
+DOWNLOAD_MAX_ATTEMPTS = int(os.getenv("DOWNLOAD_MAX_ATTEMPTS", "4"))
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+def _suggested_filename(response_headers, default_filename: str) -> str:
+    """
+    (内部辅助函数) 从 Content-Disposition 中取服务器建议的文件名，没有则使用默认文件名。
+    """
+    content_disposition = response_headers.get('Content-Disposition')
+    if content_disposition:
+        filename_match = re.search(r'filename\*?=(?:UTF-8\'\')?\"?([^\";]+)\"?', content_disposition)
+        if filename_match:
+            suggested_filename = unquote(filename_match.group(1).strip())
+            if suggested_filename:
+                return os.path.basename(suggested_filename)
+    return default_filename
+
+async def download_file_from_veeva(url: str, headers: dict, output_filename: str,
+                                   response_info: Optional[dict] = None, if_none_match: Optional[str] = None) -> str:
+    """
+    (内部辅助函数) 使用共享的 httpx 客户端流式下载文件, 成功后返回最终文件名。
+    数据边下载边写入 .part 临时文件，完成后原子重命名；连接中断时用 Range 请求从断点续传。
+    response_info 不为 None 时会写入服务器返回的 etag。
+    传入 if_none_match（本地缓存的 ETag）时发送条件请求，服务器返回 304 时不下载，
+    response_info['not_modified'] 为 True。
+    """
+    print(f"\n--- 正在使用 httpx 库流式下载文件：{url} ---")
+    client = get_http_client()
+    part_path = Path(f"{output_filename}.part")
+    etag = None
+    for attempt in range(1, DOWNLOAD_MAX_ATTEMPTS + 1):
+        request_headers = dict(headers)
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset:
+            request_headers['Range'] = f'bytes={offset}-'
+            if etag:
+                request_headers['If-Range'] = etag
+        elif if_none_match:
+            request_headers['If-None-Match'] = if_none_match
+        try:
+            async with client.stream('GET', url, headers=request_headers, follow_redirects=True,
+                                     timeout=httpx.Timeout(30.0, read=120.0)) as response:
+                if response.status_code == 304:
+                    if response_info is not None:
+                        response_info['not_modified'] = True
+                        response_info['etag'] = response.headers.get('ETag') or if_none_match
+                    print("✅ 服务器确认文件未变化 (304)，无需重新下载。")
+                    return output_filename
+                if response.status_code == 416:
+                    # 临时文件与服务器上的文件不一致，丢弃后重新下载
+                    part_path.unlink(missing_ok=True)
+                    continue
+                response.raise_for_status()
+                etag = response.headers.get('ETag') or etag
+                final_filename = _suggested_filename(response.headers, output_filename)
+                if final_filename != output_filename:
+                    print(f"ℹ️  根据服务器建议，文件将保存为: {final_filename}")
+                resuming = offset and response.status_code == 206
+                if offset and not resuming:
+                    print("ℹ️  服务器未返回部分内容，将从头重新下载。")
+                with open(part_path, 'ab' if resuming else 'wb') as f:
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+            os.replace(part_path, final_filename)
+            if response_info is not None:
+                response_info['etag'] = etag
+            print(f"✅ 文件 '{final_filename}' 下载成功！")
+            return final_filename
+        except httpx.HTTPStatusError as e:
+            part_path.unlink(missing_ok=True)
+            error_msg = f"❌ 文件下载失败: HTTP {e.response.status_code}"
+            print(error_msg)
+            return error_msg
+        except httpx.RequestError as e:
+            if attempt == DOWNLOAD_MAX_ATTEMPTS:
+                error_msg = f"❌ 文件下载失败: {e}"
+                print(error_msg)
+                return error_msg
+            downloaded = part_path.stat().st_size if part_path.exists() else 0
+            print(f"⚠️ 下载中断 ({e})，已下载 {downloaded} 字节，{2 ** attempt} 秒后续传 (第 {attempt} 次重试)...")
+            await asyncio.sleep(2 ** attempt)
+    part_path.unlink(missing_ok=True)
+    error_msg = f"❌ 文件下载失败: 超过最大重试次数 ({DOWNLOAD_MAX_ATTEMPTS})"
+    print(error_msg)
+    return error_msg
+
+def _is_ready_for_download(application_status: str, execution_status: str) -> bool:
+    return "executed" in application_status.lower() and "success" in execution_status.lower()
+
+async def _download_ready_report(jira_ticket: str, download_api_url: str, auth_headers: dict) -> str:
+    """
+    (内部辅助函数) 下载状态为 executed/success 的工单结果文件，并返回给用户的提示信息。
+    """
+    jira_match = re.search(r"ORI-\d+", jira_ticket)
+    file_jira_id = jira_match.group(0) if jira_match else jira_ticket
+
+    # 本地缓存中有同一下载地址的报告时，用保存的 ETag 发条件请求：服务器返回 304 才复用本地文件。
+    # 没有 ETag 时无法确认文件未变化，重新下载（内容相同时存储中只保留一份）
+    cached = report_store.get(file_jira_id)
+    if_none_match = cached.get('etag') if cached and cached.get('source_url') == download_api_url else None
+    response_info = {}
+    output_filename = await download_file_from_veeva(download_api_url, auth_headers, f'Veeva_Report_{file_jira_id}.xlsx',
+                                                     response_info=response_info, if_none_match=if_none_match)
+    if response_info.get('not_modified'):
+        print(f"💾 命中本地报告缓存: {cached['filename']}")
+        output_filename = cached['filename']
+    else:
+        if "失败" in output_filename or "Error" in output_filename:
+            return f"Jira {jira_ticket} 状态为 executed/success, 但下载失败: {output_filename}"
+        entry = report_store.put(file_jira_id, output_filename, etag=response_info.get('etag'), source_url=download_api_url)
+        # 下载后立即在后台生成列式副本，之后的分析不再解析 xlsx
+        columnar_cache.convert_in_background(entry['path'], key=entry['sha256'])
+    
+    return f"🎉 操作完成！Jira 工单 {jira_ticket} 的文件已成功下载为 '{output_filename}'。你可以通过新指令要求我分析这个文件。"
+
+async def _find_status_via_http(jira_ticket: str, auth_headers: dict) -> Optional[str]:
     """
-    (内部辅助函数) 使用httpx库下载文件, 成功后返回最终文件名。
+    (内部函数) 通过 Pegasus JSON 接口查询状态并在就绪时下载，不需要浏览器。
+    接口不可用、找不到工单或拿不到下载地址时返回 None，由调用方退回浏览器流程。
     """
-    print(f"\n--- 正在使用 httpx 库直接下载文件：{url} ---")
+    client = PegasusStatusClient(auth_headers)
+    if not client.available:
+        return None
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.get(url, headers=headers, follow_redirects=True)
-        response.raise_for_status()
-        if 'Content-Disposition' in response.headers:
-            content_disposition = response.headers['Content-Disposition']
-            filename_match = re.search(r'filename\*?=(?:UTF-8\'\')?\"?([^\";]+)\"?', content_disposition)
-            if filename_match:
-                suggested_filename_raw = filename_match.group(1).strip()
-                # httpx 不需要 requests.utils.unquote，可以直接使用
-                suggested_filename = suggested_filename_raw # httpx会自动处理url编码，这里不再需要requests.utils.unquote
-                if suggested_filename:
-                    output_filename = suggested_filename # Override if a suggested filename is found
-                    print(f"ℹ️  根据服务器建议，文件将保存为: {output_filename}")
-        with open(output_filename, 'wb') as f:
-            async for chunk in response.aiter_bytes():
-                f.write(chunk)
-        print(f"✅ 文件 '{output_filename}' 下载成功！")
-        return output_filename
-    except httpx.RequestError as e:
-        error_msg = f"❌ 文件下载失败: {e}"
-        print(error_msg)
-        return error_msg
+        status = await client.get_ticket_status(jira_ticket)
+    except Exception as e:
+        print(f"⚠️ 通过 HTTP 接口查询状态失败，将改用浏览器: {e}")
+        return None
+    if status is None or not status["application_status"]:
+        return None
+
+    application_status = status["application_status"]
+    execution_status = status["execution_status"] or "pagesus未执行，无执行状态"
+    print(f"⚡ 已通过 HTTP 接口获取状态 (申请状态: {application_status}, 执行状态: {execution_status})")
+    if not _is_ready_for_download(application_status, execution_status):
+        return _format_status_not_ready(jira_ticket, application_status, execution_status)
+    if not status["download_url"]:
+        return None
+    return await _download_ready_report(jira_ticket, status["download_url"], auth_headers)
+
+async def _learn_record_list_endpoint(responses: list, jira_ticket: str) -> Optional[dict]:
+    """
+    (内部辅助函数) 从"操作记录"页面加载时捕获的 XHR 响应中，找出返回该工单记录的 JSON 接口并保存，
+    之后的状态查询即可直接走 HTTP。返回匹配到的记录。
+    """
+    for response in responses:
+        try:
+            if response.request.resource_type not in ("xhr", "fetch"):
+                continue
+            if "json" not in response.headers.get("content-type", ""):
+                continue
+            record = find_record(find_record_list(await response.json()), jira_ticket)
+        except Exception:
+            continue
+        if record:
+            save_endpoints(record_list_url=response.url,
+                           record_list_method=response.request.method,
+                           record_list_body=response.request.post_data)
+            print(f"💡 已识别操作记录接口: {response.url}，后续状态查询将直接调用该接口。")
+            return record
+    return None
 
 async def _find_status_and_download_if_ready(page: Page, context: BrowserContext, jira_ticket: str, **kwargs) -> str:
     """
     (内部函数) 在"操作记录"页面整合了状态检查和文件下载的完整流程。
     """
     print("\n🔍 开始查询审批状态与执行下载流程...")
+    captured_responses = []
+
+    def _on_response(response):
+        captured_responses.append(response)
+
+    page.on("response", _on_response)
     try:
         await page.locator("li.el-menu-item", has_text="操作记录").click()
         await page.wait_for_load_state('networkidle', timeout=60000)
         print(f"✅ 已导航到操作记录页面: {page.url}")
     except Exception as e:
         return f"❌ 导航到'操作记录'页面失败: {e}."
+    finally:
+        page.remove_listener("response", _on_response)
+    learned_record = await _learn_record_list_endpoint(captured_responses, jira_ticket)
     
     print(f"📄 正在操作记录中定位 Jira: {jira_ticket}...")
     item_container_base_selector = 'div.el-card.is-always-shadow.custom-card'
@@ -573,10 +727,15 @@ async def _find_status_and_download_if_ready(page: Page, context: BrowserContext
         print(f"❗️ 解析状态时出错: {e}")
         return f"✅ 找到了Jira工单 {jira_ticket} 的卡片，但无法确定其完整状态。"
 
-    if "executed" in application_status.lower() and "success" in execution_status.lower():
+    if learned_record:
+        status_keys = learn_status_keys(learned_record, application_status, execution_status)
+        if status_keys:
+            save_endpoints(**status_keys)
+
+    if _is_ready_for_download(application_status, execution_status):
         print(f"✅ 条件满足 (申请状态: {application_status}, 执行状态: {execution_status})。继续执行下载流程...")
     else:
-        return f"✅ 查询成功！Jira 工单 {jira_ticket} 的申请状态是: '{application_status}', 执行状态是: '{execution_status}' (不满足下载条件)。"
+        return _format_status_not_ready(jira_ticket, application_status, execution_status)
     
     try:
         detail_button_locator = specific_item_container_locator.locator('button.el-button.is-circle.el-tooltip__trigger')
@@ -587,52 +746,169 @@ async def _find_status_and_download_if_ready(page: Page, context: BrowserContext
         relative_download_url = await download_link_locator.get_attribute('href')
         if not relative_download_url:
             return "❌ 找到了下载链接，但无法获取其地址(href)。"
+        if learned_record:
+            template = learn_download_template(learned_record, relative_download_url)
+            if template:
+                save_endpoints(download_url_template=template)
         
         download_api_url = urljoin(page.url, relative_download_url)
-        cookies_list = await context.cookies()
-        cookie_string = "; ".join([f"{c['name']}={c['value']}" for c in cookies_list])
         user_agent = await page.evaluate('navigator.userAgent')
-        auth_headers = {'User-Agent': user_agent, 'Cookie': cookie_string}
-        
-        jira_match = re.search(r"ORI-\d+", jira_ticket)
-        file_jira_id = jira_match.group(0) if jira_match else jira_ticket
-        
-        output_filename = await download_file_from_veeva(download_api_url, auth_headers, f'Veeva_Report_{file_jira_id}.xlsx')
-        
-        if "失败" in output_filename or "Error" in output_filename:
-            return f"Jira {jira_ticket} 状态为 executed/success, 但下载失败: {output_filename}"
+        auth_headers = build_auth_headers(await context.cookies(), user_agent)
         
-        return f"🎉 操作完成！Jira 工单 {jira_ticket} 的文件已成功下载为 '{output_filename}'。你可以通过新指令要求我分析这个文件。"
+        return await _download_ready_report(jira_ticket, download_api_url, auth_headers)
     
     except Exception as e:
         return f"❌ 在点击详情或下载过程中发生错误: {e}"
 
+async def _check_status_and_download(jira_ticket: str) -> str:
+    """
+    (内部协调器) 查询工单状态并在就绪时下载。优先只用保存的登录 cookie 调用 HTTP 接口，
+    接口不可用或信息不全时才借用浏览器上下文走"操作记录"页面。
+    """
+    cookies = load_storage_state_cookies(SESSION_STATE_PATH)
+    if cookies and not cookies_expired(cookies):
+        result = await _find_status_via_http(jira_ticket, build_auth_headers(cookies))
+        if result is not None:
+            return result
+    return await _perform_browser_action(_find_status_and_download_if_ready, jira_ticket=jira_ticket)
+
+
+# 一次 DOM 求值解析"操作记录"页面上的全部卡片
+_PARSE_OPERATION_CARDS_JS = """
+(selector) => Array.from(document.querySelectorAll(selector)).map((card, index) => {
+    const texts = Array.from(card.querySelectorAll('span.custom-text')).map(s => s.innerText.trim());
+    const find = (prefix) => texts.find(t => t.includes(prefix)) || '';
+    return {
+        index: index,
+        jira_text: find('相关Jira:'),
+        application_status: find('申请状态:'),
+        execution_status: find('执行状态:'),
+    };
+})
+"""
 
-def _get_prompt_detail_by_user_requirement(user_requirement: str) -> str:
-    count_prompt = """
-2.  **判断统计方式**：检查该工作表的数据表头中是否存在包含 "count" 关键字的列（例如 `count(*)`）。
-3.  **执行数据统计**：
-    * **如果存在 "count" 列**：请从该列的第一行提取其数值，并将此数值作为该客户的最终"数据量"。
-    * **如果不存在 "count" 列**：请计算该工作表数据内容的总行数，并将此行数作为该客户的最终"数据量"。
-4.  **处理异常情况**：如果在处理任何工作表时遇到错误，或者无法按上述规则提取有效数据，则该客户的"数据量"计为 0。
+def _format_status_not_ready(jira_ticket: str, application_status: str, execution_status: str) -> str:
+    return f"✅ 查询成功！Jira 工单 {jira_ticket} 的申请状态是: '{application_status}', 执行状态是: '{execution_status}' (不满足下载条件)。"
 
-## 输出要求
-1.  **生成单一表格**：将所有客户（即所有工作表）的分析结果汇总到一个最终的排名表格中。
-2.  **包含所有客户**：排名表格必须包含所有被分析的客户，**即使其"数据量"为 0**。
-3.  **降序排名**：所有客户需按照"数据量"从高到低进行排序。
-4.  **指定格式**：表格需包含以下三列，并严格按照此命名：
-    * 第一列："排名"
-    * 第二列："客户名称"
-    * 第三列："数据量"
-5. 只显示输出结果排名，不要输出程序代码。
-6. 将结果格式化为标准的 CSV 字符串。**不要**在 CSV 内容之外添加任何解释、标题、注释或 Markdown 代码块标记。
+async def _download_ready_reports(ready: dict, auth_headers: dict, results: dict):
+    """
+    (内部辅助函数) 并发下载多个就绪工单的结果文件。ready: {jira_ticket: download_url}
     """
+    semaphore = asyncio.Semaphore(int(os.getenv("BATCH_DOWNLOAD_CONCURRENCY", "4")))
 
-    prompt_detail = count_prompt
+    async def _download(jira_ticket: str, url: str):
+        async with semaphore:
+            results[jira_ticket] = await _download_ready_report(jira_ticket, url, auth_headers)
 
-    if user_requirement and '统计' in user_requirement:        
-        prompt_detail = count_prompt
-    return prompt_detail
+    await asyncio.gather(*[_download(ticket, url) for ticket, url in ready.items()])
+
+async def _find_statuses_via_http(jira_tickets: list, auth_headers: dict) -> dict:
+    """
+    (内部函数) 一次接口调用拿到所有工单的状态，并发下载就绪的文件。
+    返回已经得出结论的 {jira_ticket: 结果}，其余工单需要浏览器流程处理。
+    """
+    client = PegasusStatusClient(auth_headers)
+    if not client.available:
+        return {}
+    try:
+        records = await client.fetch_records()
+    except Exception as e:
+        print(f"⚠️ 通过 HTTP 接口批量查询状态失败，将改用浏览器: {e}")
+        return {}
+
+    results, ready = {}, {}
+    template = client.endpoints.get('download_url_template')
+    for jira_ticket in jira_tickets:
+        record = find_record(records, jira_ticket)
+        if record is None:
+            continue
+        statuses = extract_statuses(record, client.endpoints)
+        if statuses is None or not statuses[0]:
+            continue
+        application_status, execution_status = statuses
+        execution_status = execution_status or "pagesus未执行，无执行状态"
+        if not _is_ready_for_download(application_status, execution_status):
+            results[jira_ticket] = _format_status_not_ready(jira_ticket, application_status, execution_status)
+            continue
+        download_url = build_download_url(record, template)
+        if download_url:
+            ready[jira_ticket] = download_url
+    print(f"⚡ HTTP 接口已解析 {len(results) + len(ready)}/{len(jira_tickets)} 个工单的状态。")
+    await _download_ready_reports(ready, auth_headers, results)
+    return results
+
+async def _find_statuses_and_download_batch(page: Page, context: BrowserContext, jira_tickets: list, **kwargs) -> dict:
+    """
+    (内部函数) 只加载一次"操作记录"页面，用一次 DOM 求值解析所有卡片得到 工单→状态 映射，
+    再依次打开就绪工单的详情页读取下载地址，最后并发下载。返回 {jira_ticket: 结果}。
+    """
+    print(f"\n🔍 开始批量查询 {len(jira_tickets)} 个工单的审批状态...")
+    results = {}
+    try:
+        await page.locator("li.el-menu-item", has_text="操作记录").click()
+        await page.wait_for_load_state('networkidle', timeout=60000)
+    except Exception as e:
+        return {ticket: f"❌ 导航到'操作记录'页面失败: {e}." for ticket in jira_tickets}
+
+    item_container_base_selector = 'div.el-card.is-always-shadow.custom-card'
+    cards = await page.evaluate(_PARSE_OPERATION_CARDS_JS, item_container_base_selector)
+    print(f"✅ 已解析 {len(cards)} 张操作记录卡片。")
+
+    ready_cards = {}
+    for jira_ticket in jira_tickets:
+        pattern = re.compile(re.escape(jira_ticket) + r"(?!\d)")
+        card = next((c for c in cards if pattern.search(c["jira_text"])), None)
+        if card is None:
+            results[jira_ticket] = f"❌ 未能找到 Jira 工单 {jira_ticket} 对应的卡片。"
+            continue
+        application_status = card["application_status"]
+        execution_status = card["execution_status"] or "pagesus未执行，无执行状态"
+        if _is_ready_for_download(application_status, execution_status):
+            ready_cards[jira_ticket] = card["index"]
+        else:
+            results[jira_ticket] = _format_status_not_ready(jira_ticket, application_status, execution_status)
+
+    # 详情弹窗是页面级状态，只能逐个打开读取 href；真正耗时的下载在最后并发执行
+    ready = {}
+    card_locator = page.locator(item_container_base_selector)
+    for jira_ticket, index in ready_cards.items():
+        try:
+            detail_button_locator = card_locator.nth(index).locator('button.el-button.is-circle.el-tooltip__trigger')
+            await detail_button_locator.first.click(timeout=30000)
+            detail_title_locator = page.locator('b.el-text--large:has-text("操作申请详情页")')
+            await detail_title_locator.wait_for(state='visible', timeout=60000)
+            relative_download_url = await page.locator('a.el-link:has-text("点击下载到Excel")').first.get_attribute('href')
+            await page.keyboard.press("Escape")
+            await detail_title_locator.wait_for(state='hidden', timeout=10000)
+            if relative_download_url:
+                ready[jira_ticket] = urljoin(page.url, relative_download_url)
+            else:
+                results[jira_ticket] = "❌ 找到了下载链接，但无法获取其地址(href)。"
+        except Exception as e:
+            results[jira_ticket] = f"❌ 在点击详情或下载过程中发生错误: {e}"
+
+    user_agent = await page.evaluate('navigator.userAgent')
+    auth_headers = build_auth_headers(await context.cookies(), user_agent)
+    await _download_ready_reports(ready, auth_headers, results)
+    return results
+
+async def _check_statuses_and_download_batch(jira_tickets: list) -> dict:
+    """
+    (内部协调器) 批量查询工单状态并下载就绪的文件。先用 HTTP 接口一次性处理，剩余的工单再用一次浏览器流程处理。
+    """
+    jira_tickets = list(dict.fromkeys(t.strip() for t in jira_tickets if t and t.strip()))
+    results = {}
+    cookies = load_storage_state_cookies(SESSION_STATE_PATH)
+    if cookies and not cookies_expired(cookies):
+        results.update(await _find_statuses_via_http(jira_tickets, build_auth_headers(cookies)))
+    remaining = [t for t in jira_tickets if t not in results]
+    if remaining:
+        browser_results = await _perform_browser_action(_find_statuses_and_download_batch, jira_tickets=remaining)
+        if isinstance(browser_results, str):
+            # _perform_browser_action 出错时返回错误字符串
+            browser_results = {ticket: browser_results for ticket in remaining}
+        results.update(browser_results)
+    return {ticket: results[ticket] for ticket in jira_tickets}
 
 
 def generate_report_from_data(data_string, chart_filename):
@@ -641,6 +917,8 @@ def generate_report_from_data(data_string, chart_filename):
 
     Args:
         data_string (str): 包含客户数据的多行字符串。
+    Returns:
+        生成的图表文件路径，没有可绘制的数据时返回 None。
     """
     # --- 1. 读取数据并创建DataFrame ---
     # 使用io.StringIO将字符串模拟成一个文件
@@ -662,112 +940,125 @@ def generate_report_from_data(data_string, chart_filename):
     # 如果没有数据可供绘图，则退出
     if df_to_plot.empty:
         print("没有数据量大于0的客户，无法生成图表。")
-        return
+        return None
 
     # 对数据进行排序，确保柱状图从高到低显示
     df_to_plot.sort_values(by='数据量', ascending=False, inplace=True)
         
     # --- 4. 生成柱状图 ---
-    # 设置matplotlib以正确显示中文
-    plt.rcParams['font.sans-serif'] = ['STHeiti']  # 'SimHei' 是一个常用的支持中文的字体
-    plt.rcParams['axes.unicode_minus'] = False  # 修正负号显示问题
-    
-    # 创建图表
-    plt.figure(figsize=(12, 7)) # 设置画布大小
-    bars = plt.bar(df_to_plot['客户名称'], df_to_plot['数据量'], color='skyblue')
-    
-    # 在柱子顶端添加数据标签
-    for bar in bars:
-        yval = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width()/2.0, yval, int(yval), va='bottom', ha='center', fontsize=10)
-    
-    # 设置图表标题和坐标轴标签
-    plt.title('客户数据量对比分析', fontsize=16)
-    plt.xlabel('客户名称', fontsize=12)
-    plt.ylabel('数据量', fontsize=12)
-    
-    # 旋转X轴标签以防重叠
-    plt.xticks(rotation=45, ha='right')
-    
-    # 添加网格线
-    plt.grid(axis='y', linestyle='--', alpha=0.6)
-    
-    # 自动调整布局，防止标签被截断
-    plt.tight_layout()
-    
-    # --- 5. 保存图表到文件 ---
-    # chart_filename = 'customer_volume_chart.png'
-    plt.savefig(chart_filename)
-    print(f"柱状图已保存到文件: {chart_filename}")
+    # 在独立的渲染进程中绘制，输出格式由 CHART_OUTPUT_FORMAT 决定（png/svg/json）
+    chart_path = render_bar_chart(
+        df_to_plot['客户名称'].astype(str).tolist(),
+        df_to_plot['数据量'].astype(int).tolist(),
+        chart_filename,
+        title='客户数据量对比分析',
+        xlabel='客户名称',
+        ylabel='数据量',
+    )
+    print(f"柱状图已保存到文件: {chart_path}")
+    return chart_path
 
 
 # --- 模块 1.4: 数据分析逻辑 ---
-def _analyze_excel_file_with_gemini(excel_path: str, jira_ticket: str, user_requirement: str) -> str:
+# 本地排名只能回答"各客户数据量排名"这一类问题；"统计每个客户的平均拜访时长"之类的统计需求仍交给 Gemini
+_RANKING_KEYWORDS = ('数据量', '排名', '排行', '记录数', '条数')
+_GENERIC_COUNT_REQUIREMENT = re.compile(r"(统计|统计结果|统计一下|统计数据)?")
+
+def _is_count_requirement(user_requirement: str) -> bool:
    """
-   (内部辅助函数) 读取Excel文件，调用Gemini分析，然后将源文件和分析报告上传到Jira。
+   (内部辅助函数) 没有具体需求（默认的"统计结果"）或询问各客户数据量/排名的需求在本地计算，其余需求交给 Gemini 分析。
    """
-   print(f"\n--- 正在使用 Gemini API 分析数据: {excel_path} ---")
-   if not excel_path or not os.path.exists(excel_path):
-       return f"❌ 错误: 分析失败，因为找不到文件: {excel_path}"
-  
-   try:
-       print(f"📖 正在读取Excel文件: {excel_path}")
-       all_sheets_dict = pd.read_excel(excel_path, sheet_name=None)
-       json_compatible_dict = {}
-      
-       for sheet_name, df in all_sheets_dict.items():
-           if df.empty:
-               json_compatible_dict[sheet_name] = {'columns': [], 'index': [], 'data': []}
-           else:
-               json_compatible_dict[sheet_name] = json.loads(df.to_json(orient='split'))
-      
-       data_string = json.dumps(json_compatible_dict, indent=2, ensure_ascii=False)
-       print("✅ 数据已成功转换为JSON格式。")
-
+   requirement = re.sub(r"[\s。，,.!！?？]", "", user_requirement or "")
+   return bool(_GENERIC_COUNT_REQUIREMENT.fullmatch(requirement)) or any(k in requirement for k in _RANKING_KEYWORDS)
 
-       prompt_detail = _get_prompt_detail_by_user_requirement(user_requirement)
 
-
-       llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
-       prompt = ChatPromptTemplate.from_messages([
-           ("system", """
+def _summarize_ranking_with_gemini(ranking_csv: str, user_requirement: str) -> str:
+   """
+   (内部辅助函数) 根据已经计算好的排名表生成简短的文字摘要，只发送排名表而不是原始数据。
+   """
+   prompt = ChatPromptTemplate.from_messages([
+       ("system", """
 ## 任务目标
-你是一名资深数据分析师。你的任务是分析给定的数据，并提供简洁、专业的摘要报告。
-你将收到一个 **JSON 格式的字符串**。这个 JSON 对象中，**每个键（key）代表一个客户（即工作表名称）**，其对应的值（value）是该客户的表格数据，该数据本身也是一个 JSON 对象，通常包含了 "columns" (列名) 和 "data" (数据行) 这两个键。
-你的任务是解析这个顶层 JSON 对象，遍历其中的每一个客户，并生成一个统一的客户数据分析结果。
+你是一名资深数据分析师。下面是已经计算好的客户数据量排名（CSV 格式，列为 排名/客户名称/数据量）。
+请用不超过 5 句话给出简洁、专业的中文摘要，例如数据量最高的客户、数据是否集中在少数客户、哪些客户数据量为 0。
+**不要**重新计算或修改任何数值，不要输出表格或代码。
+"""),
+       ("human", "分析需求: {requirement}\n\n排名数据:\n---\n{ranking}\n---")
+   ])
+   chain = prompt | get_llm("gemini-2.5-flash") | StrOutputParser()
+   return invoke_chain(chain, {"requirement": user_requirement, "ranking": ranking_csv}).strip()
 
 
-## 核心分析逻辑与规则
-你需要**遍历顶层 JSON 对象的每一个键值对（即每一个客户）**，并对每个客户的数据执行以下操作：
-1.  **读取工作表**：JSON 对象的键本身就是"客户名称"，并加载其数据内容。
-{dynamic_prompt}
-"""),
-           ("human", "你好，请帮我分析以下业务数据。\n\n数据如下:\n---\n{data_as_string}\n---\n\n")
-       ])
-      
-       chain = prompt | llm | StrOutputParser()
-       print("🤖 正在将数据发送给 Gemini 进行分析...")
-       analysis_result = chain.invoke({"dynamic_prompt": prompt_detail, "data_as_string": data_string})
-       print("--- Gemini 分析结果 ---\n" + analysis_result + "\n------------------------")
-      
-       report_filename = f"Gemini分析报告_{os.path.basename(excel_path).replace('.xlsx', '.csv')}"
-       with open(report_filename, 'w', encoding='utf-8-sig') as f:
-           f.write(analysis_result)
-       print(f"✅ Gemini 分析结果已保存到 '{report_filename}'")
-      
-       image_filename = f"Gemini分析报告_{os.path.basename(excel_path).replace('.xlsx', '.png')}"
-       generate_report_from_data(analysis_result, image_filename)
+def _analyze_excel_file_with_gemini(excel_path: str, jira_ticket: Optional[str] = None, user_requirement: str = '统计结果') -> str:
+   """
+   (内部辅助函数) 读取Excel文件并按需求分析，生成报告，提供 jira_ticket 时将源文件和分析报告上传到Jira。
+   数据量/排名类需求在本地统计各客户的数据量排名并生成图表，Gemini 只用于可选的文字摘要；
+   其余需求把数据交给 Gemini 分析（数据量超出单次上限时 map-reduce）。
+   """
+   print(f"\n--- 正在分析数据: {excel_path} ---")
+   # 下载的报告保存在本地报告缓存中，这里把文件名解析为实际路径；报告/图表/附件仍使用原文件名
+   source_filename = os.path.basename(excel_path) if excel_path else ""
+   if excel_path:
+       excel_path = str(report_store.resolve_path(excel_path))
+   if not excel_path or not os.path.exists(excel_path):
+       return f"❌ 错误: 分析失败，因为找不到文件: {excel_path}"
+  
+   try:
+       if _is_count_requirement(user_requirement):
+           print(f"📖 正在统计Excel文件: {excel_path}")
+           ranking = compute_customer_ranking_from_workbook(excel_path)
+           analysis_result = ranking_to_csv(ranking)
+           print("--- 统计结果 ---\n" + analysis_result + "\n------------------------")
+
+           narrative = ""
+           if ANALYSIS_NARRATIVE_SUMMARY:
+               print("🤖 正在请求 Gemini 生成文字摘要...")
+               try:
+                   narrative = _summarize_ranking_with_gemini(analysis_result, user_requirement)
+               except Exception as e:
+                   print(f"⚠️ 生成文字摘要失败，只返回统计结果: {e}")
+
+           report_filename = f"Gemini分析报告_{source_filename.replace('.xlsx', '.csv')}"
+           with open(report_filename, 'w', encoding='utf-8-sig') as f:
+               f.write(analysis_result)
+           print(f"✅ 分析结果已保存到 '{report_filename}'")
+
+           image_filename = f"Gemini分析报告_{source_filename.replace('.xlsx', '.png')}"
+           image_filename = generate_report_from_data(analysis_result, image_filename)
+       else:
+           # 自由分析需求需要 Gemini 阅读数据，数据量超出单次上限时自动 map-reduce
+           print(f"📖 正在读取Excel文件: {excel_path}")
+           all_sheets_dict = columnar_cache.load_sheets(excel_path)
+           if all_sheets_dict is None:
+               all_sheets_dict = pd.read_excel(excel_path, sheet_name=None)
+           analysis_result = analyze_with_llm(all_sheets_dict, user_requirement)
+           narrative = ""
+           print("--- Gemini 分析结果 ---\n" + analysis_result + "\n------------------------")
+
+           report_filename = f"Gemini分析报告_{source_filename.replace('.xlsx', '.md')}"
+           with open(report_filename, 'w', encoding='utf-8') as f:
+               f.write(analysis_result)
+           print(f"✅ Gemini 分析结果已保存到 '{report_filename}'")
+           image_filename = None
+
+       summary_text = f"\n\n{narrative}" if narrative else ""
+       if not jira_ticket:
+           return f"📊 分析完成！结果如下：\n\n{analysis_result}{summary_text}"
 
 
        # --- 新增: 上传到 Jira ---
        print(f"\n📎 开始将文件上传到 Jira 工单: {jira_ticket}")
-       source_uploaded = add_attachment(jira_ticket, excel_path)
-       report_uploaded = add_attachment(jira_ticket, report_filename)
-       image_uploaded = add_attachment(jira_ticket, image_filename)
+       artifacts = [(excel_path, source_filename), (report_filename, None)]
+       if image_filename:
+           artifacts.append((image_filename, None))
+       uploaded = add_attachments(jira_ticket, artifacts)
+       source_uploaded = uploaded.get(source_filename, False)
+       report_uploaded = uploaded.get(os.path.basename(report_filename), False)
+       image_uploaded = uploaded.get(os.path.basename(image_filename), False) if image_filename else None
       
        upload_summary = []
        if source_uploaded:
-           upload_summary.append(f"源数据文件 '{os.path.basename(excel_path)}'")
+           upload_summary.append(f"源数据文件 '{source_filename}'")
        else:
            upload_summary.append(f"源数据文件上传失败")
       
@@ -779,19 +1070,19 @@ def _analyze_excel_file_with_gemini(excel_path: str, jira_ticket: str, user_requ
 
        if image_uploaded:
            upload_summary.append(f"分析图表 '{image_filename}'")
-       else:
+       elif image_filename:
            upload_summary.append(f"分析图表上传失败")
 
 
        final_message = (
-           f"📊 分析完成！结果如下：\n\n{analysis_result}\n\n"
+           f"📊 分析完成！结果如下：\n\n{analysis_result}{summary_text}\n\n"
            f"Jira 上传状态: { ' 和 '.join(upload_summary) } 已上传至工单 {jira_ticket}。"
        )
        return final_message
 
 
    except Exception as e:
-       error_message = f"❌ 数据分析或API调用过程中发生错误: {e}"
+       error_message = f"❌ 数据分析过程中发生错误: {e}"
        print(error_message)
        return error_message
 
@@ -802,19 +1093,43 @@ def _analyze_excel_file_with_gemini(excel_path: str, jira_ticket: str, user_requ
 async def _perform_browser_action(action_callable: callable, **action_kwargs) -> str:
     """
     (内部协调器) 管理整个浏览器操作生命周期。
+    从上下文池中借出一个独立的已登录上下文执行操作，多个操作可以安全地并行运行。
+    配置了浏览器服务（BROWSER_SERVICE_ADDRESS）时，操作转发给浏览器服务进程执行。
     """
     result = ""
-    browser = None # This browser variable is local to this function and will be reassigned
+    client = get_browser_service_client()
+    if client is not None:
+        # 浏览器由独立的浏览器服务进程持有，转发过去执行
+        try:
+            return await client.browser_action(action_callable.__name__, **action_kwargs)
+        except Exception as e:
+            return f"😭 操作执行过程中发生严重错误: {e}"
+    pool = get_browser_pool()
+    try:
+        lease = await pool.checkout()
+    except Exception as e:
+        return f"😭 操作执行过程中发生严重错误: {e}"
+    healthy = False
     try:
-        # Get or create the shared browser session
-        app_page, context, browser = await get_browser_session()
-        result = await action_callable(page=app_page, context=context, browser=browser, **action_kwargs)
+        result = await action_callable(page=lease.page, context=lease.context, browser=pool.browser, **action_kwargs)
+        # 操作函数出错时返回错误文字而不是抛出异常，据此判断上下文是否需要重置
+        healthy = not _is_error_result(result)
     except Exception as e:
         return f"😭 操作执行过程中发生严重错误: {e}"
+    finally:
+        await pool.checkin(lease, healthy=healthy)
     # Do not close the browser here. It will be closed on application shutdown.
     
     return result
 
+def _is_error_result(result) -> bool:
+    """
+    (内部辅助函数) 浏览器操作的返回值是否表示失败：以 ❌ 开头或包含"错误"的文字；批量操作的结果全部失败时也算。
+    """
+    if isinstance(result, dict):
+        return bool(result) and all(_is_error_result(value) for value in result.values())
+    return isinstance(result, str) and (result.lstrip().startswith("❌") or "错误" in result)
+
 # --- 步骤 2: 定义 LangChain 工具 (已更新为中文) ---
 @tool
 async def process_data_request(jira_ticket: str, approver: str, data_query_description: str) -> str:
@@ -829,7 +1144,7 @@ async def process_data_request(jira_ticket: str, approver: str, data_query_descr
     """
     print("🚀 开始执行端到端数据【提交】流程...")
     print("\n[步骤 1/3] 正在生成SQL查询...")
-    sql_query = generate_sql_query(data_query_description)
+    sql_query = await generate_sql_query(data_query_description)
     if "错误:" in sql_query:
         return f"处理失败：无法生成SQL查询。内部错误: {sql_query}"
     
@@ -857,58 +1172,70 @@ async def check_jira_status_and_download(jira_ticket: str) -> str:
         jira_ticket (str): 要查询状态的Jira工单号。
     """
     print(f"🚀 开始执行Jira工单状态【查询和下载】流程，工单号: {jira_ticket}...")
-    result = await _perform_browser_action(
-        _find_status_and_download_if_ready,
-        jira_ticket=jira_ticket
-    )
+    result = await _check_status_and_download(jira_ticket)
     return result
 
 @tool
-async def analyze_report_file(file_path: str) -> str:
+async def check_jira_status_batch(jira_tickets: list[str]) -> str:
+    """
+    当用户一次性要求【查询多个】Jira工单的【审批状态】时，使用此工具，而不是逐个调用 check_jira_status_and_download。
+    它只加载一次操作记录并一次性解析所有工单的状态，对已执行成功的工单【并发自动下载】结果文件。
+    参数:
+        jira_tickets (list[str]): 要查询状态的Jira工单号列表。
+    """
+    print(f"🚀 开始执行批量工单状态【查询和下载】流程，工单数: {len(jira_tickets)}...")
+    results = await _check_statuses_and_download_batch(jira_tickets)
+    return "\n".join(f"- {ticket}: {message}" for ticket, message in results.items())
+
+@tool
+async def analyze_report_file(file_path: str, analysis_request: str = '统计结果') -> str:
     """
     使用此工具来【分析】一个已经通过 'check_jira_status_and_download' 工具下载到本地的数据报告文件。
     你需要提供要分析的文件的【完整文件名】或【路径】。
     参数:
         file_path (str): 本地数据文件的路径 (例如 'Veeva_Report_ORI-12345.xlsx')。
+        analysis_request (str, 可选): 用户的分析需求，默认统计各客户的数据量排名。
     """
     print(f"🚀 开始执行文件【分析】流程，文件: {file_path}...")
     # 将同步的分析操作放到单独的线程中执行，避免阻塞事件循环
-    result = await asyncio.to_thread(_analyze_excel_file_with_gemini, file_path, '统计结果')
+    result = await asyncio.to_thread(_analyze_excel_file_with_gemini, file_path, user_requirement=analysis_request)
     return result
 
 @tool
-def analyze_report_file_and_upload(file_path: str, jira_ticket: str) -> str:
+def analyze_report_file_and_upload(file_path: str, jira_ticket: str, analysis_request: str = '统计结果') -> str:
     """
     使用此工具来【分析】一个已下载的数据报告文件，并将【源文件和分析报告】上传到关联的Jira工单。
     你需要提供要分析的文件的【路径】和对应的【Jira工单号】。
     参数:
         file_path (str): 本地数据文件的路径 (例如 'Veeva_Report_ORI-12345.xlsx')。
         jira_ticket (str): 与此报告关联的Jira工单号 (例如 'ORI-12345')。
+        analysis_request (str, 可选): 用户的分析需求，默认统计各客户的数据量排名；用户提出其他分析要求时原样传入。
     """
     print(f"🚀 开始执行文件【分析与上传】流程，文件: {file_path}, Jira工单: {jira_ticket}...")
-    result = _analyze_excel_file_with_gemini(excel_path=file_path, jira_ticket=jira_ticket, user_requirement='统计结果')
+    result = _analyze_excel_file_with_gemini(excel_path=file_path, jira_ticket=jira_ticket, user_requirement=analysis_request)
     return result
 
 # --- 步骤 3: 设置并运行 Agent (已更新为中文) ---
 def main():
     """主执行函数，以交互式聊天机器人模式运行。"""
     load_dotenv()
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0, model_kwargs={"response_mime_type": "application/json"})
+    llm = get_llm("gemini-2.5-flash", temperature=0, model_kwargs={"response_mime_type": "application/json"})
     
-    tools = [process_data_request, check_jira_status_and_download, analyze_report_file_and_upload]
+    tools = [process_data_request, check_jira_status_and_download, check_jira_status_batch, analyze_report_file_and_upload]
 
     prompt = ChatPromptTemplate.from_messages(
         [
             ("system", """你是一个高效的助理。你的任务是根据用户的请求调用合适的工具来完成任务。
 
-你有三个可用的工具:
+你有四个可用的工具:
 1.  `process_data_request`: 用于【提交新的数据查询申请】。需要 `jira_ticket`, `approver`, 和 `data_query_description`。
 2.  `check_jira_status_and_download`: 用于【查询已提交工单的状态】并【自动下载】结果文件（如果准备就绪）。只需要 `jira_ticket`。下载成功后，务必告知用户文件名，并提醒他们可以请求分析。
-3.  `analyze_report_file_and_upload`: 用于【分析已下载的文件】并将结果【上传到Jira】。需要 `file_path` 和 `jira_ticket`。
+3.  `check_jira_status_batch`: 用于【一次查询多个工单的状态】并自动下载已就绪的结果文件。需要 `jira_tickets` 列表。
+4.  `analyze_report_file_and_upload`: 用于【分析已下载的文件】并将结果【上传到Jira】。需要 `file_path` 和 `jira_ticket`；用户提出了具体分析要求时通过 `analysis_request` 传入，默认统计各客户数据量排名。
 
 请仔细识别用户的意图：
 -   如果用户想【提交】或【发起】新请求 -> 使用 `process_data_request`。
--   如果用户想【查询状态】或【检查进度】 -> 使用 `check_jira_status_and_download`。
+-   如果用户想【查询状态】或【检查进度】 -> 使用 `check_jira_status_and_download`；如果涉及多个工单 -> 使用 `check_jira_status_batch`。
 -   如果用户在下载文件后想【分析】或【查看报告】 -> 使用 `analyze_report_file_and_upload`。分析时必须提供文件名和它所属的Jira单号。"""),
             ("user", "{input}"),
             ("placeholder", "{agent_scratchpad}"),
@@ -980,22 +1307,23 @@ async def get_agent_executor() -> AgentExecutor:
     if _global_agent_executor is None:
         print("🤖 正在初始化 LangChain Agent...")
         load_dotenv()
-        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0, model_kwargs={"response_mime_type": "application/json"})
+        llm = get_llm("gemini-2.5-flash", temperature=0, model_kwargs={"response_mime_type": "application/json"})
         
-        tools = [process_data_request, check_jira_status_and_download, analyze_report_file_and_upload]
+        tools = [process_data_request, check_jira_status_and_download, check_jira_status_batch, analyze_report_file_and_upload]
 
         prompt = ChatPromptTemplate.from_messages(
             [
                 ("system", """你是一个高效的助理。你的任务是根据用户的请求调用合适的工具来完成任务。
 
-你有三个可用的工具:
+你有四个可用的工具:
 1.  `process_data_request`: 用于【提交新的数据查询申请】。需要 `jira_ticket`, `approver`, 和 `data_query_description`。
 2.  `check_jira_status_and_download`: 用于【查询已提交工单的状态】并【自动下载】结果文件（如果准备就绪）。只需要 `jira_ticket`。下载成功后，务必告知用户文件名，并提醒他们可以请求分析。
-3.  `analyze_report_file_and_upload`: 用于【分析已下载的文件】并将结果【上传到Jira】。需要 `file_path` 和 `jira_ticket`。
+3.  `check_jira_status_batch`: 用于【一次查询多个工单的状态】并自动下载已就绪的结果文件。需要 `jira_tickets` 列表。
+4.  `analyze_report_file_and_upload`: 用于【分析已下载的文件】并将结果【上传到Jira】。需要 `file_path` 和 `jira_ticket`；用户提出了具体分析要求时通过 `analysis_request` 传入，默认统计各客户数据量排名。
 
 请仔细识别用户的意图：
 -   如果用户想【提交】或【发起】新请求 -> 使用 `process_data_request`。
--   如果用户想【查询状态】或【检查进度】 -> 使用 `check_jira_status_and_download`。
+-   如果用户想【查询状态】或【检查进度】 -> 使用 `check_jira_status_and_download`；如果涉及多个工单 -> 使用 `check_jira_status_batch`。
 -   如果用户在下载文件后想【分析】或【查看报告】 -> 使用 `analyze_report_file_and_upload`。分析时必须提供文件名和它所属的Jira单号。"""),
                 ("user", "{input}"),
                 ("placeholder", "{agent_scratchpad}"),
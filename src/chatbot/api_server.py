@@ -1,21 +1,24 @@
 import asyncio
+import csv
+import io
 import os
 import sys
 import json
+import mimetypes
 import tempfile
 import uuid
 import re
-import io # 导入io模块
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 from pydantic import BaseModel
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.responses import JSONResponse, FileResponse, HTMLResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from starlette.responses import StreamingResponse
+from starlette.responses import Response, StreamingResponse
 from starlette.background import BackgroundTask
 
 # 导入Playwright相关类型和函数 (不再需要直接在这里导入Playwright, Browser等)
@@ -30,10 +33,23 @@ from agent_1 import (
     _analyze_excel_file_with_gemini,
     _perform_browser_action,
     fill_form_and_submit,
-    _find_status_and_download_if_ready,
+    _check_status_and_download,
+    _check_statuses_and_download_batch,
     close_browser_session, # 导入新的关闭会话函数
     invoke_agent_with_message # 导入新的Agent调用函数
 )
+from browser_service import get_browser_service_client
+from job_queue import JobQueue
+from pegasus_client import close_http_client
+from workbook_reader import close_reader_pool
+from chart_renderer import close_chart_pool
+from report_analysis import RANKING_COLUMNS
+from report_store import report_store
+from sql_cache import sql_cache
+from status_watcher import StatusWatcher
+from task_events import task_event_bus
+from task_logging import current_task_logger, install_stdout_router, task_log_context
+from task_store import task_store
 
 # 加载环境变量
 load_dotenv()
@@ -73,17 +89,16 @@ class DataQueryRequest(BaseModel):
     
 class StatusQueryRequest(BaseModel):
     jira_ticket: str
+
+class BatchStatusQueryRequest(BaseModel):
+    jira_tickets: List[str]
     
 class AnalysisResult(BaseModel):
     success: bool
     message: str
     data: Optional[List[Dict[str, Any]]] = None
 
-# 用于存储进行中的任务状态
-tasks_status = {}
-
-# 用于存储每个任务的事件流 (SSE)
-task_event_streams: Dict[str, asyncio.Queue] = {}
+# 任务状态保存在 task_store 中（默认 SQLite），重启后和多个 worker 之间都可以查询
 
 # Playwright 全局实例，用于保持登录会话 (这些变量不再需要，因为会话管理已移至agent_1.py)
 # _global_playwright: Optional[Playwright] = None
@@ -91,73 +106,81 @@ task_event_streams: Dict[str, asyncio.Queue] = {}
 # _global_context: Optional[BrowserContext] = None
 # _global_page: Optional[Page] = None
 
+def _publish_task_event(task_id: str, status: str, message: str, data: dict = None):
+    # 将消息发布到任务的事件总线，所有订阅者（SSE 连接）都会收到
+    task_event_bus.publish(task_id, {"status": status, "message": message, "data": data},
+                           final=status in ("completed", "failed"))
+
 # 辅助函数：更新任务状态并发送SSE事件
-def update_task_status(task_id: str, status: str, message: str, data: dict = None):
-    tasks_status[task_id] = {
-        "status": status,  # 可能的值: pending, processing, completed, failed
-        "message": message,
-        "data": data or {}
-    }
-    # 将消息推送到对应的事件流
-    if task_id in task_event_streams:
-        # 使用put_nowait以避免阻塞，如果队列已满则会报错，但对于日志流通常不会发生
-        try:
-            task_event_streams[task_id].put_nowait(json.dumps({"status": status, "message": message, "data": data}))
-        except asyncio.QueueFull:
-            print(f"警告: 任务 {task_id} 的事件队列已满，消息丢失。")
+def update_task_status(task_id: str, status: str, message: str, data: dict = None,
+                       jira_ticket: Optional[str] = None, kind: Optional[str] = None):
+    if job_queue.is_cancelled(task_id) and not (data or {}).get("cancelled"):
+        # 已取消的作业如果是在线程中运行的同步函数，取消后仍会执行完，忽略它之后写入的状态
+        return
+    logger = current_task_logger()
+    if status in ("completed", "failed") and logger is not None and logger.task_id == task_id:
+        # 先发出本任务尚未发送的日志，并在发布结束事件前一直持有 emit_lock，
+        # 保证刷新线程不会在结束事件之后再发出日志
+        with logger.emit_lock:
+            logger.flush(final=True)
+            task_store.set(task_id, status, message, data, jira_ticket=jira_ticket, kind=kind)
+            _publish_task_event(task_id, status, message, data)
+            logger.close()
+        return
+    # status 可能的值: pending, processing, completed, failed
+    task_store.set(task_id, status, message, data, jira_ticket=jira_ticket, kind=kind)
+    _publish_task_event(task_id, status, message, data)
+
+# 后台工单状态轮询器：提交查询后自动跟踪工单，执行完成时自动下载并推送事件
+status_watcher = StatusWatcher(check_batch=_check_statuses_and_download_batch, on_event=update_task_status)
+
+# 后台作业队列：按资源类别（浏览器/LLM/CPU）分别限制并发，支持优先级、重试和取消
+job_queue = JobQueue(on_event=update_task_status)
 
 # 辅助函数：获取任务状态
 def get_task_status(task_id: str):
-    return tasks_status.get(task_id, {
-        "status": "unknown",
-        "message": "未找到任务信息",
-        "data": {}
-    })
-
-# 定义一个自定义的stdout类，用于捕获print输出并推送到SSE
-class StdoutRedirector(io.StringIO):
-    def __init__(self, task_id: str):
-        super().__init__()
-        self.task_id = task_id
-        self.buffer = []
-
-    def write(self, s):
-        # 阻止写入控制台，只捕获到内部buffer
-        self.buffer.append(s)
-        if '\n' in s:
-            self.flush()
-
-    def flush(self):
-        if self.buffer:
-            line = ''.join(self.buffer).strip()
-            if line:
-                # 调用update_task_status将捕获到的日志发送到SSE
-                update_task_status(self.task_id, "processing", f"后端日志: {line}")
-            self.buffer = []
-
-# SSE 异步生成器函数
-async def event_generator(task_id: str):
-    if task_id not in task_event_streams:
-        task_event_streams[task_id] = asyncio.Queue()
-    
+    record = task_store.get(task_id)
+    if record is None:
+        return {
+            "status": "unknown",
+            "message": "未找到任务信息",
+            "data": {}
+        }
+    return {"status": record["status"], "message": record["message"], "data": record["data"]}
+
+# 将任务日志批量推送到SSE：一次事件包含一批日志行，message 为整批日志（前端只显示 message）
+def _emit_task_logs(task_id: str, entries: List[dict], dropped: int):
+    data = {"logs": entries}
+    if dropped:
+        data["dropped_logs"] = dropped
+    message = "后端日志:\n" + "\n".join(entry["message"] for entry in entries)
+    if get_task_status(task_id)["status"] in ("completed", "failed"):
+        # 任务已结束，只推送日志，不覆盖最终状态
+        task_event_bus.publish(task_id, {"status": "processing", "message": message, "data": data})
+    else:
+        update_task_status(task_id, "processing", message, data)
+
+def _poll_task_status(task_id: str):
+    # 任务在其他进程（--workers）中执行时，本进程只能从共享的任务存储读取状态
+    current = get_task_status(task_id)
+    if current["status"] == "unknown":
+        return None
+    return current, current["status"] in ("completed", "failed")
+
+# SSE 异步生成器函数：补发 Last-Event-ID 之后的缓存事件，再推送新事件，任务结束后关闭
+async def event_generator(task_id: str, last_event_id: Optional[int] = None):
+    current = get_task_status(task_id)
+    if not task_event_bus.has_task(task_id) and current["status"] in ("completed", "failed"):
+        # 事件缓存已回收，直接返回最终状态
+        yield f"data: {json.dumps(current, ensure_ascii=False)}\n\n"
+        return
     try:
-        while True:
-            # 等待新消息，并发送给客户端
-            message = await task_event_streams[task_id].get()
-            yield f"data: {message}\n\n"
-            # 当任务完成或失败时，可以考虑关闭流，这里简单判断completed或failed状态
-            current_status = tasks_status.get(task_id, {}).get("status")
-            if current_status in ["completed", "failed"]:
-                # 可以在这里发送一个结束信号，例如一个特殊的事件类型，然后break
-                # yield "event: end\ndata: {}\n\n"
-                break
+        async for chunk in task_event_bus.subscribe(task_id, last_event_id,
+                                                    poll=lambda: _poll_task_status(task_id)):
+            yield chunk
     except asyncio.CancelledError:
         print(f"任务 {task_id} 的事件流已取消。")
-    finally:
-        # 当客户端断开连接时，清理队列（可选，取决于需求）
-        if task_id in task_event_streams:
-            # 清理队列，防止内存泄漏，但要确保所有消息都已发送
-            pass # 暂时不做清理，让消息可以被其他监听者获取
+        raise
 
 # FastAPI 启动事件：执行一次性登录 (此段代码将被移除，登录逻辑已移至agent_1.py)
 # @app.on_event("startup")
@@ -192,10 +215,48 @@ async def event_generator(task_id: str):
 #         _global_context = None
 #         _global_page = None
 
+# FastAPI 启动事件：启动工单状态轮询器
+@app.on_event("startup")
+async def startup_event():
+    install_stdout_router()
+    task_event_bus.start()
+    task_store.start()
+    job_queue.start()
+    _recover_interrupted_tasks()
+    status_watcher.start()
+    await _check_browser_service()
+
+# 接管上次运行（本机已退出的进程）遗留的未完成任务：工单跟踪任务重新登记到轮询器，其他任务无法继续，标记为失败
+def _recover_interrupted_tasks():
+    for record in task_store.recover_orphans():
+        # pending 的跟踪任务对应的申请还没有提交成功，不能登记
+        if record["kind"] == "watch" and record["jira_ticket"] and record["status"] == "processing":
+            status_watcher.register(record["jira_ticket"], record["task_id"])
+        else:
+            update_task_status(record["task_id"], "failed", "服务已重启，任务被中断，请重新提交")
+
+# 配置了独立的浏览器服务时，启动时确认其可用（不可用不阻止 API 启动，浏览器操作会返回错误）
+async def _check_browser_service():
+    client = get_browser_service_client()
+    if client is None:
+        return
+    try:
+        info = await client.ping()
+        print(f"🧭 已连接浏览器服务 {client.address}（pid {info['pid']}，上下文池大小 {info['pool_size']}）")
+    except Exception as e:
+        print(f"⚠️ 浏览器服务 {client.address} 不可用: {e}")
+
 # FastAPI 关闭事件：关闭浏览器
 @app.on_event("shutdown")
 async def shutdown_event():
     print("👋 FastAPI 关闭中... 正在关闭浏览器会话。")
+    await status_watcher.stop()
+    await job_queue.stop()
+    await task_event_bus.stop()
+    await close_http_client()
+    close_reader_pool()
+    close_chart_pool()
+    task_store.close()
     await close_browser_session()
     print("🚪 浏览器已关闭。")
 
@@ -243,21 +304,35 @@ async def root():
         """
 
 @app.post("/api/submit-query", summary="提交数据查询申请")
-async def submit_query(data: DataQueryRequest, background_tasks: BackgroundTasks):
+async def submit_query(data: DataQueryRequest):
     try:
         # 生成唯一任务ID
         task_id = str(uuid.uuid4())
         
         # 更新任务状态为处理中
-        update_task_status(task_id, "processing", "正在处理数据查询请求")
+        update_task_status(task_id, "processing", "正在处理数据查询请求", jira_ticket=data.jira_ticket, kind="submit")
         
-        # 生成SQL查询（不需要使用后台任务，这一步很快）
-        sql_query = generate_sql_query(data.query_description)
+        # 生成SQL查询（异步调用 Gemini，不会阻塞其他请求）
+        sql_query = await generate_sql_query(data.query_description)
+        if "错误:" in sql_query:
+            # 未通过本地校验的SQL不提交审批
+            update_task_status(task_id, "failed", "SQL生成失败", {"error": sql_query})
+            return {
+                "success": False,
+                "message": f"提交失败: {sql_query}",
+                "task_id": task_id
+            }
         
+        # 表单提交成功后登记到后台轮询器，工单执行完成后会自动下载并推送到 watch_task_id 的事件流
+        watch_task_id = str(uuid.uuid4())
+        update_task_status(watch_task_id, "pending", f"正在等待工单 {data.jira_ticket} 的申请提交完成",
+                           jira_ticket=data.jira_ticket, kind="watch")
+
         # 在后台执行浏览器操作（这步耗时较长）
-        background_tasks.add_task(
-            process_query_submission,
+        job_queue.submit(
+            "submit", task_id, process_query_submission,
             task_id=task_id,
+            watch_task_id=watch_task_id,
             jira_ticket=data.jira_ticket,
             approver=data.approver,
             sql_query=sql_query,
@@ -268,6 +343,7 @@ async def submit_query(data: DataQueryRequest, background_tasks: BackgroundTasks
             "success": True,
             "message": "数据查询请求已接收，正在处理",
             "task_id": task_id,
+            "watch_task_id": watch_task_id,
             "sql_query": sql_query
         }
     except Exception as e:
@@ -279,37 +355,50 @@ async def submit_query(data: DataQueryRequest, background_tasks: BackgroundTasks
         }
 
 # 后台处理提交查询的任务
-def process_query_submission(task_id: str, jira_ticket: str, approver: str, sql_query: str, query_description: str):
-    # 重定向stdout，捕获print输出
-    old_stdout = sys.stdout
-    sys.stdout = StdoutRedirector(task_id)
-    
-    try:
-        update_task_status(task_id, "processing", "SQL已生成，正在执行表单提交...")
-        
-        # 执行表单提交操作，传入全局的浏览器会话  <- 这行注释是旧的，即将被移除或修改
-        result = _perform_browser_action(
-            fill_form_and_submit,
-            # page=_global_page,      # 传入全局page  <- 这些行将被移除
-            # context=_global_context, # 传入全局context
-            # browser=_global_browser,  # 传入全局browser
-            approver=approver,
-            jira_ticket=jira_ticket,
-            reason=f"为Jira工单 {jira_ticket} 查询数据",
-            sql_query=sql_query
-        )
+async def process_query_submission(task_id: str, watch_task_id: str, jira_ticket: str, approver: str,
+                                   sql_query: str, query_description: str):
+    # 在任务上下文中运行，print 输出只归到本任务（并发任务互不干扰）
+    with task_log_context(task_id, _emit_task_logs):
+        submitted = False
+        try:
+            update_task_status(task_id, "processing", "SQL已生成，正在执行表单提交...")
         
-        update_task_status(
-            task_id, 
-            "completed", 
-            "数据查询请求已成功提交", 
-            {"result": result}
-        )
-    except Exception as e:
-        update_task_status(task_id, "failed", f"提交失败: {str(e)}")
-    finally:
-        # 恢复stdout
-        sys.stdout = old_stdout
+            # 执行表单提交操作，从浏览器上下文池借出一个已登录的上下文
+            result = await _perform_browser_action(
+                fill_form_and_submit,
+                approver=approver,
+                jira_ticket=jira_ticket,
+                reason=f"为Jira工单 {jira_ticket} 查询数据",
+                sql_query=sql_query
+            )
+            if not (isinstance(result, dict) and result.get("success")):
+                # 浏览器操作失败时返回错误文字；提交不是幂等的，不自动重试
+                raise RuntimeError(result)
+            submitted = True
+
+            update_task_status(
+                task_id, 
+                "completed", 
+                "数据查询请求已成功提交", 
+                {"result": result}
+            )
+        except Exception as e:
+            update_task_status(task_id, "failed", f"提交失败: {str(e)}")
+        finally:
+            # 只有申请提交成功才开始跟踪工单状态（作业被取消时也会走到这里）
+            if submitted:
+                update_task_status(watch_task_id, "processing", f"正在等待工单 {jira_ticket} 审批和执行")
+                status_watcher.register(jira_ticket, watch_task_id)
+            else:
+                update_task_status(watch_task_id, "failed", f"工单 {jira_ticket} 的申请未能提交，不再跟踪其状态")
+
+@app.get("/api/watched-tickets", summary="获取后台跟踪中的工单")
+async def watched_tickets():
+    return {"success": True, "tickets": status_watcher.pending()}
+
+@app.get("/api/sql-cache/stats", summary="获取SQL生成缓存命中率")
+async def sql_cache_stats():
+    return {"success": True, "stats": sql_cache.stats()}
 
 @app.get("/api/task-status/{task_id}", summary="获取任务状态")
 async def check_task_status(task_id: str):
@@ -318,21 +407,68 @@ async def check_task_status(task_id: str):
 
 # 新增SSE端点用于实时推送任务日志
 @app.get("/api/task-stream/{task_id}", summary="获取任务实时日志流 (SSE)")
-async def task_stream(task_id: str):
-    return StreamingResponse(event_generator(task_id), media_type="text/event-stream")
+async def task_stream(task_id: str, request: Request, last_event_id: Optional[int] = None):
+    # 浏览器 EventSource 重连时会自动带上 Last-Event-ID 请求头；也可以用查询参数 last_event_id 指定
+    header = request.headers.get("last-event-id")
+    if last_event_id is None and header and header.isdigit():
+        last_event_id = int(header)
+    return StreamingResponse(event_generator(task_id, last_event_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/api/tasks/{task_id}/cancel", summary="取消排队或执行中的任务")
+async def cancel_task(task_id: str):
+    if not job_queue.cancel(task_id):
+        return JSONResponse({"success": False, "message": "任务不存在或已结束"}, status_code=404)
+    return {"success": True, "message": "任务已取消"}
+
+@app.get("/api/jobs/metrics", summary="获取作业队列的排队深度和执行统计")
+async def job_metrics():
+    return {"success": True, "metrics": job_queue.metrics()}
+
+@app.get("/api/jobs/{job_id}", summary="获取作业的执行信息")
+async def job_info(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        return JSONResponse({"success": False, "message": "未找到作业"}, status_code=404)
+    return {"success": True, "job": job.to_dict()}
+
+@app.get("/api/tickets/{jira_ticket}/tasks", summary="按Jira工单查询相关任务")
+async def tasks_by_ticket(jira_ticket: str, limit: int = 20):
+    records = await asyncio.to_thread(task_store.find_by_ticket, jira_ticket, limit)
+    return {"success": True, "tasks": records}
+
+@app.get("/api/task-store/stats", summary="获取任务存储状态")
+async def task_store_stats():
+    return {"success": True, "stats": await asyncio.to_thread(task_store.stats)}
+
+@app.get("/api/browser-service/status", summary="获取浏览器服务状态")
+async def browser_service_status():
+    client = get_browser_service_client()
+    if client is None:
+        return {"success": True, "mode": "in_process"}
+    try:
+        return {"success": True, "mode": "service", "address": client.address, "info": await client.ping()}
+    except Exception as e:
+        return JSONResponse({"success": False, "mode": "service", "address": client.address, "message": str(e)},
+                            status_code=503)
+
+@app.get("/api/task-stream-stats", summary="获取任务事件总线状态")
+async def task_stream_stats():
+    return {"success": True, "stats": task_event_bus.stats()}
 
 @app.post("/api/check-jira-status", summary="查询工单状态并下载结果")
-async def check_jira_status(data: StatusQueryRequest, background_tasks: BackgroundTasks):
+async def check_jira_status(data: StatusQueryRequest):
     try:
         # 生成唯一任务ID
         task_id = str(uuid.uuid4())
         
         # 更新任务状态为处理中
-        update_task_status(task_id, "processing", f"正在查询工单 {data.jira_ticket} 的状态")
+        update_task_status(task_id, "processing", f"正在查询工单 {data.jira_ticket} 的状态",
+                           jira_ticket=data.jira_ticket, kind="status")
         
         # 在后台执行状态查询和下载操作
-        background_tasks.add_task(
-            process_jira_status_check,
+        job_queue.submit(
+            "status", task_id, process_jira_status_check,
             task_id=task_id,
             jira_ticket=data.jira_ticket
         )
@@ -348,28 +484,25 @@ async def check_jira_status(data: StatusQueryRequest, background_tasks: Backgrou
         return JSONResponse({"success": False, "message": f"查询失败: {str(e)}"}, status_code=500)
 
 # 后台处理工单状态查询的任务
-def process_jira_status_check(task_id: str, jira_ticket: str):
-    # 重定向stdout，捕获print输出
-    old_stdout = sys.stdout
-    sys.stdout = StdoutRedirector(task_id)
-
-    try:
+async def process_jira_status_check(task_id: str, jira_ticket: str):
+    # 在任务上下文中运行，print 输出只归到本任务（并发任务互不干扰）
+    # 异常交给作业队列处理：状态查询是幂等的，失败后按退避重试，重试用尽才标记失败
+    with task_log_context(task_id, _emit_task_logs):
         update_task_status(task_id, "processing", "正在查询工单状态并尝试下载...")
         
-        # 执行状态查询和下载操作，不再传入全局的浏览器会话，由_perform_browser_action自行管理
-        result = _perform_browser_action(
-            _find_status_and_download_if_ready,
-            jira_ticket=jira_ticket
-        )
+        # 执行状态查询和下载操作，优先走 Pegasus HTTP 接口，必要时才使用浏览器
+        result = await _check_status_and_download(jira_ticket)
+        if "发生严重错误" in result:
+            raise RuntimeError(result)
         
         # 检查结果中是否包含错误信息
-        if "错误:" in result or "发生严重错误" in result or "ValueError:" in result:
+        if "错误:" in result or "ValueError:" in result:
             update_task_status(task_id, "failed", f"查询失败: {result}")
         elif "成功下载" in result:
             # 尝试提取文件名
             file_match = re.search(r"'([^']+\.xlsx)'", result)
             downloaded_file = file_match.group(1) if file_match else None
-            
+        
             update_task_status(
                 task_id, 
                 "completed", 
@@ -388,29 +521,117 @@ def process_jira_status_check(task_id: str, jira_ticket: str):
                 "工单状态查询完成，但文件未准备好或未下载", 
                 {"result": result, "status": "no_file"}
             )
-    except Exception as e:
-        update_task_status(task_id, "failed", f"查询失败: {str(e)}")
-    finally:
-        # 恢复stdout
-        sys.stdout = old_stdout
+
+@app.post("/api/check-jira-status/batch", summary="批量查询工单状态并下载结果")
+async def check_jira_status_batch(data: BatchStatusQueryRequest):
+    if not data.jira_tickets:
+        return JSONResponse({"success": False, "message": "jira_tickets 不能为空"}, status_code=400)
+    task_id = str(uuid.uuid4())
+    update_task_status(task_id, "processing", f"正在批量查询 {len(data.jira_tickets)} 个工单的状态", kind="status_batch")
+    job_queue.submit(
+        "status_batch", task_id, process_jira_status_batch_check,
+        task_id=task_id,
+        jira_tickets=data.jira_tickets
+    )
+    return {
+        "success": True,
+        "message": "批量状态查询请求已接收，正在处理",
+        "task_id": task_id
+    }
+
+def _summarize_status_result(result: str) -> dict:
+    """
+    将单个工单的状态查询结果转换为与 /api/check-jira-status 相同结构的数据。
+    """
+    if "错误:" in result or "发生严重错误" in result or "ValueError:" in result or result.startswith("❌"):
+        return {"result": result, "status": "failed"}
+    if "成功下载" in result:
+        file_match = re.search(r"'([^']+\.xlsx)'", result)
+        downloaded_file = file_match.group(1) if file_match else None
+        return {
+            "result": result,
+            "file": downloaded_file,
+            "status": "executed",
+            "download_url": f"/api/download/{downloaded_file}" if downloaded_file else None
+        }
+    return {"result": result, "status": "no_file"}
+
+# 后台处理批量工单状态查询的任务
+# 异常交给作业队列处理，失败后按退避重试
+async def process_jira_status_batch_check(task_id: str, jira_tickets: List[str]):
+    with task_log_context(task_id, _emit_task_logs):
+        results = await _check_statuses_and_download_batch(jira_tickets)
+        summary = {ticket: _summarize_status_result(result) for ticket, result in results.items()}
+        downloaded = sum(1 for item in summary.values() if item["status"] == "executed")
+        update_task_status(
+            task_id,
+            "completed",
+            f"批量状态查询完成，共 {len(summary)} 个工单，其中 {downloaded} 个文件已下载",
+            {"results": summary}
+        )
 
 @app.get("/api/download/{filename}", summary="下载文件")
-async def download_file(filename: str):
-    try:
+async def download_file(filename: str, request: Request):
+    # 只允许文件名，防止路径穿越
+    filename = os.path.basename(filename)
+    entry = report_store.find_by_filename(filename)
+    if entry:
+        file_path = Path(entry["path"])
+        etag = f'"{entry["sha256"]}"'
+    else:
+        # 不在报告缓存中的文件（例如分析生成的报告）仍从工作目录提供
         file_path = Path(f"./{filename}")
         if not file_path.exists():
             raise HTTPException(status_code=404, detail="文件未找到")
-        
+        stat = file_path.stat()
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    last_modified = formatdate(file_path.stat().st_mtime, usegmt=True)
+    cache_headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "private, max-age=0, must-revalidate"}
+
+    # 条件请求：客户端已有相同版本时返回 304，不再传输文件内容
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=cache_headers)
+    elif request.headers.get("if-modified-since"):
+        try:
+            if_modified_since = parsedate_to_datetime(request.headers["if-modified-since"])
+            if int(file_path.stat().st_mtime) <= if_modified_since.timestamp():
+                return Response(status_code=304, headers=cache_headers)
+        except (TypeError, ValueError):
+            pass
+
+    try:
         return FileResponse(
             path=file_path, 
             filename=filename,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            media_type=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            headers=cache_headers
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"下载失败: {str(e)}")
 
+# 解析分析结果中的 CSV 排名表（排名,客户名称,数据量）。用 csv 模块解析，客户名称中带逗号或引号时同样正确
+def _parse_ranking_table(analysis_result: str) -> List[dict]:
+    header = ",".join(RANKING_COLUMNS)
+    start = analysis_result.find(header)
+    if start < 0:
+        return []
+    data = []
+    rows = csv.reader(io.StringIO(analysis_result[start + len(header):].lstrip("\r\n")))
+    for row in rows:
+        # 排名表之后是空行和文字摘要
+        if len(row) != 3:
+            break
+        try:
+            data.append({"rank": int(row[0]), "name": row[1].strip(), "count": int(row[2])})
+        except ValueError:
+            break
+    return data
+
 @app.post("/api/analyze-file", summary="分析Excel数据文件")
-async def analyze_file(file: UploadFile = File(...)):
+async def analyze_file(file: UploadFile = File(...), requirement: str = Form("统计结果")):
     try:
         # 保存上传的文件
         temp_file = TEMP_DIR / f"{uuid.uuid4()}_{file.filename}"
@@ -418,25 +639,12 @@ async def analyze_file(file: UploadFile = File(...)):
             content = await file.read()
             f.write(content)
         
-        # 分析文件
-        analysis_result = _analyze_excel_file_with_gemini(str(temp_file))
+        # 分析文件（同步的分析流程由作业队列的 CPU worker 在线程中执行，限制同时解析的文件数）
+        analysis_result = await job_queue.run("analyze", str(uuid.uuid4()), _analyze_excel_file_with_gemini,
+                                              excel_path=str(temp_file), user_requirement=requirement)
         
         # 提取分析结果中的表格数据
-        import re
-        data = []
-        
-        # 尝试解析表格数据
-        table_pattern = r"\|\s*(\d+)\s*\|\s*([^|]+)\s*\|\s*(\d+)\s*\|"
-        matches = re.findall(table_pattern, analysis_result)
-        
-        for match in matches:
-            try:
-                rank = int(match[0].strip())
-                name = match[1].strip()
-                count = int(match[2].strip())
-                data.append({"rank": rank, "name": name, "count": count})
-            except:
-                continue
+        data = _parse_ranking_table(analysis_result)
         
         return {
             "success": True,
@@ -458,15 +666,15 @@ async def analyze_file(file: UploadFile = File(...)):
             pass
 
 @app.post("/api/chat", summary="与聊天机器人对话")
-async def chat_with_bot(background_tasks: BackgroundTasks, message: str = Form(...)):
+async def chat_with_bot(message: str = Form(...)):
     task_id = str(uuid.uuid4())
     
     try:
-        update_task_status(task_id, "processing", "正在处理您的消息...")
+        update_task_status(task_id, "processing", "正在处理您的消息...", kind="chat")
         
-        # 使用BackgroundTasks来异步调用Agent，避免阻塞主线程
-        background_tasks.add_task(
-            _process_chat_message_with_agent, 
+        # 通过作业队列异步调用Agent，避免阻塞主线程
+        job_queue.submit(
+            "chat", task_id, _process_chat_message_with_agent,
             task_id=task_id, 
             message=message
         )
@@ -485,22 +693,18 @@ async def chat_with_bot(background_tasks: BackgroundTasks, message: str = Form(.
         return JSONResponse({"success": False, "message": f"处理失败: {str(e)}"})
 
 async def _process_chat_message_with_agent(task_id: str, message: str):
-    # 重定向stdout，捕获print输出
-    old_stdout = sys.stdout
-    sys.stdout = StdoutRedirector(task_id)
-    try:
-        print(f"🤖 正在通过 LangChain Agent 处理消息: {message}")
-        agent_response = await invoke_agent_with_message(message)
+    # 在任务上下文中运行，print 输出只归到本任务（并发任务互不干扰）
+    with task_log_context(task_id, _emit_task_logs):
+        try:
+            print(f"🤖 正在通过 LangChain Agent 处理消息: {message}")
+            agent_response = await invoke_agent_with_message(message)
         
-        if "错误:" in agent_response or "发生严重错误" in agent_response:
-            update_task_status(task_id, "failed", f"Agent 处理失败: {agent_response}")
-        else:
-            update_task_status(task_id, "completed", "Agent 处理完成", {"response": agent_response})
-    except Exception as e:
-        update_task_status(task_id, "failed", f"Agent 处理过程中发生异常: {str(e)}")
-    finally:
-        # 恢复stdout
-        sys.stdout = old_stdout
+            if "错误:" in agent_response or "发生严重错误" in agent_response:
+                update_task_status(task_id, "failed", f"Agent 处理失败: {agent_response}")
+            else:
+                update_task_status(task_id, "completed", "Agent 处理完成", {"response": agent_response})
+        except Exception as e:
+            update_task_status(task_id, "failed", f"Agent 处理过程中发生异常: {str(e)}")
 
 # API文档自定义
 @app.get("/api/docs", include_in_schema=False)
@@ -553,6 +757,6 @@ async def download_report(filename: str):
         raise HTTPException(status_code=404, detail="File not found")
 
 if __name__ == "__main__":
-    # 确保不使用uvicorn的热重载，以维持Playwright会话的持久性
+    # 确保不使用uvicorn的热重载，以维持Playwright会话的持久性（多进程部署见 README 中的浏览器服务）
     print("🚀 API服务器启动中... 访问 http://localhost:8000/ 查看前端界面")
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
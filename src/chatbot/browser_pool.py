@@ -0,0 +1,390 @@
+"""
+Playwright 浏览器上下文池。
+
+一个 Chromium 进程 + N 个从已保存登录状态 (playwright_session_state.json) 启动的 BrowserContext。
+并发任务通过 checkout/checkin 借出和归还上下文，互不干扰彼此的表单/弹窗状态。
+"""
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Union
+
+from playwright.async_api import Browser, BrowserContext, Page, Playwright, async_playwright
+
+from browser_profile import apply_request_blocking, get_launch_options
+
+POOL_START_URL = 'https://pegasus-prod.veevasfa.com/environment/list'
+PEGASUS_COOKIE_DOMAIN = 'pegasus-prod.veevasfa.com'
+
+# 会话校验结果的缓存时长（秒）。在此期间只做 cookie 过期检查，不再做页面级校验。
+SESSION_HEALTH_TTL = float(os.getenv("SESSION_HEALTH_TTL", "300"))
+# cookie 距离过期不足该秒数时即视为已过期，避免操作进行到一半会话失效
+COOKIE_EXPIRY_MARGIN = float(os.getenv("SESSION_COOKIE_EXPIRY_MARGIN", "60"))
+# 代表登录会话的 cookie 名（逗号分隔），只有它们过期才需要重新登录；统计/埋点类 cookie 过期不影响会话
+SESSION_COOKIE_NAMES = [name.strip() for name in os.getenv("SESSION_COOKIE_NAMES", "SESSION,JSESSIONID").split(",")
+                        if name.strip()]
+
+
+def _expires_or_never(cookie: dict) -> float:
+    expires = cookie.get('expires', -1)
+    return expires if expires > 0 else float('inf')
+
+
+def cookies_expired(cookies: list, domain: str = PEGASUS_COOKIE_DOMAIN,
+                    margin: float = COOKIE_EXPIRY_MARGIN, names: Optional[List[str]] = None) -> bool:
+    """
+    根据会话 cookie（SESSION_COOKIE_NAMES）的 expires 字段判断登录会话是否（即将）过期。
+    没有任何属于 domain 的 cookie 视为过期；expires 为 -1 的会话 cookie 不会过期。
+    domain 下没有配置的会话 cookie 时，以最晚过期的 cookie 为准，而不是任何一个 cookie 快过期就重新登录。
+    """
+    names = SESSION_COOKIE_NAMES if names is None else names
+    domain_cookies = [c for c in cookies if domain.endswith(c.get('domain', '').lstrip('.'))]
+    if not domain_cookies:
+        return True
+    session_cookies = [c for c in domain_cookies if c.get('name') in names]
+    if not session_cookies:
+        session_cookies = [max(domain_cookies, key=_expires_or_never)]
+    deadline = time.time() + margin
+    return any(_expires_or_never(c) < deadline for c in session_cookies)
+
+
+def storage_state_expired(storage_state_path: Path) -> bool:
+    """
+    直接读取保存的 storage_state 文件检查 cookie 是否过期，无需启动浏览器。
+    """
+    try:
+        with open(storage_state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return True
+    return cookies_expired(state.get('cookies', []))
+
+
+class SessionHealthCache:
+    """
+    记录池中每个上下文最近一次校验成功的时间，
+    在 TTL 内跳过昂贵的页面级校验。
+    """
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = SESSION_HEALTH_TTL if ttl is None else ttl
+        self._validated_at: dict = {}
+
+    def mark_valid(self, key):
+        self._validated_at[key] = time.monotonic()
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._validated_at.clear()
+        else:
+            self._validated_at.pop(key, None)
+
+    def is_fresh(self, key) -> bool:
+        validated_at = self._validated_at.get(key)
+        return validated_at is not None and time.monotonic() - validated_at < self.ttl
+
+
+class SessionExpiredError(Exception):
+    """保存的登录状态已失效（新上下文被重定向到登录页）。"""
+
+
+class PooledContext:
+    """
+    池中的单个浏览器上下文，附带健康状态统计。
+    """
+    def __init__(self, slot: int, context: BrowserContext, page: Page, generation: int):
+        self.slot = slot
+        self.context = context
+        self.page = page
+        self.generation = generation
+        self.healthy = True
+        self.failure_count = 0
+        self.use_count = 0
+        self.created_at = time.time()
+        self.last_used_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "slot": self.slot,
+            "healthy": self.healthy,
+            "failure_count": self.failure_count,
+            "use_count": self.use_count,
+            "created_at": self.created_at,
+            "last_used_at": self.last_used_at,
+        }
+
+
+# 正在锁外创建上下文的槽位占位
+_RESERVED = object()
+
+
+class BrowserContextPool:
+    """
+    管理一个 Chromium 进程和最多 size 个已登录的 BrowserContext。
+
+    - checkout(): 借出一个上下文，超过并发上限时排队等待
+    - checkin(): 归还上下文；标记为不健康的上下文会被关闭，下次借出时重建
+    - acquire(): checkout/checkin 的 async with 封装
+
+    relogin(browser) 在池自己的浏览器中登录并重新保存 storage_state。重新登录（可能要等待 Okta 推送确认）
+    不持有 _lock，只由 _relogin_lock 保证同一时间只有一个任务在登录，其他任务可以继续借还已有的上下文。
+    同样地，_lock 只保护空闲列表和槽位分配：创建上下文（页面导航可能长达两分钟）、借出前的健康检查
+    和归还时的页面重置都在锁外进行，不会让其他任务排队等待。
+    """
+    # 重新登录后新上下文仍然失效时最多再尝试的次数
+    MAX_RELOGINS = 2
+
+    def __init__(self,
+                 storage_state_path: Path,
+                 relogin: Callable[[Browser], Awaitable[None]],
+                 size: Optional[int] = None,
+                 max_failures: int = 3,
+                 start_url: str = POOL_START_URL):
+        self.storage_state_path = Path(storage_state_path)
+        self.size = size or int(os.getenv("BROWSER_POOL_SIZE", "3"))
+        self.max_failures = max_failures
+        self.start_url = start_url
+        self._relogin = relogin
+
+        self._playwright: Optional[Playwright] = None
+        self._browser: Optional[Browser] = None
+        self._idle: List[PooledContext] = []
+        self._slots: List[Union[PooledContext, object, None]] = [None] * self.size
+        self._semaphore = asyncio.Semaphore(self.size)
+        self._lock = asyncio.Lock()
+        self._relogin_lock = asyncio.Lock()
+        # 每次重新登录后递增，旧一代的上下文在借出时被回收
+        self._generation = 0
+        self.health = SessionHealthCache()
+
+    @property
+    def browser(self) -> Optional[Browser]:
+        return self._browser
+
+    async def _launch_browser(self):
+        if self._browser and self._browser.is_connected():
+            return
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        print(f"🚀 正在为上下文池启动 Chromium (size={self.size})...")
+        self._browser = await self._playwright.chromium.launch(**get_launch_options())
+        # 浏览器重启后，所有旧上下文都已失效
+        self._idle.clear()
+        self._slots = [None] * self.size
+
+    async def _ensure_browser(self):
+        await self._launch_browser()
+        if not self.storage_state_path.exists() or storage_state_expired(self.storage_state_path):
+            raise SessionExpiredError("会话状态文件不存在或其中的 cookie 已过期")
+
+    async def _refresh_session(self, seen_generation: int):
+        """
+        重新登录一次（不持有 _lock）。等待 _relogin_lock 期间其他任务已经完成重新登录时直接返回。
+        """
+        async with self._relogin_lock:
+            if self._generation != seen_generation:
+                return
+            async with self._lock:
+                await self._launch_browser()
+                browser = self._browser
+            await self._relogin(browser)
+            # 同一份 storage_state 创建的旧上下文都会一起失效，借出时按代数回收
+            self._generation += 1
+
+    async def _new_context(self, browser: Browser, slot: int) -> PooledContext:
+        # 创建期间可能完成了重新登录，代数取读取 storage_state 之前的值
+        generation = self._generation
+        context = await browser.new_context(storage_state=self.storage_state_path)
+        await apply_request_blocking(context)
+        page = await context.new_page()
+        try:
+            await page.goto(self.start_url, timeout=60000)
+            await page.wait_for_load_state('networkidle', timeout=60000)
+        except Exception:
+            await context.close()
+            raise
+        if not page.url.startswith(self.start_url):
+            await context.close()
+            raise SessionExpiredError(f"上下文被重定向到 {page.url}")
+        print(f"   -> 上下文池: 已创建上下文 #{slot}")
+        item = PooledContext(slot, context, page, generation)
+        self.health.mark_valid(id(item))
+        return item
+
+    async def _is_alive(self, item: PooledContext) -> bool:
+        """
+        借出前的轻量级检查：TTL 内只看 cookie 是否过期；TTL 过期后再加一次 JS 往返确认页面可用。
+        登录 cookie 过期时抛出 SessionExpiredError，由 checkout 在释放锁之后重新登录。
+        """
+        if not item.healthy or item.generation != self._generation or item.page.is_closed():
+            return False
+        try:
+            expired = cookies_expired(await item.context.cookies())
+            if not expired and not self.health.is_fresh(id(item)):
+                await item.page.evaluate("1")
+                self.health.mark_valid(id(item))
+        except Exception as e:
+            print(f"⚠️ 上下文 #{item.slot} 健康检查失败: {e}")
+            return False
+        if expired:
+            raise SessionExpiredError(f"上下文 #{item.slot} 的登录 cookie 已过期")
+        return True
+
+    def _detach(self, item: PooledContext):
+        self.health.invalidate(id(item))
+        if self._slots[item.slot] is item:
+            self._slots[item.slot] = None
+
+    async def _close_context(self, item: PooledContext):
+        try:
+            await item.context.close()
+        except Exception as e:
+            print(f"❌ 关闭池上下文 #{item.slot} 时出错: {e}")
+
+    async def _close_item(self, item: PooledContext):
+        self._detach(item)
+        await self._close_context(item)
+
+    async def _take_or_reserve(self):
+        """
+        在 _lock 内取出一个空闲上下文，没有空闲上下文时预留一个空槽位。
+        返回 (item, None) 或 (None, (slot, browser))；耗时的校验、创建都在锁外进行。
+        """
+        async with self._lock:
+            await self._ensure_browser()
+            if self._idle:
+                return self._idle.pop(), None
+            slot = self._slots.index(None)
+            self._slots[slot] = _RESERVED
+            return None, (slot, self._browser)
+
+    async def _fill_reserved(self, slot: int, browser: Browser) -> Optional[PooledContext]:
+        try:
+            item = await self._new_context(browser, slot)
+        except BaseException:
+            async with self._lock:
+                if self._browser is browser and self._slots[slot] is _RESERVED:
+                    self._slots[slot] = None
+            raise
+        async with self._lock:
+            if self._browser is browser:
+                self._slots[slot] = item
+                return item
+        # 创建期间浏览器已重启，这个上下文属于旧浏览器，由调用方重新借出
+        await self._close_context(item)
+        return None
+
+    async def _checkout_once(self) -> PooledContext:
+        while True:
+            item, reserved = await self._take_or_reserve()
+            if reserved is not None:
+                item = await self._fill_reserved(*reserved)
+                if item is not None:
+                    return item
+                continue
+            # 取出后的上下文只属于当前任务，健康检查不需要持有 _lock
+            try:
+                alive = await self._is_alive(item)
+            except SessionExpiredError:
+                await self._close_item(item)
+                raise
+            if alive:
+                return item
+            await self._close_item(item)
+
+    async def checkout(self) -> PooledContext:
+        """
+        借出一个可用的上下文。并发数达到 size 时会等待其他任务归还。
+        """
+        await self._semaphore.acquire()
+        try:
+            relogins = 0
+            while True:
+                generation = self._generation
+                try:
+                    item = await self._checkout_once()
+                    break
+                except SessionExpiredError as e:
+                    if relogins >= self.MAX_RELOGINS:
+                        raise
+                    relogins += 1
+                    print(f"⚠️ 会话状态已失效 ({e})，正在重新登录...")
+                    await self._refresh_session(generation)
+            item.use_count += 1
+            item.last_used_at = time.time()
+            return item
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def checkin(self, item: PooledContext, healthy: bool = True):
+        """
+        归还上下文。healthy=False 会累计失败次数，超过 max_failures 后关闭该上下文。
+        页面重置和关闭在锁外进行，只有放回空闲列表时持有 _lock。
+        """
+        try:
+            if healthy:
+                item.failure_count = 0
+                self.health.mark_valid(id(item))
+            else:
+                # 真实操作失败，下次借出时必须重新做完整校验
+                self.health.invalidate(id(item))
+                item.failure_count += 1
+                if item.failure_count >= self.max_failures or item.page.is_closed():
+                    item.healthy = False
+                else:
+                    # 操作失败后页面可能停留在弹窗/表单中，先导航回起始页再放回池中
+                    try:
+                        await item.page.goto(self.start_url, timeout=30000)
+                    except Exception as e:
+                        print(f"⚠️ 重置上下文 #{item.slot} 的页面失败: {e}")
+                        item.healthy = False
+            async with self._lock:
+                owned = self._slots[item.slot] is item
+                if item.healthy and owned:
+                    self._idle.append(item)
+                elif owned:
+                    self._detach(item)
+            if owned and not item.healthy:
+                print(f"⚠️ 上下文 #{item.slot} 已被标记为不健康，正在关闭。")
+                await self._close_context(item)
+        finally:
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def acquire(self):
+        item = await self.checkout()
+        healthy = True
+        try:
+            yield item
+        except BaseException:
+            healthy = False
+            raise
+        finally:
+            await self.checkin(item, healthy=healthy)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "contexts": [item.to_dict() for item in self._slots if isinstance(item, PooledContext)],
+        }
+
+    async def close(self):
+        print("🚪 正在关闭浏览器上下文池...")
+        async with self._lock:
+            for item in [i for i in self._slots if isinstance(i, PooledContext)]:
+                await self._close_item(item)
+            self._idle.clear()
+            try:
+                if self._browser and self._browser.is_connected():
+                    await self._browser.close()
+                if self._playwright:
+                    await self._playwright.stop()
+            except Exception as e:
+                print(f"❌ 关闭上下文池浏览器时出错: {e}")
+            finally:
+                self._browser = None
+                self._playwright = None
@@ -0,0 +1,67 @@
+"""
+Chromium 启动配置。
+
+所有启动浏览器的地方（两个登录函数、保存状态加载路径、上下文池）统一使用这里的配置，
+服务器部署默认无头模式，并在 pegasus-prod 页面上拦截图片/字体/统计脚本以降低内存和页面加载时间。
+"""
+import os
+import re
+
+from playwright.async_api import BrowserContext, Route
+
+# 本地调试时可设置 BROWSER_HEADLESS=false 观察浏览器操作
+BROWSER_HEADLESS = os.getenv("BROWSER_HEADLESS", "true").lower() == "true"
+# 设置 BROWSER_BLOCK_RESOURCES=false 可关闭资源拦截
+BROWSER_BLOCK_RESOURCES = os.getenv("BROWSER_BLOCK_RESOURCES", "true").lower() == "true"
+
+LEAN_CHROMIUM_ARGS = [
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-dev-shm-usage",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--mute-audio",
+    "--no-first-run",
+]
+
+# 只在 pegasus-prod 页面上拦截这些资源类型，Okta 登录页保持原样
+PEGASUS_URL_PATTERN = re.compile(r"^https://pegasus-prod\.veevasfa\.com/")
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+# 统计/埋点脚本在任何页面上都拦截
+ANALYTICS_URL_PATTERN = re.compile(
+    r"google-analytics\.com|googletagmanager\.com|doubleclick\.net|hm\.baidu\.com|"
+    r"hotjar\.com|segment\.(io|com)|sentry\.io|newrelic\.com|nr-data\.net"
+)
+
+
+def get_launch_options(timeout: int = 60000) -> dict:
+    """
+    返回传给 chromium.launch() 的参数。
+    """
+    return {
+        "headless": BROWSER_HEADLESS,
+        "args": LEAN_CHROMIUM_ARGS,
+        "timeout": timeout,
+    }
+
+
+async def _block_pegasus_heavy_resources(route: Route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def _block_analytics(route: Route):
+    await route.abort()
+
+
+async def apply_request_blocking(context: BrowserContext):
+    """
+    在上下文上注册请求拦截。应在打开任何页面之前调用。
+    """
+    if not BROWSER_BLOCK_RESOURCES:
+        return
+    await context.route(PEGASUS_URL_PATTERN, _block_pegasus_heavy_resources)
+    await context.route(ANALYTICS_URL_PATTERN, _block_analytics)
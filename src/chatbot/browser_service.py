@@ -0,0 +1,196 @@
+"""
+浏览器服务（独立进程）。
+
+Playwright 的浏览器、登录会话和上下文池原本保存在 agent_1 的模块全局变量中，API 只能以单进程运行。
+设置 BROWSER_SERVICE_ADDRESS 后，浏览器操作改由一个独立的浏览器服务进程执行：
+    python browser_service.py                     # 启动浏览器服务，负责登录和上下文池
+    uvicorn api_server:app --workers 4            # API 多进程/多机部署，共用同一个已登录的浏览器服务
+多进程部署时各 worker 还需共用任务存储（TASK_STORE_PATH 或 TASK_STORE_BACKEND=redis），
+任务事件流落在非执行该任务的 worker 上时通过轮询任务存储推送状态。
+地址格式为 unix:///path/to/browser_service.sock（同机）或 tcp://host:port（跨机器，必须同时设置 BROWSER_SERVICE_TOKEN，否则服务拒绝启动）。
+未设置地址时仍在 API 进程内直接操作浏览器。
+
+协议：每个连接发送一行 JSON 请求 {"method", "params", "token"}，服务端返回一行 JSON {"result"} 或 {"error"}。
+只开放 BROWSER_ACTIONS 中列出的浏览器操作。
+"""
+import asyncio
+import hmac
+import json
+import os
+import signal
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+BROWSER_SERVICE_ADDRESS = os.getenv("BROWSER_SERVICE_ADDRESS", "")
+BROWSER_SERVICE_TOKEN = os.getenv("BROWSER_SERVICE_TOKEN", "")
+# 浏览器操作（包括可能的 Okta 登录）耗时较长
+BROWSER_SERVICE_TIMEOUT = float(os.getenv("BROWSER_SERVICE_TIMEOUT", "900"))
+_MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+# 允许远程调用的浏览器操作（agent_1 中以 page/context 为参数的函数）
+BROWSER_ACTIONS = ("fill_form_and_submit", "_find_status_and_download_if_ready", "_find_statuses_and_download_batch")
+
+# 在浏览器服务进程内为 True，此时 agent_1 直接操作浏览器，不再转发
+IN_BROWSER_SERVICE = False
+
+
+class BrowserServiceError(Exception):
+    pass
+
+
+def _parse_address(address: str) -> Tuple[str, str, Optional[int]]:
+    parsed = urlparse(address)
+    if parsed.scheme == "unix":
+        return "unix", parsed.path, None
+    if parsed.scheme == "tcp" and parsed.hostname and parsed.port:
+        return "tcp", parsed.hostname, parsed.port
+    raise ValueError(f"无效的浏览器服务地址: {address}（应为 unix:///path 或 tcp://host:port）")
+
+
+async def _open(address: str):
+    kind, host, port = _parse_address(address)
+    if kind == "unix":
+        return await asyncio.open_unix_connection(host, limit=_MAX_MESSAGE_BYTES)
+    return await asyncio.open_connection(host, port, limit=_MAX_MESSAGE_BYTES)
+
+
+class BrowserServiceClient:
+    def __init__(self, address: str, token: str = BROWSER_SERVICE_TOKEN, timeout: float = BROWSER_SERVICE_TIMEOUT):
+        _parse_address(address)
+        self.address = address
+        self.token = token
+        self.timeout = timeout
+
+    async def call(self, method: str, **params):
+        try:
+            reader, writer = await _open(self.address)
+        except OSError as e:
+            raise BrowserServiceError(f"无法连接浏览器服务 {self.address}: {e}") from e
+        try:
+            request = {"method": method, "params": params, "token": self.token}
+            writer.write(json.dumps(request, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+            await writer.drain()
+            line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+        except asyncio.TimeoutError as e:
+            raise BrowserServiceError(f"浏览器服务 {method} 超时（{self.timeout:.0f} 秒）") from e
+        finally:
+            writer.close()
+        if not line:
+            raise BrowserServiceError("浏览器服务关闭了连接")
+        response = json.loads(line)
+        if "error" in response:
+            raise BrowserServiceError(response["error"])
+        return response.get("result")
+
+    async def browser_action(self, action: str, **kwargs):
+        return await self.call("browser_action", action=action, kwargs=kwargs)
+
+    async def ping(self) -> dict:
+        return await self.call("ping")
+
+
+def get_browser_service_client() -> Optional[BrowserServiceClient]:
+    """
+    配置了浏览器服务且当前不在浏览器服务进程内时返回客户端，否则返回 None（在本进程内操作浏览器）。
+    """
+    address = os.getenv("BROWSER_SERVICE_ADDRESS", BROWSER_SERVICE_ADDRESS)
+    if IN_BROWSER_SERVICE or not address:
+        return None
+    return BrowserServiceClient(address, token=os.getenv("BROWSER_SERVICE_TOKEN", BROWSER_SERVICE_TOKEN))
+
+
+class BrowserService:
+    def __init__(self, address: str, token: str = BROWSER_SERVICE_TOKEN):
+        self.address = address
+        self.token = token
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._active = 0
+        # TCP 监听可被其他机器访问，始终校验令牌；Unix socket 由文件权限保护，令牌可选
+        self._require_token = _parse_address(address)[0] == "tcp"
+
+    async def _dispatch(self, method: str, params: dict):
+        import agent_1
+        if method == "ping":
+            pool = agent_1.get_browser_pool()
+            return {"pid": os.getpid(), "pool_size": pool.size, "active_requests": self._active}
+        if method == "browser_action":
+            action = params.get("action")
+            if action not in BROWSER_ACTIONS:
+                raise BrowserServiceError(f"不支持的浏览器操作: {action}")
+            return await agent_1._perform_browser_action(getattr(agent_1, action), **(params.get("kwargs") or {}))
+        raise BrowserServiceError(f"未知的方法: {method}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._active += 1
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+                if self._require_token and not self.token:
+                    raise BrowserServiceError("浏览器服务未配置令牌，拒绝 TCP 请求")
+                if self.token and not hmac.compare_digest(str(request.get("token") or ""), self.token):
+                    raise BrowserServiceError("浏览器服务令牌无效")
+                response = {"result": await self._dispatch(request.get("method"), request.get("params") or {})}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            writer.write(json.dumps(response, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+            await writer.drain()
+        finally:
+            self._active -= 1
+            writer.close()
+
+    async def start(self):
+        kind, host, port = _parse_address(self.address)
+        if kind == "unix":
+            if os.path.exists(host):
+                os.unlink(host)
+            self._server = await asyncio.start_unix_server(self._handle, path=host, limit=_MAX_MESSAGE_BYTES)
+            os.chmod(host, 0o600)
+        else:
+            if not self.token:
+                raise BrowserServiceError("通过 TCP 监听浏览器服务时必须设置 BROWSER_SERVICE_TOKEN")
+            self._server = await asyncio.start_server(self._handle, host, port, limit=_MAX_MESSAGE_BYTES)
+        print(f"🧭 浏览器服务已启动: {self.address}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        kind, host, _ = _parse_address(self.address)
+        if kind == "unix" and os.path.exists(host):
+            os.unlink(host)
+
+
+async def _serve(address: str):
+    import agent_1
+    from pegasus_client import close_http_client
+    service = BrowserService(address, token=os.getenv("BROWSER_SERVICE_TOKEN", BROWSER_SERVICE_TOKEN))
+    await service.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        print("👋 浏览器服务关闭中... 正在关闭浏览器会话。")
+        await service.stop()
+        await agent_1.close_browser_session()
+        await close_http_client()
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    # 以脚本运行时本文件是 __main__，agent_1 导入的是另一份 browser_service 模块，标记要设置在那一份上
+    import browser_service
+    browser_service.IN_BROWSER_SERVICE = True
+    address = os.getenv("BROWSER_SERVICE_ADDRESS") or "unix://" + os.path.abspath("browser_service.sock")
+    asyncio.run(_serve(address))
+
+
+if __name__ == "__main__":
+    main()
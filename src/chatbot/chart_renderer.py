@@ -0,0 +1,96 @@
+"""
+分析图表的渲染。
+
+使用 matplotlib 的面向对象 Figure API（不经过 pyplot 的全局状态，图表用完即释放），
+中文字体只在每个渲染进程启动时配置一次；渲染在独立的进程池中执行，
+并发的分析不会在 matplotlib 的全局锁上排队。
+CHART_OUTPUT_FORMAT=svg 输出矢量图，=json 只输出图表数据由前端渲染，两者都不需要栅格化。
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+CHART_OUTPUT_FORMAT = os.getenv("CHART_OUTPUT_FORMAT", "png").lower()
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", "2"))
+# 按顺序尝试的中文字体，找不到时 matplotlib 自动退到下一个
+CHART_FONTS = ["STHeiti", "SimHei", "PingFang SC", "Noto Sans CJK SC", "WenQuanYi Micro Hei", "Arial Unicode MS",
+               "DejaVu Sans"]
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_fonts_configured = False
+
+
+def _configure_fonts():
+    global _fonts_configured
+    if _fonts_configured:
+        return
+    import matplotlib
+    matplotlib.use('Agg')
+    matplotlib.rcParams['font.sans-serif'] = CHART_FONTS
+    matplotlib.rcParams['axes.unicode_minus'] = False  # 修正负号显示问题
+    _fonts_configured = True
+
+
+def _chart_path(output_path: str, fmt: str) -> str:
+    return str(Path(output_path).with_suffix(f".{fmt}"))
+
+
+def _render_bar_chart(labels: List[str], values: List[int], output_path: str, title: str,
+                      xlabel: str, ylabel: str, fmt: str) -> str:
+    output_path = _chart_path(output_path, fmt)
+    if fmt == "json":
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump({"type": "bar", "title": title, "x_label": xlabel, "y_label": ylabel,
+                       "labels": labels, "values": values}, f, ensure_ascii=False)
+        return output_path
+
+    _configure_fonts()
+    from matplotlib.figure import Figure
+    figure = Figure(figsize=(12, 7))
+    try:
+        ax = figure.subplots()
+        bars = ax.bar(labels, values, color='skyblue')
+        # 在柱子顶端添加数据标签
+        ax.bar_label(bars, labels=[str(int(v)) for v in values], fontsize=10)
+        ax.set_title(title, fontsize=16)
+        ax.set_xlabel(xlabel, fontsize=12)
+        ax.set_ylabel(ylabel, fontsize=12)
+        # 旋转X轴标签以防重叠
+        ax.tick_params(axis='x', labelrotation=45)
+        for label in ax.get_xticklabels():
+            label.set_horizontalalignment('right')
+        ax.grid(axis='y', linestyle='--', alpha=0.6)
+        figure.tight_layout()
+        figure.savefig(output_path, format=fmt)
+    finally:
+        figure.clear()
+    return output_path
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    if _render_pool is None:
+        _render_pool = ProcessPoolExecutor(max_workers=CHART_RENDER_WORKERS, initializer=_configure_fonts)
+    return _render_pool
+
+
+def close_chart_pool():
+    global _render_pool
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+
+def render_bar_chart(labels: List[str], values: List[int], output_path: str, title: str,
+                     xlabel: str = "", ylabel: str = "", fmt: Optional[str] = None) -> str:
+    """
+    渲染柱状图并返回实际输出的文件路径（扩展名随输出格式变化）。
+    """
+    fmt = (fmt or CHART_OUTPUT_FORMAT).lower()
+    if fmt == "json" or CHART_RENDER_WORKERS <= 0:
+        return _render_bar_chart(labels, values, output_path, title, xlabel, ylabel, fmt)
+    future = _get_render_pool().submit(_render_bar_chart, list(labels), [int(v) for v in values], output_path,
+                                       title, xlabel, ylabel, fmt)
+    return future.result()
@@ -0,0 +1,227 @@
+"""
+Excel 报告的列式（Parquet）副本。
+
+xlsx 解析是分析流程里最慢的一步。每个报告按文件内容 SHA-256 只转换一次，
+每个工作表保存为一个 Parquet 文件并附带 manifest.json；之后对同一文件的分析通过内存映射读取列式副本，
+行数直接取自 Parquet 元数据，count 列只读第一行。
+pyarrow 未安装时该缓存不生效，调用方退回流式读取 xlsx。
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from report_store import REPORT_CACHE_DIR, file_sha256, report_store
+from workbook_reader import CalamineWorkbook, SheetSummary
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+COLUMNAR_CACHE_DIR = Path(os.getenv("COLUMNAR_CACHE_DIR", str(REPORT_CACHE_DIR / "columnar")))
+COLUMNAR_CACHE_MAX_BYTES = int(float(os.getenv("COLUMNAR_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+
+
+def _in_report_store(path: Path) -> bool:
+    return path.resolve().parent == report_store.blob_dir.resolve()
+
+
+def _file_key(path: Path) -> str:
+    # 报告缓存中的文件名本身就是内容哈希，不需要重新计算
+    if _in_report_store(path) and len(path.stem) == 64:
+        return path.stem
+    return file_sha256(path)
+
+
+def _to_arrow_compatible(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    df.columns = [str(column) for column in df.columns]
+    # object 列中常混有数字和文本，统一转成字符串，空值保持为空
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].map(lambda value: None if pd.isna(value) else str(value))
+    return df
+
+
+class ColumnarCache:
+    """
+    目录结构: <root>/<sha256>/manifest.json + <序号>.parquet
+    manifest.json: {"source": 原文件名, "sheets": [{"name", "file", "rows", "columns"}]}
+    """
+    def __init__(self, root: Path = COLUMNAR_CACHE_DIR, max_bytes: int = COLUMNAR_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._in_progress = set()
+
+    @property
+    def available(self) -> bool:
+        return pq is not None
+
+    def _dataset_dir(self, key: str) -> Path:
+        return self.root / key
+
+    def _load_manifest(self, key: str) -> Optional[dict]:
+        manifest_path = self._dataset_dir(key) / "manifest.json"
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        # 更新访问时间，供按最近使用淘汰
+        os.utime(manifest_path)
+        return manifest
+
+    def lookup(self, excel_path: str) -> Optional[dict]:
+        """
+        返回 {"key", "dir", "manifest"}，没有列式副本时返回 None。
+        """
+        if not self.available:
+            return None
+        key = _file_key(Path(excel_path))
+        manifest = self._load_manifest(key)
+        if manifest is None:
+            return None
+        return {"key": key, "dir": self._dataset_dir(key), "manifest": manifest}
+
+    def convert(self, excel_path: str, key: Optional[str] = None) -> Optional[dict]:
+        """
+        将工作簿的每个工作表写成 Parquet 文件，已存在时直接返回。
+        逐个工作表解析并写出，内存中同时只保留一个工作表的 DataFrame。
+        """
+        if not self.available:
+            return None
+        source = Path(excel_path)
+        key = key or _file_key(source)
+        existing = self._load_manifest(key)
+        if existing is not None:
+            return {"key": key, "dir": self._dataset_dir(key), "manifest": existing}
+
+        started = time.time()
+        engine = "calamine" if CalamineWorkbook is not None else None
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_dir = self.root / f"{key}.tmp-{uuid.uuid4().hex}"
+        tmp_dir.mkdir()
+        try:
+            sheets = []
+            with pd.ExcelFile(source, engine=engine) as workbook:
+                for index, sheet_name in enumerate(workbook.sheet_names):
+                    df = _to_arrow_compatible(workbook.parse(sheet_name))
+                    file_name = f"{index}.parquet"
+                    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_dir / file_name)
+                    sheets.append({"name": sheet_name, "file": file_name, "rows": len(df),
+                                   "columns": list(df.columns)})
+                    del df
+            manifest = {"source": source.name, "sheets": sheets, "created_at": time.time()}
+            with open(tmp_dir / "manifest.json", 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            try:
+                os.replace(tmp_dir, self._dataset_dir(key))
+            except OSError:
+                # 并发转换时另一方已经写好了同一份副本
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        print(f"🗃️ 已生成列式副本: {source.name} ({len(sheets)} 个工作表, {time.time() - started:.1f}s)")
+        self._evict()
+        return {"key": key, "dir": self._dataset_dir(key), "manifest": manifest}
+
+    def convert_in_background(self, excel_path: str, key: Optional[str] = None):
+        """
+        在后台线程中转换，不阻塞当前分析或下载。不在报告缓存中的文件（例如上传的临时文件）先复制一份，
+        避免调用方在转换完成前删除原文件。
+        """
+        if not self.available:
+            return
+        source = Path(excel_path)
+        key = key or _file_key(source)
+        with self._lock:
+            if key in self._in_progress or (self._dataset_dir(key) / "manifest.json").exists():
+                return
+            self._in_progress.add(key)
+
+        copy_path = None
+        if not _in_report_store(source):
+            copy_path = self.root / f"{key}.source{source.suffix}"
+            try:
+                self.root.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(source, copy_path)
+            except OSError as e:
+                # 列式副本只是加速手段，复制失败不影响调用方的分析
+                print(f"⚠️ 复制 {source.name} 以生成列式副本失败: {e}")
+                copy_path.unlink(missing_ok=True)
+                with self._lock:
+                    self._in_progress.discard(key)
+                return
+
+        def _run():
+            try:
+                self.convert(str(copy_path or source), key=key)
+            except Exception as e:
+                print(f"⚠️ 生成列式副本失败 ({source.name}): {e}")
+            finally:
+                if copy_path is not None:
+                    copy_path.unlink(missing_ok=True)
+                with self._lock:
+                    self._in_progress.discard(key)
+
+        threading.Thread(target=_run, name=f"columnar-{key[:8]}").start()
+
+    def summarize(self, excel_path: str) -> Optional[List[SheetSummary]]:
+        """
+        从列式副本得到与 workbook_reader.summarize_workbook 相同的工作表摘要，没有副本时返回 None。
+        """
+        dataset = self.lookup(excel_path)
+        if dataset is None:
+            return None
+        summaries = []
+        for sheet in dataset["manifest"]["sheets"]:
+            summary = SheetSummary(name=sheet["name"], columns=sheet["columns"], row_count=sheet["rows"])
+            summary.count_column = next((c for c in sheet["columns"] if "count" in c.lower()), None)
+            if summary.count_column is not None and summary.row_count:
+                parquet_file = pq.ParquetFile(dataset["dir"] / sheet["file"], memory_map=True)
+                first_batch = next(parquet_file.iter_batches(batch_size=1, columns=[summary.count_column]), None)
+                if first_batch is not None and first_batch.num_rows:
+                    summary.count_value = first_batch.column(0)[0].as_py()
+            summaries.append(summary)
+        return summaries
+
+    def load_sheets(self, excel_path: str, columns: Optional[List[str]] = None) -> Optional[Dict[str, pd.DataFrame]]:
+        """
+        通过内存映射读取列式副本中的所有工作表，没有副本时返回 None。
+        """
+        dataset = self.lookup(excel_path)
+        if dataset is None:
+            return None
+        sheets = {}
+        for sheet in dataset["manifest"]["sheets"]:
+            selected = [c for c in columns if c in sheet["columns"]] if columns else None
+            table = pq.read_table(dataset["dir"] / sheet["file"], columns=selected, memory_map=True)
+            sheets[sheet["name"]] = table.to_pandas()
+        return sheets
+
+    def _evict(self):
+        datasets = []
+        for directory in self.root.iterdir():
+            manifest_path = directory / "manifest.json"
+            if directory.is_dir() and manifest_path.exists():
+                size = sum(f.stat().st_size for f in directory.iterdir())
+                datasets.append((manifest_path.stat().st_mtime, size, directory))
+        total = sum(size for _, size, _ in datasets)
+        for _, size, directory in sorted(datasets):
+            if total <= self.max_bytes:
+                break
+            print(f"🧹 淘汰列式副本: {directory.name}")
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+
+
+columnar_cache = ColumnarCache()
@@ -0,0 +1,299 @@
+"""
+后台任务的作业队列。
+
+每种作业（submit/status/status_batch/analyze/chat）属于一个资源类别，每个资源类别有自己的优先级队列和固定数量的 worker：
+- browser: 占用浏览器上下文的作业，worker 数默认等于浏览器上下文池大小，多余的作业排队而不是挤在上下文池上；
+- llm: 调用 Gemini 的作业；
+- cpu: 本地解析/统计 Excel 的作业，同步处理函数在线程中执行。
+数字越小优先级越高，同优先级按提交顺序执行。处理函数抛出异常时按指数退避重试（重试等待期间不占用 worker），
+重试用尽后通过 on_event 回调把任务标记为失败。作业可以在排队或执行中取消。
+"""
+import asyncio
+import inspect
+import itertools
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+JOB_BROWSER_WORKERS = int(os.getenv("JOB_BROWSER_WORKERS", os.getenv("BROWSER_POOL_SIZE", "3")))
+JOB_LLM_WORKERS = int(os.getenv("JOB_LLM_WORKERS", "4"))
+JOB_CPU_WORKERS = int(os.getenv("JOB_CPU_WORKERS", "2"))
+JOB_RETRY_BASE_DELAY = float(os.getenv("JOB_RETRY_BASE_DELAY", "5"))
+JOB_RETRY_MAX_DELAY = float(os.getenv("JOB_RETRY_MAX_DELAY", "120"))
+
+
+@dataclass(frozen=True)
+class JobKind:
+    name: str
+    resource: str
+    priority: int
+    max_retries: int
+
+
+# 提交审批不是幂等的（重试可能重复提交申请），不自动重试；聊天中 Agent 也可能调用提交工具，同样不重试
+JOB_KINDS = {
+    kind.name: kind for kind in (
+        JobKind("submit", "browser", priority=0, max_retries=0),
+        JobKind("status", "browser", priority=1, max_retries=2),
+        JobKind("status_batch", "browser", priority=2, max_retries=2),
+        JobKind("analyze", "cpu", priority=1, max_retries=0),
+        JobKind("chat", "llm", priority=1, max_retries=0),
+    )
+}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _ignore_event(job_id: str, status: str, message: str, data: dict):
+    pass
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: JobKind
+    handler: Callable[..., Any]
+    kwargs: Dict[str, Any]
+    priority: int
+    max_retries: int
+    created_at: float = field(default_factory=time.time)
+    queued_at: float = field(default_factory=time.time)
+    attempts: int = 0
+    state: str = "queued"  # queued / running / retrying / succeeded / failed / cancelled
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    # 作业自己的状态回调，未设置时使用队列的 on_event
+    on_event: Optional[Callable[[str, str, str, dict], None]] = None
+    cancel_requested: bool = False
+    future: Optional[asyncio.Future] = None
+    _task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind.name,
+            "resource": self.kind.resource,
+            "priority": self.priority,
+            "state": self.state,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class _ResourcePool:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.size = max(1, workers)
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self.workers = []
+        self.running = 0
+        self.attempts = 0
+        self.counters = {"submitted": 0, "succeeded": 0, "failed": 0, "retried": 0, "cancelled": 0}
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+
+class JobQueue:
+    """
+    on_event: 任务状态回调 (task_id, status, message, data)，与 update_task_status 签名一致。
+    """
+    def __init__(self, on_event: Callable[[str, str, str, dict], None],
+                 workers: Optional[Dict[str, int]] = None,
+                 retry_base_delay: float = JOB_RETRY_BASE_DELAY, retry_max_delay: float = JOB_RETRY_MAX_DELAY):
+        self._on_event = on_event
+        self._worker_counts = workers or {"browser": JOB_BROWSER_WORKERS, "llm": JOB_LLM_WORKERS,
+                                          "cpu": JOB_CPU_WORKERS}
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self._pools: Dict[str, _ResourcePool] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._sequence = itertools.count()
+        self._retry_timers = set()
+        self._stopping = False
+
+    def start(self):
+        self._stopping = False
+        for resource, count in self._worker_counts.items():
+            pool = self._pools.get(resource)
+            if pool is None:
+                pool = self._pools[resource] = _ResourcePool(resource, count)
+            if not pool.workers:
+                pool.workers = [asyncio.create_task(self._worker(pool), name=f"job-{resource}-{i}")
+                                for i in range(pool.size)]
+
+    async def stop(self):
+        self._stopping = True
+        tasks = [worker for pool in self._pools.values() for worker in pool.workers] + list(self._retry_timers)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for pool in self._pools.values():
+            pool.workers = []
+        self._retry_timers.clear()
+
+    def submit(self, kind: str, job_id: str, handler: Callable[..., Any], priority: Optional[int] = None,
+               max_retries: Optional[int] = None, on_event: Optional[Callable[[str, str, str, dict], None]] = None,
+               **kwargs) -> Job:
+        """
+        提交作业并立即返回。handler 可以是协程函数或普通函数（在线程中执行），以 kwargs 调用。
+        job.future 在作业结束时得到 handler 的返回值（或异常），需要同步等待结果的调用方可以 await 它。
+        """
+        job_kind = JOB_KINDS[kind]
+        job = Job(job_id=job_id, kind=job_kind, handler=handler, kwargs=kwargs,
+                  priority=job_kind.priority if priority is None else priority,
+                  max_retries=job_kind.max_retries if max_retries is None else max_retries,
+                  on_event=on_event, future=asyncio.get_running_loop().create_future())
+        self._jobs[job_id] = job
+        pool = self._pools[job_kind.resource]
+        pool.counters["submitted"] += 1
+        self._enqueue(pool, job)
+        self._prune()
+        return job
+
+    async def run(self, kind: str, job_id: str, handler: Callable[..., Any], **kwargs) -> Any:
+        """
+        提交作业并等待结果。调用方直接拿到返回值或异常，没有对应的任务记录，因此不发出状态回调。
+        """
+        job = self.submit(kind, job_id, handler, on_event=_ignore_event, **kwargs)
+        return await asyncio.shield(job.future)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def is_cancelled(self, job_id: str) -> bool:
+        """
+        作业是否已被取消。在线程中运行的同步处理函数取消后仍会执行完，调用方据此忽略它之后写入的任务状态。
+        """
+        job = self._jobs.get(job_id)
+        return job is not None and (job.cancel_requested or job.state == "cancelled")
+
+    def cancel(self, job_id: str) -> bool:
+        job = self._jobs.get(job_id)
+        if job is None or job.state in ("succeeded", "failed", "cancelled"):
+            return False
+        job.cancel_requested = True
+        if job.state == "running" and job._task is not None:
+            # 同步处理函数已经在线程中运行时无法中断，只是不再等待其结果
+            job._task.cancel()
+        else:
+            # 排队或等待重试中的作业在出队时直接跳过
+            self._finish(job, "cancelled", error=JobCancelled("作业已取消"))
+            self._emit(job, "failed", "任务已取消", {"cancelled": True})
+        return True
+
+    def _emit(self, job: Job, status: str, message: str, data: dict):
+        (job.on_event or self._on_event)(job.job_id, status, message, data)
+
+    def _enqueue(self, pool: _ResourcePool, job: Job):
+        job.state = "queued"
+        job.queued_at = time.time()
+        pool.queue.put_nowait((job.priority, next(self._sequence), job))
+
+    def _finish(self, job: Job, state: str, result: Any = None, error: Optional[BaseException] = None):
+        job.state = state
+        job.finished_at = time.time()
+        pool = self._pools[job.kind.resource]
+        pool.counters[state] += 1
+        if error is not None:
+            job.error = str(error)
+        if job.future is not None and not job.future.done():
+            if error is not None:
+                job.future.set_exception(error)
+                # 没有调用方等待结果时避免 "exception was never retrieved" 警告
+                job.future.exception()
+            else:
+                job.future.set_result(result)
+
+    async def _call(self, job: Job):
+        if inspect.iscoroutinefunction(job.handler):
+            return await job.handler(**job.kwargs)
+        return await asyncio.to_thread(job.handler, **job.kwargs)
+
+    async def _worker(self, pool: _ResourcePool):
+        while True:
+            _, _, job = await pool.queue.get()
+            try:
+                if job.state == "cancelled":
+                    continue
+                await self._execute(pool, job)
+            finally:
+                pool.queue.task_done()
+
+    async def _execute(self, pool: _ResourcePool, job: Job):
+        job.state = "running"
+        job.attempts += 1
+        job.started_at = time.time()
+        pool.total_wait += job.started_at - job.queued_at
+        pool.running += 1
+        pool.attempts += 1
+        job._task = asyncio.create_task(self._call(job))
+        try:
+            result = await job._task
+        except asyncio.CancelledError:
+            if self._stopping:
+                # worker 本身被取消（服务关闭）
+                job._task.cancel()
+                raise
+            self._finish(job, "cancelled", error=JobCancelled("作业已取消"))
+            self._emit(job, "failed", "任务已取消", {"cancelled": True})
+        except Exception as e:
+            if job.attempts <= job.max_retries:
+                self._schedule_retry(pool, job, e)
+            else:
+                self._finish(job, "failed", error=e)
+                self._emit(job, "failed", f"任务执行失败: {e}", {"attempts": job.attempts})
+        else:
+            self._finish(job, "succeeded", result=result)
+        finally:
+            pool.running -= 1
+            pool.total_run += time.time() - job.started_at
+            job._task = None
+
+    def _schedule_retry(self, pool: _ResourcePool, job: Job, error: Exception):
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (job.attempts - 1))
+        job.state = "retrying"
+        job.error = str(error)
+        pool.counters["retried"] += 1
+        self._emit(job, "processing", f"第 {job.attempts} 次执行失败，{delay:.0f} 秒后重试: {error}",
+                   {"attempts": job.attempts})
+
+        async def _requeue():
+            try:
+                await asyncio.sleep(delay)
+                if job.state == "retrying":
+                    self._enqueue(pool, job)
+            finally:
+                self._retry_timers.discard(timer)
+
+        timer = asyncio.create_task(_requeue())
+        self._retry_timers.add(timer)
+
+    def _prune(self, keep: int = 1000):
+        # 只保留最近结束的作业用于查询，任务结果本身在 task_store 中
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        if len(finished) > keep:
+            for job in sorted(finished, key=lambda j: j.finished_at)[:len(finished) - keep]:
+                del self._jobs[job.job_id]
+
+    def metrics(self) -> dict:
+        resources = {}
+        for name, pool in self._pools.items():
+            resources[name] = {
+                "workers": pool.size,
+                "queued": pool.queue.qsize(),
+                "running": pool.running,
+                "retrying": sum(1 for job in self._jobs.values()
+                                if job.kind.resource == name and job.state == "retrying"),
+                **pool.counters,
+                "attempts": pool.attempts,
+                "avg_wait_seconds": round(pool.total_wait / pool.attempts, 3) if pool.attempts else 0.0,
+                "avg_run_seconds": round(pool.total_run / pool.attempts, 3) if pool.attempts else 0.0,
+            }
+        return {"resources": resources}
@@ -0,0 +1,130 @@
+"""
+需要 Gemini 阅读数据的自由分析需求（统计类需求由 report_analysis 在本地计算，不走这里）。
+
+数据部分由 prompt_payload 选择能满足需求的最紧凑编码并估算 token 数：
+- 不超过单次上限时一次发送；
+- 超过时按工作表（过大的工作表再按行）切块，map 阶段并发地对每块生成摘要（并发受 llm_clients 的上限约束），
+  reduce 阶段合并各块摘要得到最终结果，合并内容仍然过长时逐层合并。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import pandas as pd
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from llm_clients import get_llm, invoke_chain
+from prompt_payload import FULL_DATA_ENCODINGS, build_payload, encode_sheet, estimate_tokens, sheet_title
+from task_logging import map_in_context
+
+ANALYSIS_MODEL = os.getenv("ANALYSIS_MODEL", "gemini-2.5-flash")
+# 单次请求允许的数据 token 数，超过时改用 map-reduce
+ANALYSIS_SINGLE_PASS_MAX_TOKENS = int(os.getenv("ANALYSIS_SINGLE_PASS_MAX_TOKENS", "200000"))
+ANALYSIS_CHUNK_TOKENS = int(os.getenv("ANALYSIS_CHUNK_TOKENS", "50000"))
+ANALYSIS_MAP_CONCURRENCY = int(os.getenv("ANALYSIS_MAP_CONCURRENCY", "4"))
+
+_SINGLE_PASS_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
+## 任务目标
+你是一名资深数据分析师。你将收到一个工作簿的数据，每个工作表代表一个客户（工作表名即客户名称）。
+数据格式: {format_note}
+请根据用户的分析需求给出简洁、专业的分析结果。不要输出程序代码。
+"""),
+    ("human", "分析需求: {requirement}\n\n数据如下:\n---\n{data}\n---")
+])
+
+_MAP_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
+## 任务目标
+你是一名资深数据分析师。你将收到一个大型工作簿中的一部分数据（标明了所属工作表即客户名称，以及这是该工作表的第几部分）。
+数据格式: {format_note}
+请只针对这部分数据，提取与用户分析需求相关的事实和数值（例如行数、合计、最大/最小值、异常值），
+结果会与其他部分合并，因此必须保留客户名称和具体数值，不要做跨部分的推断。不要输出程序代码。
+"""),
+    ("human", "分析需求: {requirement}\n\n{chunk_title}\n---\n{data}\n---")
+])
+
+_REDUCE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
+## 任务目标
+你是一名资深数据分析师。下面是同一个工作簿按工作表/分块分别分析得到的部分结果。
+请合并这些部分结果，给出针对用户分析需求的最终结论；同一客户的多个部分需要合并计算（例如行数相加）。
+不要输出程序代码。
+"""),
+    ("human", "分析需求: {requirement}\n\n部分结果:\n---\n{partials}\n---")
+])
+
+
+def build_chunks(sheets: Dict[str, pd.DataFrame], encoding: str = "csv",
+                 chunk_tokens: int = ANALYSIS_CHUNK_TOKENS) -> List[dict]:
+    """
+    按工作表切块，完整数据编码下超过 chunk_tokens 的工作表按行拆分，每块都带上表头。
+    返回 [{"title", "data", "tokens"}]。
+    """
+    chunks = []
+    for sheet_name, df in sheets.items():
+        text = encode_sheet(df, encoding)
+        tokens = estimate_tokens(text)
+        if tokens <= chunk_tokens or len(df) <= 1 or encoding not in FULL_DATA_ENCODINGS:
+            chunks.append({"title": sheet_title(sheet_name, df), "data": text, "tokens": tokens})
+            continue
+        parts = -(-tokens // chunk_tokens)
+        rows_per_part = -(-len(df) // parts)
+        for index, start in enumerate(range(0, len(df), rows_per_part), start=1):
+            part_text = encode_sheet(df.iloc[start:start + rows_per_part], encoding)
+            chunks.append({
+                "title": f"{sheet_title(sheet_name, df)}，第 {index}/{parts} 部分（第 {start + 1} 行起）",
+                "data": part_text,
+                "tokens": estimate_tokens(part_text),
+            })
+    return chunks
+
+
+def _run(prompt: ChatPromptTemplate, inputs: dict) -> str:
+    chain = prompt | get_llm(ANALYSIS_MODEL) | StrOutputParser()
+    return invoke_chain(chain, inputs).strip()
+
+
+def _reduce(partials: List[str], requirement: str) -> str:
+    # 合并内容过长时先分组合并，再合并各组结果
+    groups, current, current_tokens = [], [], 0
+    for partial in partials:
+        tokens = estimate_tokens(partial)
+        if current and current_tokens + tokens > ANALYSIS_SINGLE_PASS_MAX_TOKENS:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(partial)
+        current_tokens += tokens
+    groups.append(current)
+    if len(groups) == 1:
+        return _run(_REDUCE_PROMPT, {"requirement": requirement, "partials": "\n\n".join(groups[0])})
+    print(f"🔁 部分结果过长，分 {len(groups)} 组逐层合并...")
+    with ThreadPoolExecutor(max_workers=ANALYSIS_MAP_CONCURRENCY) as executor:
+        merged = map_in_context(
+            executor, lambda group: _run(_REDUCE_PROMPT, {"requirement": requirement, "partials": "\n\n".join(group)}),
+            groups)
+    return _reduce(merged, requirement)
+
+
+def analyze_with_llm(sheets: Dict[str, pd.DataFrame], requirement: str) -> str:
+    """
+    根据数据量选择一次分析或 map-reduce 分析，返回 Gemini 的分析结果。
+    """
+    payload = build_payload(sheets, requirement)
+    options = ", ".join(f"{encoding}={tokens}" for encoding, tokens in payload["options"].items())
+    print(f"📦 可满足需求的数据编码 token 估算: {options}，选择 {payload['encoding']}")
+    if payload["tokens"] <= ANALYSIS_SINGLE_PASS_MAX_TOKENS:
+        print(f"🤖 数据约 {payload['tokens']} tokens，一次发送给 Gemini 分析...")
+        return _run(_SINGLE_PASS_PROMPT, {"requirement": requirement, "data": payload["text"],
+                                          "format_note": payload["format_note"]})
+
+    chunks = build_chunks(sheets, encoding=payload["encoding"])
+    print(f"🤖 数据约 {payload['tokens']} tokens，超过单次上限，拆分为 {len(chunks)} 块进行 map-reduce 分析...")
+    inputs = [{"requirement": requirement, "chunk_title": chunk["title"], "data": chunk["data"],
+               "format_note": payload["format_note"]} for chunk in chunks]
+    with ThreadPoolExecutor(max_workers=ANALYSIS_MAP_CONCURRENCY) as executor:
+        results = map_in_context(executor, lambda chunk_inputs: _run(_MAP_PROMPT, chunk_inputs), inputs)
+    partials = [f"{chunk['title']}\n{result}" for chunk, result in zip(chunks, results)]
+    print("🤖 各块分析完成，正在合并结果...")
+    return _reduce(partials, requirement)
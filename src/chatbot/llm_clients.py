@@ -0,0 +1,100 @@
+"""
+共享的 Gemini 客户端注册表。
+
+同样配置的 ChatGoogleGenerativeAI 只创建一次并在所有调用之间复用（复用底层连接），
+异步调用通过 ainvoke_chain 执行，不会阻塞 FastAPI 的事件循环；同步调用（在线程中运行的分析流程）
+使用 invoke_chain。两者都带有并发上限，并在遇到 429/配额限制时按退避重试。
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+# 同时进行的 Gemini 调用上限（异步和同步调用各自计数）
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+
+_llm_registry: dict = {}
+_registry_lock = threading.Lock()
+_sync_semaphore = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+_async_semaphores: dict = {}
+
+
+def get_llm(model: str = DEFAULT_MODEL, temperature: Optional[float] = None, **kwargs) -> ChatGoogleGenerativeAI:
+    """
+    按 (model, temperature, 其他参数) 返回共享的 LLM 实例，首次使用时才创建。
+    """
+    key = (model, temperature, json.dumps(kwargs, sort_keys=True, default=str))
+    with _registry_lock:
+        llm = _llm_registry.get(key)
+        if llm is None:
+            options = dict(kwargs)
+            if temperature is not None:
+                options["temperature"] = temperature
+            if os.getenv("GOOGLE_API_KEY"):
+                options.setdefault("google_api_key", os.getenv("GOOGLE_API_KEY"))
+            llm = ChatGoogleGenerativeAI(model=model, **options)
+            _llm_registry[key] = llm
+        return llm
+
+
+def _get_async_semaphore() -> asyncio.Semaphore:
+    # asyncio.Semaphore 绑定事件循环，每个循环各用一个
+    loop = asyncio.get_running_loop()
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _async_semaphores[loop] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return semaphore
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    text = f"{type(error).__name__}: {error}".lower()
+    return any(k in text for k in ("429", "resourceexhausted", "resource exhausted", "rate limit", "quota",
+                                   "503", "unavailable", "overloaded"))
+
+
+def _retry_delay(attempt: int, error: Exception) -> float:
+    # 优先使用服务端建议的等待时间，例如 "retry in 12.5s" / "retry_delay { seconds: 12 }"
+    match = re.search(r"retry(?:_delay)?\D{0,20}?(\d+(?:\.\d+)?)\s*s", str(error), re.IGNORECASE)
+    if match:
+        return float(match.group(1)) + random.uniform(0, 1)
+    return min(2 ** attempt, 30) + random.uniform(0, 1)
+
+
+async def ainvoke_chain(chain, inputs: dict):
+    """
+    异步执行 chain.ainvoke，受并发上限约束，遇到限流时重试。
+    """
+    async with _get_async_semaphore():
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                return await chain.ainvoke(inputs)
+            except Exception as e:
+                if attempt == LLM_MAX_RETRIES or not _is_rate_limited(e):
+                    raise
+                delay = _retry_delay(attempt, e)
+                print(f"⏳ Gemini 限流 ({type(e).__name__})，{delay:.1f} 秒后重试 (第 {attempt + 1} 次)...")
+                await asyncio.sleep(delay)
+
+
+def invoke_chain(chain, inputs: dict):
+    """
+    ainvoke_chain 的同步版本，供在线程中运行的分析流程使用。
+    """
+    with _sync_semaphore:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            try:
+                return chain.invoke(inputs)
+            except Exception as e:
+                if attempt == LLM_MAX_RETRIES or not _is_rate_limited(e):
+                    raise
+                delay = _retry_delay(attempt, e)
+                print(f"⏳ Gemini 限流 ({type(e).__name__})，{delay:.1f} 秒后重试 (第 {attempt + 1} 次)...")
+                time.sleep(delay)
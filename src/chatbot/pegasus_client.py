@@ -0,0 +1,218 @@
+"""
+Pegasus 操作记录的 HTTP 状态客户端。
+
+直接调用"操作记录"页面背后的 JSON 接口读取申请状态/执行状态和下载地址，不需要渲染页面。
+鉴权复用浏览器登录后保存的 cookie（与 download_file_from_veeva 相同的做法）。
+
+接口地址可以通过环境变量显式配置；未配置时，浏览器走一次 DOM 流程时会从页面自身发出的
+XHR 中学习接口地址和下载链接模板，并保存到 pegasus_endpoints.json，之后的查询直接走 HTTP。
+"""
+import json
+import os
+import re
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import urljoin
+
+import httpx
+
+PEGASUS_BASE_URL = 'https://pegasus-prod.veevasfa.com/'
+ENDPOINTS_PATH = Path("./pegasus_endpoints.json")
+DEFAULT_USER_AGENT = ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+                      "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+
+# 与应用同生命周期的共享 httpx 客户端（连接池 + keep-alive），由 close_http_client() 在关闭时释放
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, read=120.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def build_auth_headers(cookies: list, user_agent: Optional[str] = None) -> dict:
+    """
+    根据 cookie 列表（context.cookies() 或 storage_state 中的 cookies）构造请求头。
+    """
+    cookie_string = "; ".join([f"{c['name']}={c['value']}" for c in cookies])
+    return {'User-Agent': user_agent or DEFAULT_USER_AGENT, 'Cookie': cookie_string}
+
+
+def load_storage_state_cookies(storage_state_path: Path) -> list:
+    try:
+        with open(storage_state_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('cookies', [])
+    except (OSError, json.JSONDecodeError):
+        return []
+
+
+def load_endpoints() -> dict:
+    """
+    读取接口配置：环境变量优先，其次是之前学习到并保存在 pegasus_endpoints.json 中的值。
+    """
+    endpoints = {}
+    try:
+        with open(ENDPOINTS_PATH, 'r', encoding='utf-8') as f:
+            endpoints = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        pass
+    if os.getenv("PEGASUS_RECORD_LIST_API"):
+        endpoints['record_list_url'] = os.getenv("PEGASUS_RECORD_LIST_API")
+        endpoints['record_list_method'] = os.getenv("PEGASUS_RECORD_LIST_METHOD", "GET")
+    if os.getenv("PEGASUS_DOWNLOAD_URL_TEMPLATE"):
+        endpoints['download_url_template'] = os.getenv("PEGASUS_DOWNLOAD_URL_TEMPLATE")
+    if os.getenv("PEGASUS_APPLY_STATUS_KEY") and os.getenv("PEGASUS_EXEC_STATUS_KEY"):
+        endpoints['apply_status_key'] = os.getenv("PEGASUS_APPLY_STATUS_KEY")
+        endpoints['exec_status_key'] = os.getenv("PEGASUS_EXEC_STATUS_KEY")
+    return endpoints
+
+
+def save_endpoints(**updates):
+    endpoints = {}
+    try:
+        with open(ENDPOINTS_PATH, 'r', encoding='utf-8') as f:
+            endpoints = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        pass
+    endpoints.update(updates)
+    with open(ENDPOINTS_PATH, 'w', encoding='utf-8') as f:
+        json.dump(endpoints, f, ensure_ascii=False, indent=2)
+
+
+def find_record_list(payload) -> List[dict]:
+    """
+    在接口返回的 JSON 中找到记录列表（常见形态: data / data.list / data.records / rows ...）。
+    """
+    if isinstance(payload, list) and payload and all(isinstance(item, dict) for item in payload):
+        return payload
+    if isinstance(payload, dict):
+        for value in payload.values():
+            records = find_record_list(value)
+            if records:
+                return records
+    return []
+
+
+def find_record(records: List[dict], jira_ticket: str) -> Optional[dict]:
+    # 避免 ORI-1 误匹配到 ORI-12
+    pattern = re.compile(re.escape(jira_ticket) + r"(?!\d)")
+    for record in records:
+        if pattern.search(json.dumps(record, ensure_ascii=False)):
+            return record
+    return None
+
+
+def extract_statuses(record: dict, endpoints: Optional[dict] = None) -> Optional[tuple]:
+    """
+    从一条记录中取出 (申请状态, 执行状态)。字段名来自环境变量 PEGASUS_APPLY_STATUS_KEY / PEGASUS_EXEC_STATUS_KEY
+    或浏览器 DOM 流程中学习到的 apply_status_key / exec_status_key；字段名未知时返回 None，由调用方退回浏览器流程。
+    """
+    endpoints = endpoints if endpoints is not None else load_endpoints()
+    apply_key = endpoints.get('apply_status_key')
+    exec_key = endpoints.get('exec_status_key')
+    if not apply_key or not exec_key:
+        return None
+    application_status = str(record.get(apply_key) or "")
+    execution_status = str(record.get(exec_key) or "")
+    return application_status, execution_status
+
+
+def learn_status_keys(record: dict, application_status: str, execution_status: str) -> Optional[dict]:
+    """
+    根据 DOM 中显示的状态文字（例如 "申请状态: 已通过"）找出记录中对应的字段名。
+    两个字段都能唯一确定时返回 {"apply_status_key", "exec_status_key"}，否则返回 None。
+    """
+    def _match(text: str) -> Optional[str]:
+        keys = [k for k, v in record.items() if isinstance(v, str) and v.strip() and v.strip() in text]
+        return keys[0] if len(keys) == 1 else None
+
+    apply_key = _match(application_status)
+    exec_key = _match(execution_status)
+    if not apply_key or not exec_key or apply_key == exec_key:
+        return None
+    return {"apply_status_key": apply_key, "exec_status_key": exec_key}
+
+
+def learn_download_template(record: dict, href: str) -> Optional[str]:
+    """
+    根据 DOM 中拿到的下载链接和对应记录，推导出下载链接模板，例如 /api/export?id={id}。
+    """
+    for key, value in record.items():
+        if isinstance(value, (str, int)) and not isinstance(value, bool):
+            text = str(value)
+            if len(text) >= 3 and text in href:
+                return href.replace(text, "{" + key + "}")
+    return None
+
+
+def build_download_url(record: dict, template: Optional[str]) -> Optional[str]:
+    if template:
+        try:
+            return urljoin(PEGASUS_BASE_URL, template.format_map(record))
+        except (KeyError, ValueError):
+            return None
+    for key, value in record.items():
+        if isinstance(value, str) and ('download' in key.lower() or 'fileurl' in key.lower()) and value:
+            return urljoin(PEGASUS_BASE_URL, value)
+    return None
+
+
+class PegasusStatusClient:
+    """
+    通过 HTTP 直接查询 Pegasus 操作记录。endpoints 中没有记录列表接口时 available 为 False，
+    调用方应退回到浏览器 DOM 流程。
+    """
+    def __init__(self, headers: dict, endpoints: Optional[dict] = None, timeout: float = 30.0):
+        self.headers = headers
+        self.endpoints = endpoints if endpoints is not None else load_endpoints()
+        self.timeout = timeout
+
+    @property
+    def available(self) -> bool:
+        return bool(self.endpoints.get('record_list_url'))
+
+    async def fetch_records(self) -> List[dict]:
+        url = self.endpoints['record_list_url']
+        method = self.endpoints.get('record_list_method', 'GET').upper()
+        body = self.endpoints.get('record_list_body')
+        headers = dict(self.headers)
+        if body:
+            headers['Content-Type'] = 'application/json'
+        response = await get_http_client().request(method, url, headers=headers, content=body,
+                                                    follow_redirects=False, timeout=self.timeout)
+        # 会话过期时接口通常会 302 到登录页
+        if response.is_redirect or response.status_code in (401, 403):
+            raise PermissionError(f"Pegasus 接口拒绝访问 (HTTP {response.status_code})，会话可能已过期。")
+        response.raise_for_status()
+        return find_record_list(response.json())
+
+    async def get_ticket_status(self, jira_ticket: str) -> Optional[dict]:
+        """
+        返回 {"application_status", "execution_status", "download_url", "record"}；找不到工单或状态字段未知时返回 None。
+        """
+        records = await self.fetch_records()
+        record = find_record(records, jira_ticket)
+        if record is None:
+            return None
+        statuses = extract_statuses(record, self.endpoints)
+        if statuses is None:
+            return None
+        application_status, execution_status = statuses
+        return {
+            "application_status": application_status,
+            "execution_status": execution_status,
+            "download_url": build_download_url(record, self.endpoints.get('download_url_template')),
+            "record": record,
+        }
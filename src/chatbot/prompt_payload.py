@@ -0,0 +1,123 @@
+"""
+分析 Prompt 中数据部分的紧凑编码。
+
+可选的编码：
+- csv / tsv: 每个工作表的完整数据；
+- sample: 表头 + 前若干行样例；
+- stats: 每列的统计信息（非空数、唯一值数、数值列的最小/最大/平均/合计、文本列最常见的取值）。
+先根据分析需求判断哪些编码能满足需求，只对这些编码估算 token 数，选择其中最便宜的一种。
+"""
+import os
+import re
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+ANALYSIS_SAMPLE_ROWS = int(os.getenv("ANALYSIS_SAMPLE_ROWS", "20"))
+ANALYSIS_STATS_TOP_VALUES = int(os.getenv("ANALYSIS_STATS_TOP_VALUES", "5"))
+
+FULL_DATA_ENCODINGS = ("csv", "tsv")
+ENCODINGS = FULL_DATA_ENCODINGS + ("sample", "stats")
+
+FORMAT_NOTES = {
+    "csv": "每个工作表的完整数据，CSV 格式（第一行为表头）。",
+    "tsv": "每个工作表的完整数据，制表符分隔（第一行为表头）。",
+    "sample": f"每个工作表的表头和前 {ANALYSIS_SAMPLE_ROWS} 行样例（CSV 格式），不是完整数据，总行数见工作表标题。",
+    "stats": "每个工作表各列的统计信息（非空数、唯一值数、数值列的最小/最大/平均/合计、文本列最常见的取值），不是原始数据，总行数见工作表标题。",
+}
+
+# 只关心表结构/字段含义的需求，样例行即可
+_SCHEMA_KEYWORDS = re.compile(r"字段|列名|表头|结构|有哪些列|样例|示例|格式")
+# 只需要整体统计量的需求，列统计即可
+_STATS_KEYWORDS = re.compile(r"平均|均值|最大|最小|最高|最低|总和|合计|总数|缺失|空值|唯一|去重|分布|概况|概览|总体")
+# 需要逐行数据的需求，必须发送完整数据
+_FULL_DATA_KEYWORDS = re.compile(r"明细|每一行|每行|逐行|所有记录|列出|清单|按.{0,8}(分组|汇总|统计)|每个|各个|趋势|对比|筛选|查找|异常")
+
+_CJK_PATTERN = re.compile(r"[　-鿿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数：中日韩字符约 1 个 token，其余字符约 4 个字符 1 个 token。
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def acceptable_encodings(requirement: str) -> List[str]:
+    """
+    能满足该分析需求的编码。无法判断时只接受完整数据。
+    """
+    requirement = requirement or ""
+    if _FULL_DATA_KEYWORDS.search(requirement):
+        return list(FULL_DATA_ENCODINGS)
+    if _SCHEMA_KEYWORDS.search(requirement):
+        return list(ENCODINGS)
+    if _STATS_KEYWORDS.search(requirement):
+        return list(FULL_DATA_ENCODINGS) + ["stats"]
+    return list(FULL_DATA_ENCODINGS)
+
+
+def _format_number(value) -> str:
+    if pd.isna(value):
+        return ""
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+def _column_stats(df: pd.DataFrame) -> str:
+    lines = ["列名|类型|非空|唯一|统计"]
+    for column in df.columns:
+        series = df[column]
+        non_null = series.dropna()
+        if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+            detail = (f"min={_format_number(non_null.min())} max={_format_number(non_null.max())} "
+                      f"mean={_format_number(non_null.mean())} sum={_format_number(non_null.sum())}") if len(non_null) else ""
+            kind = "数值"
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            detail = f"min={non_null.min()} max={non_null.max()}" if len(non_null) else ""
+            kind = "日期"
+        else:
+            top = non_null.astype(str).value_counts().head(ANALYSIS_STATS_TOP_VALUES)
+            detail = "top: " + ", ".join(f"{value}({count})" for value, count in top.items())
+            kind = "文本"
+        lines.append(f"{column}|{kind}|{len(non_null)}|{non_null.nunique()}|{detail}")
+    return "\n".join(lines)
+
+
+def encode_sheet(df: pd.DataFrame, encoding: str) -> str:
+    if encoding == "csv":
+        return df.to_csv(index=False)
+    if encoding == "tsv":
+        return df.to_csv(index=False, sep="\t")
+    if encoding == "sample":
+        return df.head(ANALYSIS_SAMPLE_ROWS).to_csv(index=False)
+    if encoding == "stats":
+        return _column_stats(df)
+    raise ValueError(f"未知的编码: {encoding}")
+
+
+def sheet_title(sheet_name: str, df: pd.DataFrame) -> str:
+    return f"工作表(客户): {sheet_name}（共 {len(df)} 行）"
+
+
+def encode_sheets(sheets: Dict[str, pd.DataFrame], encoding: str) -> str:
+    return "\n\n".join(f"{sheet_title(name, df)}\n{encode_sheet(df, encoding)}" for name, df in sheets.items())
+
+
+def build_payload(sheets: Dict[str, pd.DataFrame], requirement: str, encoding: Optional[str] = None) -> dict:
+    """
+    返回 {"encoding", "text", "tokens", "format_note", "options": {编码: token 数}, "acceptable": [...]}。
+    只编码能满足需求的候选（options 也只包含这些编码），选择其中 token 数最少的一种。指定 encoding 时直接使用该编码。
+    """
+    acceptable = [encoding] if encoding else acceptable_encodings(requirement)
+    texts = {candidate: encode_sheets(sheets, candidate) for candidate in acceptable}
+    options = {candidate: estimate_tokens(text) for candidate, text in texts.items()}
+    chosen = min(acceptable, key=options.get)
+    return {
+        "encoding": chosen,
+        "text": texts[chosen],
+        "tokens": options[chosen],
+        "format_note": FORMAT_NOTES[chosen],
+        "options": options,
+        "acceptable": acceptable,
+    }
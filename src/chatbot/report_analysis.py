@@ -0,0 +1,100 @@
+"""
+Pegasus 报告的本地统计分析。
+
+每个工作表代表一个客户，"数据量"的计算规则是确定的：
+- 表头中有包含 "count" 的列（例如 `count(*)`）时，取该列第一行的数值；
+- 否则取工作表的数据行数；
+- 无法取得有效数值时记为 0。
+所有客户（包括数据量为 0 的）按数据量降序排名，输出 排名/客户名称/数据量 三列。
+这里直接用 pandas 计算，不再把整个工作簿发给 Gemini；LLM 只用于可选的文字摘要。
+"""
+import math
+import os
+from typing import Dict, Optional
+
+import pandas as pd
+
+from columnar_cache import columnar_cache
+from workbook_reader import SheetSummary, summarize_workbook
+
+RANKING_COLUMNS = ["排名", "客户名称", "数据量"]
+# 是否在统计结果之外再调用 Gemini 生成一段文字摘要（只发送排名表，不发送原始数据）
+ANALYSIS_NARRATIVE_SUMMARY = os.getenv("ANALYSIS_NARRATIVE_SUMMARY", "false").lower() == "true"
+
+
+def find_count_column(columns) -> Optional[str]:
+    for column in columns:
+        if "count" in str(column).lower():
+            return column
+    return None
+
+
+def sheet_data_volume(df: pd.DataFrame) -> int:
+    count_column = find_count_column(df.columns)
+    if count_column is None:
+        return int(len(df))
+    values = pd.to_numeric(df[count_column], errors="coerce")
+    if values.empty or pd.isna(values.iloc[0]):
+        return 0
+    return int(values.iloc[0])
+
+
+def summary_data_volume(summary: SheetSummary) -> int:
+    """
+    与 sheet_data_volume 相同的规则，作用于流式读取得到的工作表摘要。
+    """
+    if summary.error:
+        raise ValueError(summary.error)
+    if summary.count_column is None:
+        return summary.row_count
+    try:
+        value = float(summary.count_value)
+    except (TypeError, ValueError):
+        return 0
+    return 0 if math.isnan(value) else int(value)
+
+
+def rank_volumes(volumes: Dict[str, int]) -> pd.DataFrame:
+    """
+    volumes: {客户名称: 数据量}（按工作表顺序），返回按数据量降序的排名表。
+    """
+    ranking = pd.DataFrame({"客户名称": list(volumes.keys()), "数据量": list(volumes.values())}, columns=RANKING_COLUMNS[1:])
+    # 稳定排序，数据量相同的客户保持工作表原有顺序
+    ranking = ranking.sort_values("数据量", ascending=False, kind="mergesort").reset_index(drop=True)
+    ranking.insert(0, "排名", range(1, len(ranking) + 1))
+    return ranking
+
+
+def _collect_volumes(items, volume_of) -> Dict[str, int]:
+    volumes = {}
+    for sheet_name, item in items:
+        try:
+            volumes[sheet_name] = volume_of(item)
+        except Exception as e:
+            print(f"⚠️ 统计工作表 '{sheet_name}' 时出错，数据量记为 0: {e}")
+            volumes[sheet_name] = 0
+    return volumes
+
+
+def compute_customer_ranking(sheets: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    sheets: {工作表名(客户名称): DataFrame}，返回按数据量降序的排名表。
+    """
+    return rank_volumes(_collect_volumes(sheets.items(), sheet_data_volume))
+
+
+def compute_customer_ranking_from_workbook(excel_path: str) -> pd.DataFrame:
+    """
+    优先从列式副本读取；没有副本时流式读取工作簿（不把工作表加载成 DataFrame），并在后台生成副本供下次使用。
+    """
+    summaries = columnar_cache.summarize(excel_path)
+    if summaries is None:
+        summaries = summarize_workbook(excel_path)
+        columnar_cache.convert_in_background(excel_path)
+    else:
+        print(f"🗃️ 使用列式副本统计: {os.path.basename(excel_path)}")
+    return rank_volumes(_collect_volumes(((s.name, s) for s in summaries), summary_data_volume))
+
+
+def ranking_to_csv(ranking: pd.DataFrame) -> str:
+    return ranking.to_csv(index=False).strip()
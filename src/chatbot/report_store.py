@@ -0,0 +1,205 @@
+"""
+已下载 Pegasus 报告的本地存储。
+
+报告文件按内容 SHA-256 存放（相同内容只存一份），索引按 Jira 工单记录下载地址、ETag、大小、
+工作表列表和下载时间。重复的状态查询/分析直接命中本地文件，不再走网络；
+按总大小和存放时长淘汰旧报告。
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional
+
+REPORT_CACHE_DIR = Path(os.getenv("REPORT_CACHE_DIR", "./report_cache"))
+REPORT_CACHE_MAX_BYTES = int(float(os.getenv("REPORT_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+REPORT_CACHE_MAX_AGE = float(os.getenv("REPORT_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_sheet_names(path: Path) -> List[str]:
+    """
+    直接读取 xlsx 压缩包中的 workbook.xml 获取工作表名称，不需要加载整个工作簿。
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            workbook_xml = archive.read('xl/workbook.xml').decode('utf-8')
+        return re.findall(r'<sheet\b[^>]*\bname="([^"]*)"', workbook_xml)
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return []
+
+
+class ReportStore:
+    """
+    index.json 结构: {jira_ticket: {filename, sha256, etag, size, sheets, source_url, downloaded_at}}
+    报告文件保存在 blobs/<sha256>.xlsx，文件的修改时间即最近访问时间。
+
+    多进程共用同一目录时（浏览器服务负责写入，API worker 只读），index.json 变化后自动重新加载；
+    读取时只更新报告文件的修改时间，不写索引；写入在文件锁内基于磁盘上的最新索引合并和淘汰。
+    """
+    def __init__(self, root: Path = REPORT_CACHE_DIR,
+                 max_bytes: int = REPORT_CACHE_MAX_BYTES,
+                 max_age: float = REPORT_CACHE_MAX_AGE):
+        self.root = Path(root)
+        self.blob_dir = self.root / "blobs"
+        self.index_path = self.root / "index.json"
+        self.lock_path = self.root / "index.lock"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self._index = {}
+        self._index_mtime = None
+        self._reload_if_changed()
+
+    def _index_stat(self) -> Optional[tuple]:
+        try:
+            stat = self.index_path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload_if_changed(self):
+        mtime = self._index_stat()
+        if mtime == self._index_mtime:
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self._index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._index = {}
+        self._index_mtime = mtime
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_suffix(f'.json.{os.getpid()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.index_path)
+        self._index_mtime = self._index_stat()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blob_dir / f"{sha256}.xlsx"
+
+    def get(self, jira_ticket: str) -> Optional[dict]:
+        """
+        返回工单对应的报告元数据（含 path），文件已被删除时返回 None。
+        """
+        with self._lock:
+            self._reload_if_changed()
+            entry = self._index.get(jira_ticket)
+            if not entry:
+                return None
+            path = self.blob_path(entry['sha256'])
+            try:
+                os.utime(path)
+            except OSError:
+                return None
+            return dict(entry, path=str(path))
+
+    def find_by_filename(self, filename: str) -> Optional[dict]:
+        with self._lock:
+            self._reload_if_changed()
+            for jira_ticket, entry in self._index.items():
+                if entry['filename'] == filename:
+                    break
+            else:
+                return None
+        return self.get(jira_ticket)
+
+    def resolve_path(self, filename_or_path: str) -> Path:
+        """
+        将报告文件名（例如 Veeva_Report_ORI-12345.xlsx）解析为存储中的实际路径；
+        不在存储中的文件按原路径返回。
+        """
+        path = Path(filename_or_path)
+        if path.exists():
+            return path
+        entry = self.find_by_filename(path.name)
+        return Path(entry['path']) if entry else path
+
+    def put(self, jira_ticket: str, file_path: str, etag: Optional[str] = None,
+            source_url: Optional[str] = None) -> dict:
+        """
+        将刚下载的文件移入存储并登记元数据，返回登记后的条目（含 path）。
+        """
+        src = Path(file_path)
+        sha256 = file_sha256(src)
+        blob = self.blob_path(sha256)
+        entry = {
+            "filename": src.name,
+            "sha256": sha256,
+            "etag": etag,
+            "source_url": source_url,
+        }
+        with self._lock, self._file_lock():
+            if blob.exists():
+                src.unlink()
+                os.utime(blob)
+            else:
+                shutil.move(str(src), blob)
+            entry.update(size=blob.stat().st_size, sheets=read_sheet_names(blob), downloaded_at=time.time())
+            # 基于磁盘上的最新索引合并，避免覆盖其他进程写入的条目
+            self._index_mtime = None
+            self._reload_if_changed()
+            self._index[jira_ticket] = entry
+            # 刚写入的报告即使单独超过上限也保留，否则调用方拿到的 path 已被删除
+            self._evict(keep=jira_ticket)
+            self._save_index()
+        print(f"🗄️ 报告已存入本地缓存: {src.name} ({entry['size']} bytes, {len(entry['sheets'])} 个工作表)")
+        return dict(entry, path=str(blob))
+
+    def _last_accessed(self, sha256: str) -> float:
+        try:
+            return self.blob_path(sha256).stat().st_mtime
+        except OSError:
+            return 0.0
+
+    def _evict(self, keep: Optional[str] = None):
+        now = time.time()
+        for jira_ticket, entry in list(self._index.items()):
+            if jira_ticket == keep:
+                continue
+            if now - entry['downloaded_at'] > self.max_age or not self.blob_path(entry['sha256']).exists():
+                del self._index[jira_ticket]
+        # 按最近访问时间（报告文件的修改时间）淘汰，直到总大小低于上限（同一内容被多个工单引用时只计算一次）
+        by_access = sorted(self._index.items(), key=lambda item: self._last_accessed(item[1]['sha256']))
+        total = sum({e['sha256']: e['size'] for e in self._index.values()}.values())
+        for jira_ticket, entry in by_access:
+            if total <= self.max_bytes:
+                break
+            if jira_ticket == keep:
+                continue
+            del self._index[jira_ticket]
+            if all(e['sha256'] != entry['sha256'] for e in self._index.values()):
+                total -= entry['size']
+        referenced = {e['sha256'] for e in self._index.values()}
+        for blob in self.blob_dir.glob("*.xlsx"):
+            if blob.stem not in referenced:
+                print(f"🧹 淘汰本地缓存的报告: {blob.name}")
+                blob.unlink(missing_ok=True)
+
+
+report_store = ReportStore()
@@ -0,0 +1,214 @@
+"""
+结构化的 Schema 目录。
+
+把 schemas.json 中的 CREATE TABLE 语句解析成表/列/类型/外键，并据此建立表之间的关联图：
+- 选中的多张表之间缺少直接关联时，只补充最短关联路径上的中间表；
+- 每个表集合渲染出的紧凑 Prompt 片段会被缓存；
+- schemas.json 修改后（mtime 变化）自动重新加载。
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas.json")
+
+# 列名中的角色词对应的表，例如 coaching_rep_id / coaching_manager_id / created_by 都指向 users
+ROLE_REFERENCES = {
+    "rep": "users",
+    "manager": "users",
+    "user": "users",
+    "owner": "users",
+    "created_by": "users",
+    "modified_by": "users",
+}
+# 不以 _id 结尾但保存的是维度表 id 的列
+EXPLICIT_REFERENCES = {
+    ("coachings", "state"): "object_states",
+}
+DISPLAY_COLUMNS = ("label", "name")
+
+_COLUMN_PATTERN = re.compile(r"`(\w+)`\s+([A-Za-z]+(?:\([^)]*\))?)")
+
+
+@dataclass
+class Column:
+    name: str
+    type: str
+    references: Optional[str] = None
+
+
+@dataclass
+class TableSchema:
+    name: str
+    ddl: str
+    columns: List[Column] = field(default_factory=list)
+
+    @property
+    def display_columns(self) -> List[str]:
+        return [c.name for c in self.columns if c.name in DISPLAY_COLUMNS]
+
+
+def _parse_columns(table: str, ddl: str) -> List[Column]:
+    # 去掉 "CREATE TABLE `name` (" 前缀，只解析列定义部分
+    body = ddl[ddl.find("(") + 1:] if "(" in ddl else ddl
+    return [Column(name, _normalize_type(column_type)) for name, column_type in _COLUMN_PATTERN.findall(body)]
+
+
+def _normalize_type(column_type: str) -> str:
+    # 只大写类型关键字，ENUM/SET 的取值保持原样（SQL 中按原值比较）
+    keyword, paren, rest = column_type.partition("(")
+    return keyword.upper() + paren + rest
+
+
+def _infer_reference(table: str, column: str, table_names: Iterable[str]) -> Optional[str]:
+    if (table, column) in EXPLICIT_REFERENCES:
+        return EXPLICIT_REFERENCES[(table, column)]
+    if column in ROLE_REFERENCES:
+        return ROLE_REFERENCES[column]
+    if not column.endswith("_id") or column == "id":
+        return None
+    stem = column[:-3]
+    # record_type_id -> object_record_types / record_types
+    for candidate in table_names:
+        if candidate != table and (candidate == f"{stem}s" or candidate.endswith(f"_{stem}s")):
+            return candidate
+    role = stem.rsplit("_", 1)[-1]
+    return ROLE_REFERENCES.get(role)
+
+
+class SchemaCatalog:
+    def __init__(self, path: str = DEFAULT_SCHEMA_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime: Optional[float] = None
+        self.raw: Dict[str, str] = {}
+        self.tables: Dict[str, TableSchema] = {}
+        self.version = ""
+        # 两张表之间可能有多个外键（例如 coachings.coaching_rep_id 和 coaching_manager_id 都指向 users）
+        self._graph: Dict[str, Dict[str, List[Tuple[str, str]]]] = {}
+        self._prompt_cache: Dict[frozenset, str] = {}
+        self.reload_if_changed()
+
+    def _load(self) -> Dict[str, str]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            print(f"❌ 错误: Schema文件 '{self.path}' 未找到。")
+        except json.JSONDecodeError:
+            print(f"❌ 错误: Schema文件 '{self.path}' 不是一个有效的JSON格式。")
+        return {}
+
+    def reload_if_changed(self) -> bool:
+        """
+        schemas.json 的修改时间变化时重新解析，返回是否发生了重新加载。
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime and self._mtime is not None:
+            return False
+        with self._lock:
+            if mtime == self._mtime and self._mtime is not None:
+                return False
+            raw = self._load()
+            tables = {}
+            for name, ddl in raw.items():
+                tables[name] = TableSchema(name, ddl, _parse_columns(name, ddl))
+            graph: Dict[str, Dict[str, List[Tuple[str, str]]]] = {name: {} for name in tables}
+            for table in tables.values():
+                for column in table.columns:
+                    target = _infer_reference(table.name, column.name, tables.keys())
+                    if target in tables:
+                        column.references = target
+                        graph[table.name].setdefault(target, []).append(
+                            (f"{table.name}.{column.name}", f"{target}.id"))
+                        if target != table.name:
+                            graph[target].setdefault(table.name, []).append(
+                                (f"{target}.id", f"{table.name}.{column.name}"))
+            self.raw = raw
+            self.tables = tables
+            self._graph = graph
+            self.version = hashlib.sha256(json.dumps(raw, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+            self._prompt_cache = {}
+            if self._mtime is not None:
+                print(f"🔄 schemas.json 已变化，Schema 目录已重新加载 (版本 {self.version})。")
+            self._mtime = mtime
+            return True
+
+    def _shortest_path(self, start: str, goal: str) -> List[str]:
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = previous[node]
+                return path[::-1]
+            for neighbor in self._graph.get(node, {}):
+                if neighbor not in previous:
+                    previous[neighbor] = node
+                    queue.append(neighbor)
+        return []
+
+    def expand_with_join_path(self, tables: List[str]) -> List[str]:
+        """
+        在选中的表之间补充最短关联路径上的中间表，保持原有顺序。
+        """
+        selected = [t for t in tables if t in self.tables]
+        result = list(selected)
+        for a, b in combinations(selected, 2):
+            for table in self._shortest_path(a, b):
+                if table not in result:
+                    result.append(table)
+        return result
+
+    def join_conditions(self, tables: List[str]) -> List[str]:
+        table_set = set(tables)
+        conditions = []
+        for table in tables:
+            for target, edges in self._graph.get(table, {}).items():
+                for left, right in edges:
+                    if target in table_set and left.startswith(f"{table}.") and right.endswith(".id"):
+                        conditions.append(f"{left} = {right}")
+        return conditions
+
+    def render_prompt(self, tables: List[str]) -> str:
+        """
+        渲染选中表的紧凑 Schema 描述（每表一行 + 关联条件），按表集合缓存。
+        """
+        key = frozenset(tables)
+        cached = self._prompt_cache.get(key)
+        if cached is not None:
+            return cached
+        lines = []
+        for name in tables:
+            table = self.tables.get(name)
+            if table is None:
+                continue
+            columns = ", ".join(
+                f"`{c.name}` {c.type}" + (f" -> {c.references}.id" if c.references else "")
+                for c in table.columns
+            )
+            line = f"{name}({columns})"
+            if table.display_columns:
+                line += f"  -- 显示列: {', '.join(table.display_columns)}"
+            lines.append(line)
+        conditions = self.join_conditions(tables)
+        if conditions:
+            lines.append("-- 关联条件: " + "; ".join(conditions))
+            pairs = [(left.split(".", 1)[0], right) for left, right in (c.split(" = ", 1) for c in conditions)]
+            if len(set(pairs)) < len(pairs):
+                lines.append("-- 同一张表有多个关联条件时代表不同角色，按问题语义选择；同时需要多个角色时为该表使用不同别名分别关联")
+        fragment = "\n".join(lines)
+        self._prompt_cache[key] = fragment
+        return fragment
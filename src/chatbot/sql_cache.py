@@ -0,0 +1,208 @@
+"""
+自然语言 → SQL 的两级缓存。
+
+第一级：规范化后的问题文本 + schema 版本精确匹配。
+第二级：字符 n-gram 余弦相似度超过阈值，且两个问题的差异只在"请/帮我/查询/一下"这类无关词上，
+避免"会议随访"和"电话随访"这种只差几个字但含义不同的问题误命中。
+缓存持久化到磁盘，按最近使用淘汰，并统计命中率。
+多个 worker 共用同一个缓存文件：保存时在文件锁内与磁盘上的条目合并后原子替换，不会覆盖其他 worker 写入的条目。
+"""
+import asyncio
+import difflib
+import fcntl
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import Optional
+
+SQL_CACHE_PATH = Path(os.getenv("SQL_CACHE_PATH", "./sql_cache.json"))
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "500"))
+SQL_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("SQL_CACHE_SIMILARITY_THRESHOLD", "0.75"))
+
+# 不影响查询含义的词，两个问题只在这些词上不同时视为同一个问题
+_FILLER_PATTERN = re.compile(
+    r"请|帮我|帮忙|麻烦|我想|我要|想要|需要|查询|查找|查一下|查看|查|找出|找|一下|给我|所有的|所有|全部的|全部|"
+    r"相关的|相关|数据|记录|的|了|吧|呢|啊|一个"
+)
+_WHITESPACE_PATTERN = re.compile(r"\s+", re.UNICODE)
+
+
+def normalize_query(text: str) -> str:
+    """
+    只折叠空白、全半角和大小写。比较符、小数点、负号、百分号和数字都会改变查询含义（"金额<100" 与 "金额>100"、
+    "1.5" 与 "15"），必须保留在缓存键中。
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return _WHITESPACE_PATTERN.sub("", text)
+
+
+def _ngram_vector(text: str) -> Counter:
+    grams = Counter()
+    for n in (2, 3):
+        grams.update(text[i:i + n] for i in range(len(text) - n + 1))
+    if not grams and text:
+        grams[text] += 1
+    return grams
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b.get(gram, 0) for gram, count in a.items())
+    norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def _differences_are_filler(a: str, b: str) -> bool:
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if _FILLER_PATTERN.sub("", a[i1:i2]) or _FILLER_PATTERN.sub("", b[j1:j2]):
+            return False
+    return True
+
+
+class SqlCache:
+    def __init__(self, path: Path = SQL_CACHE_PATH,
+                 max_entries: int = SQL_CACHE_MAX_ENTRIES,
+                 threshold: float = SQL_CACHE_SIMILARITY_THRESHOLD):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._vectors: dict = {}
+        self._stats = {"exact_hits": 0, "similar_hits": 0, "misses": 0}
+        self._load()
+
+    @staticmethod
+    def _key(normalized: str, schema_version: str) -> str:
+        return f"{schema_version}:{normalized}"
+
+    def _read_entries(self) -> list:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return []
+        for entry in data.get("entries", []):
+            # 规范化规则可能变化，按原始问题重新计算
+            entry["normalized"] = normalize_query(entry["query"])
+        return data.get("entries", [])
+
+    def _load(self):
+        for entry in self._read_entries():
+            key = self._key(entry["normalized"], entry["schema_version"])
+            self._entries[key] = entry
+            self._vectors[key] = _ngram_vector(entry["normalized"])
+
+    def _merge_locked(self, disk_entries: list):
+        """
+        合并磁盘上其他 worker 写入的条目（需持有 _lock）：本进程的条目视为最近使用，排在后面。
+        """
+        merged: "OrderedDict[str, dict]" = OrderedDict()
+        for entry in disk_entries:
+            merged[self._key(entry["normalized"], entry["schema_version"])] = entry
+        for key, entry in self._entries.items():
+            merged.pop(key, None)
+            merged[key] = entry
+        while len(merged) > self.max_entries:
+            merged.popitem(last=False)
+        self._entries = merged
+        self._vectors = {key: self._vectors.get(key) or _ngram_vector(entry["normalized"])
+                         for key, entry in merged.items()}
+
+    def _save(self):
+        lock_path = self.path.with_suffix('.lock')
+        with self._save_lock, open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                disk_entries = self._read_entries()
+                with self._lock:
+                    self._merge_locked(disk_entries)
+                    entries = list(self._entries.values())
+                tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({"entries": entries}, f, ensure_ascii=False, indent=1)
+                os.replace(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, query: str, schema_version: str) -> Optional[dict]:
+        """
+        返回 {"sql", "tier": "exact"|"similar", "score", "query"}，未命中返回 None。
+        """
+        normalized = normalize_query(query)
+        key = self._key(normalized, schema_version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key)
+                entry["hits"] += 1
+                self._stats["exact_hits"] += 1
+                return {"sql": entry["sql"], "tier": "exact", "score": 1.0, "query": entry["query"]}
+
+            vector = _ngram_vector(normalized)
+            best_key, best_score = None, 0.0
+            for candidate_key, candidate_vector in self._vectors.items():
+                if self._entries[candidate_key]["schema_version"] != schema_version:
+                    continue
+                score = _cosine(vector, candidate_vector)
+                if score > best_score:
+                    best_key, best_score = candidate_key, score
+            if best_key and best_score >= self.threshold and \
+                    _differences_are_filler(normalized, self._entries[best_key]["normalized"]):
+                entry = self._entries[best_key]
+                self._entries.move_to_end(best_key)
+                entry["hits"] += 1
+                self._stats["similar_hits"] += 1
+                return {"sql": entry["sql"], "tier": "similar", "score": best_score, "query": entry["query"]}
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, query: str, schema_version: str, sql: str):
+        normalized = normalize_query(query)
+        key = self._key(normalized, schema_version)
+        with self._lock:
+            self._entries[key] = {
+                "query": query,
+                "normalized": normalized,
+                "schema_version": schema_version,
+                "sql": sql,
+                "created_at": time.time(),
+                "hits": 0,
+            }
+            self._entries.move_to_end(key)
+            self._vectors[key] = _ngram_vector(normalized)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._vectors.pop(evicted_key, None)
+        try:
+            self._save()
+        except OSError as e:
+            print(f"⚠️ 保存 SQL 缓存失败: {e}")
+
+    async def aput(self, query: str, schema_version: str, sql: str):
+        """
+        put 的异步版本：读写磁盘放到线程中执行，不阻塞事件循环。
+        """
+        await asyncio.to_thread(self.put, query, schema_version, sql)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self._stats.values())
+            hits = self._stats["exact_hits"] + self._stats["similar_hits"]
+            return dict(self._stats, size=len(self._entries),
+                        hit_rate=round(hits / lookups, 4) if lookups else 0.0)
+
+
+sql_cache = SqlCache()
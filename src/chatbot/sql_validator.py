@@ -0,0 +1,239 @@
+"""
+生成 SQL 的本地校验。
+
+在把 SQL 填进 Pegasus 表单（需要数小时的人工审批）之前，先在本地确认它能执行：
+1. 只允许单条 SELECT / WITH 查询；
+2. FROM / JOIN 中的表、"别名.列" 引用必须存在于 Schema 目录；
+3. 用 schemas.json 的表结构建一个内存 SQLite 库，对 SQL 做 EXPLAIN QUERY PLAN 和 LIMIT 0 试运行，
+   捕获不存在的表/列、歧义列，并从执行计划中发现缺少关联条件的笛卡尔积。
+MySQL 特有的写法（INTERVAL、NOW() 等）在 SQLite 中先做等价改写或注册同名空函数；
+仍然无法解析的语法只记为警告，不阻止提交。
+"""
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from schema_catalog import SchemaCatalog
+
+# 常见的 MySQL 函数，在 SQLite 中注册为返回 NULL 的同名函数，仅用于让语句通过解析
+_MYSQL_FUNCTIONS = (
+    "now", "curdate", "curtime", "sysdate", "date_sub", "date_add", "adddate", "subdate", "date_format",
+    "datediff", "timestampdiff", "timestampadd", "year", "month", "day", "dayofmonth", "dayofweek", "week",
+    "weekofyear", "quarter", "hour", "minute", "last_day", "str_to_date", "from_unixtime", "unix_timestamp",
+    "concat", "concat_ws", "if", "extract", "regexp", "convert_tz", "yearweek", "dayname", "monthname",
+)
+_INTERVAL_PATTERN = re.compile(
+    r"\bINTERVAL\s+('[^']*'|-?\d+(?:\.\d+)?|\w+)\s+"
+    r"(?:MICROSECOND|SECOND|MINUTE|HOUR|DAY|WEEK|MONTH|QUARTER|YEAR)S?\b", re.IGNORECASE)
+_TIMESTAMP_UNIT_PATTERN = re.compile(
+    r"\b(TIMESTAMPDIFF|TIMESTAMPADD)\s*\(\s*(MICROSECOND|SECOND|MINUTE|HOUR|DAY|WEEK|MONTH|QUARTER|YEAR)\s*,",
+    re.IGNORECASE)
+_EXTRACT_PATTERN = re.compile(r"\bEXTRACT\s*\(\s*(\w+)\s+FROM\b", re.IGNORECASE)
+_STRING_LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_TABLE_REFERENCE_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN)\s+`?(\w+)`?(?:\s+(?:AS\s+)?`?(\w+)`?)?", re.IGNORECASE)
+_QUALIFIED_COLUMN_PATTERN = re.compile(r"`?(\w+)`?\.`?(\w+)`?")
+_CTE_PATTERN = re.compile(r"(?:\bWITH(?:\s+RECURSIVE)?|,)\s*`?(\w+)`?\s+AS\s*\(", re.IGNORECASE)
+_FORBIDDEN_PATTERN = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|DROP|ALTER|CREATE|TRUNCATE|GRANT|REVOKE|CALL)\b", re.IGNORECASE)
+_SAFE_TYPE_PATTERN = re.compile(r"\w+(?:\(\d+(?:,\s*\d+)?\))?")
+# 这些关键字后面的括号是子查询/列表而不是函数调用
+_NON_FUNCTION_WORDS = {
+    "from", "join", "in", "exists", "as", "on", "where", "and", "or", "not", "select", "union", "all", "any",
+    "some", "with", "using", "lateral", "values", "having", "by", "then", "else", "when", "is",
+}
+_TRAILING_WORD_PATTERN = re.compile(r"(\w+)\s*$")
+# 拆分条件表达式，每一段是一个（或一组 BETWEEN ... AND ...）谓词
+_PREDICATE_SPLIT_PATTERN = re.compile(
+    r"\b(?:SELECT|FROM|JOIN|ON|WHERE|AND|OR|HAVING|GROUP\s+BY|ORDER\s+BY|LIMIT|UNION)\b", re.IGNORECASE)
+_WORD_PATTERN = re.compile(r"\b[A-Za-z_]\w*\b")
+_SQL_KEYWORDS = {
+    "where", "on", "join", "left", "right", "inner", "outer", "cross", "full", "group", "order", "limit",
+    "having", "union", "using", "natural", "as", "select", "set", "straight_join", "lateral", "window",
+}
+# SQLite 报出这些错误时说明 SQL 本身有问题，其余（多为方言语法差异）只记为警告
+_HARD_ERRORS = ("no such table", "no such column", "ambiguous column", "wrong number of arguments")
+
+
+@dataclass
+class ValidationResult:
+    ok: bool
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    tables: List[str] = field(default_factory=list)
+
+    def feedback(self) -> str:
+        """
+        给 SQL 生成器的修正提示。
+        """
+        return "\n".join(f"- {message}" for message in self.errors + self.warnings)
+
+
+def _strip_literals(sql: str) -> str:
+    return _STRING_LITERAL_PATTERN.sub("''", sql)
+
+
+def _function_call_mask(sql: str) -> List[bool]:
+    """
+    标出每个字符是否直接位于函数调用的括号内，例如 TRIM(LEADING 'x' FROM u.name) 中的 FROM 不是表引用。
+    """
+    mask = []
+    stack: List[bool] = []
+    for index, char in enumerate(sql):
+        if char == "(":
+            word = _TRAILING_WORD_PATTERN.search(sql[max(0, index - 64):index])
+            stack.append(word is not None and word.group(1).lower() not in _NON_FUNCTION_WORDS)
+        elif char == ")" and stack:
+            stack.pop()
+        mask.append(bool(stack) and stack[-1])
+    return mask
+
+
+def _table_references(sql: str) -> List[tuple]:
+    mask = _function_call_mask(sql)
+    return [match.groups() for match in _TABLE_REFERENCE_PATTERN.finditer(sql) if not mask[match.start()]]
+
+
+def _plan_table_name(detail: str) -> str:
+    # "SCAN x" / "SCAN TABLE users AS u"（旧版本 SQLite）
+    tokens = detail.split()
+    if len(tokens) > 1 and tokens[1] == "TABLE":
+        tokens = tokens[1:]
+    if len(tokens) > 3 and tokens[2] == "AS":
+        return tokens[3]
+    return tokens[1] if len(tokens) > 1 else ""
+
+
+def to_sqlite_dialect(sql: str) -> str:
+    """
+    将常见的 MySQL 写法改写为 SQLite 能解析的形式（只为校验，不改变提交的 SQL）。
+    """
+    sql = _INTERVAL_PATTERN.sub(r"\1", sql)
+    sql = _TIMESTAMP_UNIT_PATTERN.sub(lambda m: f"{m.group(1)}('{m.group(2).upper()}',", sql)
+    sql = _EXTRACT_PATTERN.sub(lambda m: f"EXTRACT('{m.group(1).upper()}',", sql)
+    return sql
+
+
+class SqlValidator:
+    def __init__(self, catalog: SchemaCatalog):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._connection_version: Optional[str] = None
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # Schema 目录热加载后重建内存库
+        if self._connection is None or self._connection_version != self.catalog.version:
+            if self._connection is not None:
+                self._connection.close()
+            connection = sqlite3.connect(":memory:", check_same_thread=False)
+            for name in _MYSQL_FUNCTIONS:
+                connection.create_function(name, -1, lambda *args: None)
+            for table in self.catalog.tables.values():
+                columns = ", ".join(
+                    f'"{c.name}" {c.type if _SAFE_TYPE_PATTERN.fullmatch(c.type) else "TEXT"}'
+                    for c in table.columns
+                )
+                connection.execute(f'CREATE TABLE "{table.name}" ({columns})')
+            self._connection = connection
+            self._connection_version = self.catalog.version
+        return self._connection
+
+    def _check_references(self, sql: str, result: ValidationResult) -> Dict[str, str]:
+        """
+        检查表和 "别名.列" 引用，返回 {别名或表名: 表名}。
+        """
+        stripped = _strip_literals(to_sqlite_dialect(sql))
+        cte_names = {name.lower() for name in _CTE_PATTERN.findall(stripped)}
+        aliases: Dict[str, str] = {}
+        for table, alias in _table_references(stripped):
+            if table.lower() in cte_names or table.lower() in _SQL_KEYWORDS:
+                continue
+            if table not in self.catalog.tables:
+                result.errors.append(f"表 `{table}` 不存在于数据库表结构中。")
+                continue
+            if table not in result.tables:
+                result.tables.append(table)
+            aliases[table] = table
+            if alias and alias.lower() not in _SQL_KEYWORDS:
+                aliases[alias] = table
+        for qualifier, column in _QUALIFIED_COLUMN_PATTERN.findall(stripped):
+            table = aliases.get(qualifier)
+            if table is None:
+                continue
+            if column not in {c.name for c in self.catalog.tables[table].columns}:
+                result.errors.append(f"列 `{qualifier}.{column}` 不存在: 表 `{table}` 中没有 `{column}` 列。")
+        return aliases
+
+    def _joined_groups(self, sql: str, names: List[str], aliases: Dict[str, str]) -> Dict[str, str]:
+        """
+        根据 ON/WHERE 中同时引用两张表的谓词（包括 BETWEEN、<、> 等非等值条件）把表连成组，返回 {名字: 组代表}。
+        """
+        group = {name: name for name in names}
+
+        def find(name: str) -> str:
+            while group[name] != name:
+                name = group[name]
+            return name
+
+        columns = {name: {c.name for c in self.catalog.tables[aliases[name]].columns}
+                   for name in names if aliases.get(name) in self.catalog.tables}
+        for fragment in _PREDICATE_SPLIT_PATTERN.split(_strip_literals(to_sqlite_dialect(sql))):
+            referenced = {qualifier for qualifier, _ in _QUALIFIED_COLUMN_PATTERN.findall(fragment)
+                          if qualifier in group}
+            bare = _WORD_PATTERN.findall(_QUALIFIED_COLUMN_PATTERN.sub(" ", fragment))
+            referenced.update(name for name, table_columns in columns.items()
+                              if any(word in table_columns for word in bare))
+            referenced = sorted(referenced)
+            for other in referenced[1:]:
+                group[find(other)] = find(referenced[0])
+        return {name: find(name) for name in names}
+
+    def _dry_run(self, sql: str, result: ValidationResult, aliases: Dict[str, str]):
+        statement = to_sqlite_dialect(sql)
+        with self._lock:
+            connection = self._get_connection()
+            try:
+                plan = connection.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+                connection.execute(f"SELECT * FROM ({statement}) LIMIT 0").fetchall()
+            except sqlite3.Error as e:
+                message = str(e)
+                if any(marker in message.lower() for marker in _HARD_ERRORS):
+                    result.errors.append(f"试运行失败: {message}")
+                else:
+                    result.warnings.append(f"本地试运行未能解析该语句（可能是 MySQL 方言差异）: {message}")
+                return
+        # 顶层有多个全表扫描且没有 SEARCH 时，可能是表之间缺少关联条件（笛卡尔积，结果行数 = 各表行数相乘）；
+        # 非等值关联（BETWEEN、<、>）同样表现为多个 SCAN，只有没有任何谓词同时引用这些表时才报错
+        top_level = [row[3] for row in plan if row[1] == 0]
+        scans = [detail for detail in top_level if detail.startswith("SCAN ") and "CONSTANT ROW" not in detail]
+        searches = [detail for detail in top_level if detail.startswith("SEARCH ")]
+        if len(scans) > 1 and not searches:
+            names = list(dict.fromkeys(_plan_table_name(detail) for detail in scans))
+            groups = self._joined_groups(sql, names, aliases)
+            if len(set(groups.values())) > 1:
+                result.errors.append(f"表 {', '.join(names)} 之间缺少关联条件，会产生笛卡尔积。")
+
+    def validate(self, sql: str) -> ValidationResult:
+        result = ValidationResult(ok=False)
+        statement = sql.strip().rstrip(";").strip()
+        if not statement:
+            result.errors.append("SQL 为空。")
+            return result
+        stripped = _strip_literals(statement)
+        if ";" in stripped:
+            result.errors.append("只能包含一条 SQL 语句。")
+        if not re.match(r"\s*(SELECT|WITH)\b", stripped, re.IGNORECASE):
+            result.errors.append("只允许 SELECT 查询语句。")
+        elif _FORBIDDEN_PATTERN.search(stripped):
+            result.errors.append("查询中不能包含修改数据或表结构的语句。")
+        if result.errors:
+            return result
+
+        aliases = self._check_references(statement, result)
+        if not result.errors:
+            self._dry_run(statement, result, aliases)
+        result.ok = not result.errors
+        return result
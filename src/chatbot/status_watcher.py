@@ -0,0 +1,179 @@
+"""
+Pegasus 工单状态后台轮询器。
+
+通过 /api/submit-query 提交的工单会登记到这里，由一个调度循环定期用一次批量查询检查所有待处理工单，
+未变化的工单按指数退避延长轮询间隔。工单执行成功后文件会被自动下载，并通过回调推送完成事件，
+用户不再需要反复询问"查一下 ORI-xxxx 的状态"。
+"""
+import asyncio
+import os
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+# 首次轮询的间隔和退避上限（秒）
+WATCH_MIN_INTERVAL = float(os.getenv("STATUS_WATCH_MIN_INTERVAL", "60"))
+WATCH_MAX_INTERVAL = float(os.getenv("STATUS_WATCH_MAX_INTERVAL", "1800"))
+WATCH_BACKOFF_FACTOR = float(os.getenv("STATUS_WATCH_BACKOFF", "1.5"))
+# 超过该时长仍未完成的工单停止轮询
+WATCH_MAX_AGE = float(os.getenv("STATUS_WATCH_MAX_AGE", str(3 * 24 * 3600)))
+# 调度循环的检查周期
+WATCH_TICK = float(os.getenv("STATUS_WATCH_TICK", "15"))
+# 连续这么多次查询都找不到工单卡片或查询出错时停止跟踪（刚提交的申请可能还没出现在操作记录中，不能第一次就放弃）
+WATCH_MAX_ERRORS = int(os.getenv("STATUS_WATCH_MAX_ERRORS", "3"))
+
+_TERMINAL_FAILURE_KEYWORDS = ("reject", "fail", "拒绝", "驳回", "失败")
+
+
+class WatchedTicket:
+    def __init__(self, jira_ticket: str, task_id: str):
+        self.jira_ticket = jira_ticket
+        self.task_ids = {task_id}
+        self.registered_at = time.time()
+        self.interval = WATCH_MIN_INTERVAL
+        # 刚提交的申请需要审批，首次检查也等一个最小间隔
+        self.next_check_at = time.monotonic() + WATCH_MIN_INTERVAL
+        self.checks = 0
+        self.errors = 0
+        self.last_result: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "jira_ticket": self.jira_ticket,
+            "task_ids": sorted(self.task_ids),
+            "registered_at": self.registered_at,
+            "interval": self.interval,
+            "checks": self.checks,
+            "errors": self.errors,
+            "last_result": self.last_result,
+        }
+
+
+def classify_status_result(result: str) -> str:
+    """
+    将一次状态查询的结果归类为 downloaded / failed / error / pending。
+    error 表示查询本身没有得到状态（找不到工单卡片、导航或下载出错），连续多次后由轮询器按失败处理。
+    """
+    if "成功下载" in result:
+        return "downloaded"
+    status_match = re.search(r"申请状态是: '([^']*)', 执行状态是: '([^']*)'", result)
+    if status_match:
+        if any(k in " ".join(status_match.groups()).lower() for k in _TERMINAL_FAILURE_KEYWORDS):
+            return "failed"
+        return "pending"
+    if result.lstrip().startswith(("❌", "😭")) or "错误" in result or "失败" in result:
+        return "error"
+    return "pending"
+
+
+class StatusWatcher:
+    """
+    check_batch: 批量查询函数，参数为工单列表，返回 {jira_ticket: 结果字符串}
+    on_event: 事件回调 (task_id, status, message, data)
+    """
+    def __init__(self,
+                 check_batch: Callable[[List[str]], Awaitable[Dict[str, str]]],
+                 on_event: Callable[[str, str, str, dict], None]):
+        self._check_batch = check_batch
+        self._on_event = on_event
+        self._tickets: Dict[str, WatchedTicket] = {}
+        self._runner: Optional[asyncio.Task] = None
+
+    def register(self, jira_ticket: str, task_id: str):
+        watched = self._tickets.get(jira_ticket)
+        if watched:
+            watched.task_ids.add(task_id)
+        else:
+            self._tickets[jira_ticket] = WatchedTicket(jira_ticket, task_id)
+        print(f"👀 已开始后台跟踪工单 {jira_ticket} 的状态。")
+
+    def unregister(self, jira_ticket: str):
+        self._tickets.pop(jira_ticket, None)
+
+    def pending(self) -> List[dict]:
+        return [watched.to_dict() for watched in self._tickets.values()]
+
+    def start(self):
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def _emit(self, watched: WatchedTicket, status: str, message: str, data: dict):
+        for task_id in watched.task_ids:
+            try:
+                self._on_event(task_id, status, message, data)
+            except Exception as e:
+                print(f"❌ 推送工单 {watched.jira_ticket} 的事件失败: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ 状态轮询循环出错: {e}")
+            await asyncio.sleep(WATCH_TICK)
+
+    async def poll_once(self):
+        now = time.monotonic()
+        for jira_ticket, watched in list(self._tickets.items()):
+            if time.time() - watched.registered_at > WATCH_MAX_AGE:
+                self.unregister(jira_ticket)
+                self._emit(watched, "failed", f"工单 {jira_ticket} 长时间未执行完成，已停止后台跟踪。",
+                           {"jira_ticket": jira_ticket, "last_result": watched.last_result})
+        due = [t for t, w in self._tickets.items() if w.next_check_at <= now]
+        if not due:
+            return
+
+        # 先按当前间隔排好下一次检查，批量查询整体失败时也不会每个周期都重试
+        for jira_ticket in due:
+            self._tickets[jira_ticket].next_check_at = now + self._tickets[jira_ticket].interval
+        print(f"🔄 后台轮询 {len(due)} 个工单的状态...")
+        results = await self._check_batch(due)
+        for jira_ticket in due:
+            watched = self._tickets.get(jira_ticket)
+            result = results.get(jira_ticket)
+            if watched is None or result is None:
+                continue
+            watched.checks += 1
+            outcome = classify_status_result(result)
+            if outcome == "downloaded":
+                self.unregister(jira_ticket)
+                file_match = re.search(r"'([^']+\.xlsx)'", result)
+                downloaded_file = file_match.group(1) if file_match else None
+                self._emit(watched, "completed", f"工单 {jira_ticket} 已执行完成，文件已自动下载", {
+                    "jira_ticket": jira_ticket,
+                    "result": result,
+                    "file": downloaded_file,
+                    "status": "executed",
+                    "download_url": f"/api/download/{downloaded_file}" if downloaded_file else None,
+                })
+            elif outcome == "failed":
+                self.unregister(jira_ticket)
+                self._emit(watched, "failed", f"工单 {jira_ticket} 未能执行: {result}",
+                           {"jira_ticket": jira_ticket, "result": result})
+            elif outcome == "error" and watched.errors + 1 >= WATCH_MAX_ERRORS:
+                self.unregister(jira_ticket)
+                self._emit(watched, "failed",
+                           f"工单 {jira_ticket} 连续 {watched.errors + 1} 次查询失败，已停止后台跟踪: {result}",
+                           {"jira_ticket": jira_ticket, "result": result})
+            else:
+                watched.errors = watched.errors + 1 if outcome == "error" else 0
+                if result != watched.last_result:
+                    # 状态有变化（例如已审批、执行中），推送进度并恢复到最小轮询间隔
+                    watched.interval = WATCH_MIN_INTERVAL
+                    self._emit(watched, "processing", f"工单 {jira_ticket} 当前状态: {result}",
+                               {"jira_ticket": jira_ticket, "result": result})
+                else:
+                    watched.interval = min(watched.interval * WATCH_BACKOFF_FACTOR, WATCH_MAX_INTERVAL)
+                watched.next_check_at = time.monotonic() + watched.interval
+            watched.last_result = result
@@ -0,0 +1,114 @@
+"""
+本地表选择器。
+
+启动时根据 schemas.json 为每张表建立一个 BM25 文档（表名、列名、中文同义词），
+对自然语言问题在毫秒级内给出相关表排名，替代一次 Gemini 往返。
+只有在置信度不足（没有任何表得分超过阈值）时，调用方才需要退回到 LLM 选表。
+"""
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# 中文业务词到表的映射；schemas.json 中只有英文 DDL，中文问题靠这里对上表
+TABLE_SYNONYMS: Dict[str, List[str]] = {
+    "coachings": ["协访", "协访记录", "辅导", "陪访", "coaching"],
+    "object_record_types": ["记录类型", "类型", "record type"],
+    "picklist_values": ["选项", "选项值", "选项列表", "下拉", "picklist"],
+    "users": ["用户", "员工", "代表", "经理", "人员", "姓名", "邮箱", "区域", "大区"],
+    "object_states": ["状态", "state"],
+    "custom_settings": ["配置", "设置", "自定义设置", "配置项", "setting"],
+}
+
+TABLE_SELECTOR_MIN_SCORE = float(os.getenv("TABLE_SELECTOR_MIN_SCORE", "1.0"))
+# 得分不低于最高分该比例的表都会被选中（例如协访 + 记录类型）
+TABLE_SELECTOR_RELATIVE_CUTOFF = float(os.getenv("TABLE_SELECTOR_RELATIVE_CUTOFF", "0.35"))
+
+_STOPWORDS = {"id", "the", "of", "a", "an", "and", "or", "to", "for", "in", "on", "by", "with", "all"}
+_COLUMN_PATTERN = re.compile(r"`(\w+)`\s+[A-Za-z]+")
+_CJK_RUN_PATTERN = re.compile(r"[一-鿿]+")
+_WORD_PATTERN = re.compile(r"[a-zA-Z]+")
+
+
+def _english_tokens(text: str) -> List[str]:
+    tokens = []
+    for word in _WORD_PATTERN.findall(text.replace("_", " ")):
+        word = word.lower()
+        if word in _STOPWORDS:
+            continue
+        # 简单的单复数归一: coachings -> coaching, values -> value
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def _cjk_tokens(text: str) -> List[str]:
+    tokens = []
+    for run in _CJK_RUN_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def tokenize(text: str) -> List[str]:
+    return _english_tokens(text) + _cjk_tokens(text)
+
+
+class TableSelector:
+    """
+    基于 BM25 的表排名。schemas: {表名: CREATE TABLE 语句}
+    """
+    def __init__(self, schemas: Dict[str, str], synonyms: Optional[Dict[str, List[str]]] = None,
+                 k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.synonyms = synonyms if synonyms is not None else TABLE_SYNONYMS
+        self._all_synonyms = sorted({s.lower() for values in self.synonyms.values() for s in values},
+                                    key=len, reverse=True)
+        self._docs: Dict[str, Counter] = {}
+        for table, ddl in schemas.items():
+            tokens = _english_tokens(table) * 3  # 表名本身权重更高
+            for column in _COLUMN_PATTERN.findall(ddl):
+                tokens.extend(_english_tokens(column))
+            for synonym in self.synonyms.get(table, []):
+                tokens.extend(tokenize(synonym))
+                tokens.extend([f"syn:{synonym.lower()}"] * 2)
+            self._docs[table] = Counter(tokens)
+        self._avg_len = (sum(sum(doc.values()) for doc in self._docs.values()) / len(self._docs)) if self._docs else 0
+        doc_freq = Counter(token for doc in self._docs.values() for token in doc)
+        n_docs = len(self._docs)
+        self._idf = {token: math.log(1 + (n_docs - df + 0.5) / (df + 0.5)) for token, df in doc_freq.items()}
+
+    def _query_tokens(self, query: str) -> List[str]:
+        lowered = query.lower()
+        tokens = tokenize(query)
+        tokens.extend(f"syn:{synonym}" for synonym in self._all_synonyms if synonym in lowered)
+        return tokens
+
+    def rank(self, query: str) -> List[Tuple[str, float]]:
+        query_tokens = Counter(self._query_tokens(query))
+        scores = []
+        for table, doc in self._docs.items():
+            doc_len = sum(doc.values())
+            score = 0.0
+            for token, query_count in query_tokens.items():
+                tf = doc.get(token, 0)
+                if not tf:
+                    continue
+                norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * doc_len / self._avg_len))
+                score += self._idf.get(token, 0.0) * norm * query_count
+            scores.append((table, score))
+        return sorted(scores, key=lambda item: item[1], reverse=True)
+
+    def select(self, query: str) -> Tuple[List[str], bool]:
+        """
+        返回 (选中的表, 是否有把握)。没有把握时调用方应改用 LLM 选表。
+        """
+        ranked = self.rank(query)
+        if not ranked or ranked[0][1] < TABLE_SELECTOR_MIN_SCORE:
+            return [], False
+        cutoff = ranked[0][1] * TABLE_SELECTOR_RELATIVE_CUTOFF
+        return [table for table, score in ranked if score > 0 and score >= cutoff], True
@@ -0,0 +1,199 @@
+"""
+任务事件总线（SSE）。
+
+每个任务一个频道：
+- 最近 TASK_EVENT_BUFFER 个事件保存在定长环形缓冲区中，每个事件带递增的 id，
+  客户端重连时通过 Last-Event-ID 补发错过的事件，晚连接的客户端也能看到之前的进度；
+- 同一任务可以有多个订阅者（多个浏览器标签页），每个订阅者有自己的有界队列，
+  跟不上的订阅者会被断开，由客户端带 Last-Event-ID 重连补发，而不是无限堆积；
+- 空闲时每隔 TASK_EVENT_HEARTBEAT 秒发送一次注释行心跳，防止代理断开长连接；
+- 任务结束 TASK_EVENT_TTL 秒后（或未结束但 TASK_EVENT_IDLE_TTL 秒无新事件）且没有订阅者时回收频道；
+- 多进程部署时任务可能在别的进程中执行，本进程的频道收不到事件。订阅时可以传入 poll 回调（读取共享的任务存储），
+  频道中没有本进程发布的事件时每隔 TASK_EVENT_POLL_INTERVAL 秒轮询一次，状态变化时推送，任务结束时推送并关闭流。
+publish 可以在任意线程调用，事件会转交到事件循环所在线程处理。
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+TASK_EVENT_BUFFER = int(os.getenv("TASK_EVENT_BUFFER", "200"))
+TASK_EVENT_SUBSCRIBER_QUEUE = int(os.getenv("TASK_EVENT_SUBSCRIBER_QUEUE", "500"))
+TASK_EVENT_HEARTBEAT = float(os.getenv("TASK_EVENT_HEARTBEAT", "15"))
+TASK_EVENT_TTL = float(os.getenv("TASK_EVENT_TTL", "600"))
+TASK_EVENT_IDLE_TTL = float(os.getenv("TASK_EVENT_IDLE_TTL", "86400"))
+TASK_EVENT_GC_INTERVAL = float(os.getenv("TASK_EVENT_GC_INTERVAL", "60"))
+TASK_EVENT_POLL_INTERVAL = float(os.getenv("TASK_EVENT_POLL_INTERVAL", "2"))
+
+# 订阅者队列中的结束标记：任务结束或订阅者跟不上时放入
+_CLOSE = object()
+
+
+class _Channel:
+    def __init__(self, buffer_size: int):
+        self.events = deque(maxlen=buffer_size)
+        self.next_id = 1
+        self.subscribers = set()
+        self.finished_at: Optional[float] = None
+        self.updated_at = time.time()
+        # 是否有本进程 publish 的事件；没有时说明任务由其他进程执行，需要轮询任务存储
+        self.local = False
+
+
+class TaskEventBus:
+    def __init__(self, buffer_size: int = TASK_EVENT_BUFFER, subscriber_queue: int = TASK_EVENT_SUBSCRIBER_QUEUE):
+        self.buffer_size = buffer_size
+        self.subscriber_queue = subscriber_queue
+        self._channels: Dict[str, _Channel] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._gc_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """
+        在事件循环中调用（例如 FastAPI startup），绑定事件循环并启动回收任务。
+        """
+        self._loop = asyncio.get_running_loop()
+        if self._gc_task is None:
+            self._gc_task = asyncio.create_task(self._gc_loop())
+
+    async def stop(self):
+        if self._gc_task is not None:
+            self._gc_task.cancel()
+            try:
+                await self._gc_task
+            except asyncio.CancelledError:
+                pass
+            self._gc_task = None
+        for channel in self._channels.values():
+            for queue in channel.subscribers:
+                self._close_subscriber(queue)
+
+    def publish(self, task_id: str, payload: dict, final: bool = False):
+        """
+        发布事件，final=True 表示任务已结束（completed/failed），订阅者收到后结束流。
+        """
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is not loop:
+                loop.call_soon_threadsafe(self._publish, task_id, payload, final)
+                return
+        self._publish(task_id, payload, final)
+
+    def _publish(self, task_id: str, payload: dict, final: bool, local: bool = True):
+        channel = self._channels.get(task_id)
+        if channel is None:
+            channel = self._channels[task_id] = _Channel(self.buffer_size)
+        if local:
+            channel.local = True
+        event = (channel.next_id, json.dumps(payload, ensure_ascii=False))
+        channel.next_id += 1
+        channel.events.append(event)
+        channel.updated_at = time.time()
+        if final:
+            channel.finished_at = channel.updated_at
+        for queue in list(channel.subscribers):
+            try:
+                queue.put_nowait(event)
+                if final:
+                    queue.put_nowait(_CLOSE)
+            except asyncio.QueueFull:
+                # 跟不上的订阅者直接断开，客户端重连后从环形缓冲区补发
+                channel.subscribers.discard(queue)
+                self._close_subscriber(queue)
+
+    @staticmethod
+    def _close_subscriber(queue: asyncio.Queue):
+        while True:
+            try:
+                queue.put_nowait(_CLOSE)
+                return
+            except asyncio.QueueFull:
+                queue.get_nowait()
+
+    def has_task(self, task_id: str) -> bool:
+        return task_id in self._channels
+
+    async def subscribe(self, task_id: str, last_event_id: Optional[int] = None,
+                        heartbeat: float = TASK_EVENT_HEARTBEAT,
+                        poll: Optional[Callable[[], Optional[Tuple[dict, bool]]]] = None,
+                        poll_interval: float = TASK_EVENT_POLL_INTERVAL) -> AsyncIterator[str]:
+        """
+        生成 SSE 文本块：先补发 id 大于 last_event_id 的缓存事件，再推送新事件；任务结束后结束。
+        poll: 同步回调，返回任务当前的 (payload, final)，未知时返回 None；在线程中调用。
+        """
+        channel = self._channels.get(task_id)
+        if channel is None:
+            channel = self._channels[task_id] = _Channel(self.buffer_size)
+        queue = asyncio.Queue(maxsize=self.subscriber_queue)
+        # 补发与订阅之间没有 await，不会漏掉或重复事件
+        backlog = [event for event in channel.events if last_event_id is None or event[0] > last_event_id]
+        finished = channel.finished_at is not None
+        if not finished:
+            channel.subscribers.add(queue)
+        try:
+            for event_id, data in backlog:
+                yield f"id: {event_id}\ndata: {data}\n\n"
+            if finished:
+                return
+            last_polled = channel.events[-1][1] if channel.events else None
+            last_sent = time.monotonic()
+            wait = heartbeat if poll is None else 0
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=wait)
+                except asyncio.TimeoutError:
+                    wait = heartbeat if poll is None else min(heartbeat, poll_interval)
+                    if poll is not None and not channel.local:
+                        polled = await asyncio.to_thread(poll)
+                        snapshot = json.dumps(polled[0], ensure_ascii=False) if polled else None
+                        if snapshot is not None and snapshot != last_polled:
+                            last_polled = snapshot
+                            self._publish(task_id, polled[0], polled[1], local=False)
+                            continue
+                    if time.monotonic() - last_sent >= heartbeat:
+                        last_sent = time.monotonic()
+                        yield ": ping\n\n"
+                    continue
+                last_sent = time.monotonic()
+                if item is _CLOSE:
+                    return
+                event_id, data = item
+                yield f"id: {event_id}\ndata: {data}\n\n"
+        finally:
+            channel.subscribers.discard(queue)
+            channel.updated_at = time.time()
+
+    def stats(self) -> dict:
+        return {
+            "tasks": len(self._channels),
+            "subscribers": sum(len(c.subscribers) for c in self._channels.values()),
+            "buffered_events": sum(len(c.events) for c in self._channels.values()),
+        }
+
+    def collect_garbage(self, now: Optional[float] = None) -> int:
+        now = now or time.time()
+        expired = [
+            task_id for task_id, channel in self._channels.items()
+            if not channel.subscribers and (
+                (channel.finished_at is not None and now - channel.finished_at > TASK_EVENT_TTL)
+                or now - channel.updated_at > TASK_EVENT_IDLE_TTL)
+        ]
+        for task_id in expired:
+            del self._channels[task_id]
+        return len(expired)
+
+    async def _gc_loop(self):
+        while True:
+            await asyncio.sleep(TASK_EVENT_GC_INTERVAL)
+            removed = self.collect_garbage()
+            if removed:
+                print(f"🧹 回收了 {removed} 个已结束任务的事件缓存")
+
+
+task_event_bus = TaskEventBus()
@@ -0,0 +1,197 @@
+"""
+后台任务的日志捕获。
+
+进程启动时安装一次 stdout 路由器，之后不再替换 sys.stdout：
+- 当前上下文（contextvars，线程池中的 asyncio.to_thread / run_in_threadpool 会继承）绑定了任务时，
+  print 的内容写入该任务的 TaskLogger；ThreadPoolExecutor.submit/map 不会复制上下文，
+  需要在线程池中输出任务日志时使用 map_in_context；
+- 否则照常写到控制台。
+并发执行的任务因此各自收到自己的日志。TaskLogger 先把日志行缓存起来，由一个后台线程每隔
+TASK_LOG_FLUSH_INTERVAL 秒（或缓存达到 TASK_LOG_BATCH_SIZE 行时）合并成一个事件发出，
+每个任务最多保留 TASK_LOG_MAX_LINES 行，超出部分只计数，避免输出频繁的任务压垮 SSE。
+"""
+import contextvars
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, List, Optional
+
+TASK_LOG_FLUSH_INTERVAL = float(os.getenv("TASK_LOG_FLUSH_INTERVAL", "0.5"))
+TASK_LOG_BATCH_SIZE = int(os.getenv("TASK_LOG_BATCH_SIZE", "50"))
+TASK_LOG_MAX_LINES = int(os.getenv("TASK_LOG_MAX_LINES", "2000"))
+# 任务日志是否同时输出到控制台
+TASK_LOG_ECHO = os.getenv("TASK_LOG_ECHO", "false").lower() == "true"
+
+_current_logger: contextvars.ContextVar[Optional["TaskLogger"]] = contextvars.ContextVar("task_logger", default=None)
+
+
+def _level_of(line: str) -> str:
+    if line.startswith(("❌", "Traceback", "错误")) or "Error" in line.split(":", 1)[0]:
+        return "error"
+    if line.startswith("⚠️") or line.startswith("警告"):
+        return "warning"
+    return "info"
+
+
+class TaskLogger:
+    """
+    emit(task_id, entries, dropped): 批量发出日志，entries 为 [{"ts", "level", "message"}]，
+    dropped 为因超出上限而丢弃的累计行数。
+    emit_lock 在取出并发出一批日志的整个过程中持有；发布任务最终状态时也持有它，
+    保证刷新线程不会在最终状态之后再发出日志；最终状态发布后调用 close()，之后的输出只写到控制台。
+    """
+    def __init__(self, task_id: str, emit: Callable[[str, List[dict], int], None],
+                 batch_size: int = TASK_LOG_BATCH_SIZE, max_lines: int = TASK_LOG_MAX_LINES):
+        self.task_id = task_id
+        self._emit = emit
+        self._batch_size = batch_size
+        self._max_lines = max_lines
+        self._lock = threading.Lock()
+        self.emit_lock = threading.RLock()
+        self._partial = ""
+        self._pending: List[dict] = []
+        self._total = 0
+        self.dropped = 0
+        self.closed = False
+
+    def write(self, text: str):
+        with self._lock:
+            self._partial += text
+            if "\n" not in self._partial:
+                return
+            *lines, self._partial = self._partial.split("\n")
+            for line in lines:
+                self._append(line)
+            full = len(self._pending) >= self._batch_size
+        if full:
+            self.flush()
+
+    def log(self, message: str, level: Optional[str] = None):
+        with self._lock:
+            self._append(message, level)
+
+    def _append(self, line: str, level: Optional[str] = None):
+        line = line.rstrip()
+        if not line.strip():
+            return
+        if self._total >= self._max_lines:
+            self.dropped += 1
+            return
+        self._total += 1
+        self._pending.append({"ts": time.time(), "level": level or _level_of(line.lstrip()), "message": line})
+
+    def flush(self, final: bool = False):
+        with self.emit_lock:
+            with self._lock:
+                if final and self._partial:
+                    self._append(self._partial)
+                    self._partial = ""
+                entries, self._pending = self._pending, []
+                dropped = self.dropped
+            if entries and self.closed:
+                # 任务已发布最终状态，之后的输出只写到控制台（TASK_LOG_ECHO 时路由器已经写过）
+                if not TASK_LOG_ECHO:
+                    _console.write("".join(f"{entry['message']}\n" for entry in entries))
+            elif entries:
+                try:
+                    self._emit(self.task_id, entries, dropped)
+                except Exception as e:
+                    _console.write(f"⚠️ 发送任务 {self.task_id} 的日志失败: {e}\n")
+
+    def close(self):
+        with self.emit_lock:
+            self.closed = True
+
+
+class _StdoutRouter(io.TextIOBase):
+    """
+    替代 sys.stdout 的路由器：按当前上下文绑定的 TaskLogger 分发输出。
+    """
+    def __init__(self, console):
+        self.console = console
+
+    def write(self, text: str) -> int:
+        logger = _current_logger.get()
+        if logger is None or TASK_LOG_ECHO:
+            self.console.write(text)
+        if logger is not None:
+            logger.write(text)
+        return len(text)
+
+    def flush(self):
+        self.console.flush()
+
+    def isatty(self) -> bool:
+        return self.console.isatty()
+
+    def fileno(self) -> int:
+        return self.console.fileno()
+
+    @property
+    def encoding(self):
+        return self.console.encoding
+
+
+_console = sys.stdout
+_active_loggers = set()
+_active_lock = threading.Lock()
+_flusher: Optional[threading.Thread] = None
+
+
+def _flush_loop():
+    while True:
+        time.sleep(TASK_LOG_FLUSH_INTERVAL)
+        with _active_lock:
+            loggers = list(_active_loggers)
+        for logger in loggers:
+            logger.flush()
+
+
+def install_stdout_router():
+    """
+    安装 stdout 路由器并启动定时刷新线程，可重复调用。
+    """
+    global _console, _flusher
+    with _active_lock:
+        if not isinstance(sys.stdout, _StdoutRouter):
+            _console = sys.stdout
+            sys.stdout = _StdoutRouter(_console)
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="task-log-flusher", daemon=True)
+            _flusher.start()
+
+
+def current_task_logger() -> Optional[TaskLogger]:
+    return _current_logger.get()
+
+
+def map_in_context(executor: Executor, fn: Callable[[Any], Any], items: Iterable[Any]) -> list:
+    """
+    与 list(executor.map(fn, items)) 相同，但每次调用都在当前上下文的副本中执行，线程中的 print 仍归到当前任务。
+    """
+    futures = [executor.submit(contextvars.copy_context().run, fn, item) for item in items]
+    return [future.result() for future in futures]
+
+
+@contextmanager
+def task_log_context(task_id: str, emit: Callable[[str, List[dict], int], None]):
+    """
+    在 with 块内（包括其中 await 的协程和 asyncio.to_thread 启动的线程）把 print 输出归到该任务。
+    退出时发出剩余的日志。
+    """
+    install_stdout_router()
+    logger = TaskLogger(task_id, emit)
+    token = _current_logger.set(logger)
+    with _active_lock:
+        _active_loggers.add(logger)
+    try:
+        yield logger
+    finally:
+        _current_logger.reset(token)
+        with _active_lock:
+            _active_loggers.discard(logger)
+        logger.flush(final=True)
@@ -0,0 +1,383 @@
+"""
+后台任务状态的持久化存储。
+
+任务状态不再只保存在进程内存中：服务重启后轮询 /api/task-status 仍能取到已完成任务的结果，
+多个 uvicorn worker（或多台机器共用 Redis）之间也能互相查到任务。
+- 默认后端为 SQLite（WAL 模式，读写互不阻塞），按 task_id 主键、Jira 工单号和更新时间建索引；
+- TASK_STORE_BACKEND=redis 时使用 Redis（需要安装 redis 包），适合多机部署；
+- 状态更新先在内存中按任务合并，由后台线程每隔 TASK_STORE_FLUSH_INTERVAL 秒批量写入，
+  任务进入 completed/failed 时立即写入；读取时优先返回尚未写入的最新状态；
+- 超过保留天数或超过最大任务数的已结束任务会被定期清理。
+每条记录记录所属进程（主机名:pid），重启时可以找回本机已退出进程遗留的未完成任务。
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+TASK_STORE_BACKEND = os.getenv("TASK_STORE_BACKEND", "sqlite").lower()
+TASK_STORE_PATH = Path(os.getenv("TASK_STORE_PATH", "./task_store.db"))
+TASK_STORE_REDIS_URL = os.getenv("TASK_STORE_REDIS_URL", "redis://localhost:6379/0")
+TASK_STORE_FLUSH_INTERVAL = float(os.getenv("TASK_STORE_FLUSH_INTERVAL", "0.5"))
+TASK_STORE_RETENTION_DAYS = float(os.getenv("TASK_STORE_RETENTION_DAYS", "7"))
+TASK_STORE_MAX_TASKS = int(os.getenv("TASK_STORE_MAX_TASKS", "10000"))
+TASK_STORE_PURGE_INTERVAL = float(os.getenv("TASK_STORE_PURGE_INTERVAL", "3600"))
+
+FINAL_STATUSES = ("completed", "failed")
+PROCESS_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: str) -> bool:
+    """
+    只能判断本机进程；其他主机的进程一律视为存活。
+    """
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    if int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SqliteTaskBackend:
+    def __init__(self, path: Path = TASK_STORE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    kind TEXT,
+                    jira_ticket TEXT,
+                    status TEXT NOT NULL,
+                    message TEXT,
+                    data TEXT,
+                    owner TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_jira_ticket ON tasks (jira_ticket, updated_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, updated_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks (updated_at)")
+
+    @staticmethod
+    def _to_record(row: sqlite3.Row) -> dict:
+        record = dict(row)
+        record["data"] = json.loads(record["data"]) if record["data"] else {}
+        return record
+
+    def write_many(self, records: List[dict]):
+        rows = [(r["task_id"], r.get("kind"), r.get("jira_ticket"), r["status"], r["message"],
+                 json.dumps(r["data"], ensure_ascii=False, default=str), r["owner"], r["updated_at"], r["updated_at"])
+                for r in records]
+        with self._lock, self._conn:
+            # 工单号、任务类型只在首次出现时传入，之后的更新保留原值
+            self._conn.executemany("""
+                INSERT INTO tasks (task_id, kind, jira_ticket, status, message, data, owner, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(task_id) DO UPDATE SET
+                    kind = COALESCE(excluded.kind, tasks.kind),
+                    jira_ticket = COALESCE(excluded.jira_ticket, tasks.jira_ticket),
+                    status = excluded.status,
+                    message = excluded.message,
+                    data = excluded.data,
+                    owner = excluded.owner,
+                    updated_at = excluded.updated_at""", rows)
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return self._to_record(row) if row else None
+
+    def find_by_ticket(self, jira_ticket: str, limit: int) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM tasks WHERE jira_ticket = ? ORDER BY updated_at DESC LIMIT ?",
+                (jira_ticket, limit)).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def unfinished(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM tasks WHERE status NOT IN (?, ?)", FINAL_STATUSES).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def claim(self, task_id: str, old_owner: str, new_owner: str) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute("UPDATE tasks SET owner = ? WHERE task_id = ? AND owner IS ?",
+                                        (new_owner, task_id, old_owner))
+        return cursor.rowcount == 1
+
+    def purge(self, before: float, max_tasks: int) -> int:
+        with self._lock, self._conn:
+            removed = self._conn.execute(
+                "DELETE FROM tasks WHERE updated_at < ? AND status IN (?, ?)", (before, *FINAL_STATUSES)).rowcount
+            removed += self._conn.execute("""
+                DELETE FROM tasks WHERE task_id IN (
+                    SELECT task_id FROM tasks WHERE status IN (?, ?)
+                    ORDER BY updated_at DESC LIMIT -1 OFFSET ?)""", (*FINAL_STATUSES, max_tasks)).rowcount
+        return removed
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisTaskBackend:
+    """
+    task:<id> 为哈希；tasks:updated 为按更新时间排序的有序集合（用于清理）；
+    task_ticket:<工单号> 为该工单的任务有序集合；tasks:unfinished 为未结束任务集合。
+    """
+    def __init__(self, url: str = TASK_STORE_REDIS_URL):
+        if redis is None:
+            raise RuntimeError("TASK_STORE_BACKEND=redis 需要安装 redis 包")
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _key(task_id: str) -> str:
+        return f"task:{task_id}"
+
+    @staticmethod
+    def _to_record(task_id: str, fields: dict) -> Optional[dict]:
+        if not fields:
+            return None
+        return {
+            "task_id": task_id,
+            "kind": fields.get("kind") or None,
+            "jira_ticket": fields.get("jira_ticket") or None,
+            "status": fields["status"],
+            "message": fields.get("message", ""),
+            "data": json.loads(fields.get("data") or "{}"),
+            "owner": fields.get("owner"),
+            "created_at": float(fields.get("created_at", 0)),
+            "updated_at": float(fields.get("updated_at", 0)),
+        }
+
+    def write_many(self, records: List[dict]):
+        pipe = self._redis.pipeline(transaction=False)
+        for r in records:
+            key = self._key(r["task_id"])
+            mapping = {"status": r["status"], "message": r["message"], "owner": r["owner"],
+                       "data": json.dumps(r["data"], ensure_ascii=False, default=str), "updated_at": r["updated_at"]}
+            if r.get("kind"):
+                mapping["kind"] = r["kind"]
+            if r.get("jira_ticket"):
+                mapping["jira_ticket"] = r["jira_ticket"]
+                pipe.zadd(f"task_ticket:{r['jira_ticket']}", {r["task_id"]: r["updated_at"]})
+            pipe.hsetnx(key, "created_at", r["updated_at"])
+            pipe.hset(key, mapping=mapping)
+            pipe.zadd("tasks:updated", {r["task_id"]: r["updated_at"]})
+            if r["status"] in FINAL_STATUSES:
+                pipe.srem("tasks:unfinished", r["task_id"])
+            else:
+                pipe.sadd("tasks:unfinished", r["task_id"])
+        pipe.execute()
+
+    def get(self, task_id: str) -> Optional[dict]:
+        return self._to_record(task_id, self._redis.hgetall(self._key(task_id)))
+
+    def _get_many(self, task_ids: List[str]) -> List[dict]:
+        pipe = self._redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(self._key(task_id))
+        records = [self._to_record(task_id, fields) for task_id, fields in zip(task_ids, pipe.execute())]
+        return [record for record in records if record]
+
+    def find_by_ticket(self, jira_ticket: str, limit: int) -> List[dict]:
+        return self._get_many(self._redis.zrevrange(f"task_ticket:{jira_ticket}", 0, limit - 1))
+
+    def unfinished(self) -> List[dict]:
+        return self._get_many(sorted(self._redis.smembers("tasks:unfinished")))
+
+    def claim(self, task_id: str, old_owner: str, new_owner: str) -> bool:
+        # 同一个遗留任务只允许一个进程接管
+        if not self._redis.set(f"task_claim:{task_id}:{old_owner}", new_owner, nx=True, ex=86400):
+            return False
+        self._redis.hset(self._key(task_id), "owner", new_owner)
+        return True
+
+    def _delete(self, task_ids: List[str]):
+        records = self._get_many(task_ids)
+        pipe = self._redis.pipeline(transaction=False)
+        for record in records:
+            pipe.delete(self._key(record["task_id"]))
+            if record["jira_ticket"]:
+                pipe.zrem(f"task_ticket:{record['jira_ticket']}", record["task_id"])
+        pipe.zrem("tasks:updated", *task_ids)
+        pipe.srem("tasks:unfinished", *task_ids)
+        pipe.execute()
+
+    def purge(self, before: float, max_tasks: int) -> int:
+        unfinished = self._redis.smembers("tasks:unfinished")
+        expired = [t for t in self._redis.zrangebyscore("tasks:updated", 0, before) if t not in unfinished]
+        excess = max(0, self._redis.zcard("tasks:updated") - len(expired) - max_tasks)
+        if excess:
+            oldest = self._redis.zrange("tasks:updated", 0, excess + len(unfinished) + len(expired) - 1)
+            expired += [t for t in oldest if t not in unfinished and t not in expired][:excess]
+        if expired:
+            self._delete(expired)
+        return len(expired)
+
+    def count(self) -> int:
+        return self._redis.zcard("tasks:updated")
+
+    def close(self):
+        self._redis.close()
+
+
+class TaskStore:
+    def __init__(self, backend=None, flush_interval: float = TASK_STORE_FLUSH_INTERVAL,
+                 retention_days: float = TASK_STORE_RETENTION_DAYS, max_tasks: int = TASK_STORE_MAX_TASKS):
+        self._backend = backend
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.max_tasks = max_tasks
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[str, dict] = {}
+        # 正在写入的批次，写入完成前读取仍返回这些最新状态
+        self._writing: Dict[str, dict] = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._last_purge = 0.0
+        self._stats = {"updates": 0, "writes": 0, "batches": 0}
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = RedisTaskBackend() if TASK_STORE_BACKEND == "redis" else SqliteTaskBackend()
+        return self._backend
+
+    def start(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._stopped.clear()
+            self._flusher = threading.Thread(target=self._flush_loop, name="task-store-flusher", daemon=True)
+            self._flusher.start()
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=10)
+            self._flusher = None
+        self.flush()
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+
+    def set(self, task_id: str, status: str, message: str, data: Optional[dict] = None,
+            jira_ticket: Optional[str] = None, kind: Optional[str] = None):
+        record = {"task_id": task_id, "status": status, "message": message, "data": data or {},
+                  "owner": PROCESS_OWNER, "updated_at": time.time()}
+        with self._lock:
+            previous = self._pending.get(task_id)
+            # 同一批次内合并同一任务的多次更新，保留首次传入的工单号和任务类型
+            record["jira_ticket"] = jira_ticket or (previous or {}).get("jira_ticket")
+            record["kind"] = kind or (previous or {}).get("kind")
+            self._pending[task_id] = record
+            self._stats["updates"] += 1
+        if status in FINAL_STATUSES or self._flusher is None:
+            self._wakeup.set()
+            if self._flusher is None:
+                self.flush()
+
+    def get(self, task_id: str) -> Optional[dict]:
+        with self._lock:
+            pending = self._pending.get(task_id) or self._writing.get(task_id)
+        if pending is not None:
+            return dict(pending)
+        return self.backend.get(task_id)
+
+    def find_by_ticket(self, jira_ticket: str, limit: int = 50) -> List[dict]:
+        self.flush()
+        return self.backend.find_by_ticket(jira_ticket, limit)
+
+    def recover_orphans(self) -> List[dict]:
+        """
+        接管本机已退出进程遗留的未完成任务，返回接管成功的记录（每个任务只会被一个进程接管）。
+        """
+        self.flush()
+        claimed = []
+        for record in self.backend.unfinished():
+            if _owner_alive(record["owner"]):
+                continue
+            if self.backend.claim(record["task_id"], record["owner"], PROCESS_OWNER):
+                record["owner"] = PROCESS_OWNER
+                claimed.append(record)
+        return claimed
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._writing = batch
+            if not batch:
+                return
+            try:
+                self.backend.write_many(list(batch.values()))
+            except Exception as e:
+                # 写入失败时放回待写队列（不覆盖期间产生的更新），下次重试
+                with self._lock:
+                    for task_id, record in batch.items():
+                        self._pending.setdefault(task_id, record)
+                    self._writing = {}
+                print(f"⚠️ 写入任务状态失败，稍后重试: {e}")
+                return
+            with self._lock:
+                self._writing = {}
+                self._stats["writes"] += len(batch)
+                self._stats["batches"] += 1
+
+    def purge(self) -> int:
+        before = time.time() - self.retention_days * 86400
+        removed = self.backend.purge(before, self.max_tasks)
+        if removed:
+            print(f"🧹 清理了 {removed} 条过期任务记录")
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, pending=len(self._pending))
+        stats["tasks"] = self.backend.count()
+        stats["backend"] = type(self.backend).__name__
+        return stats
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if time.time() - self._last_purge > TASK_STORE_PURGE_INTERVAL:
+                self._last_purge = time.time()
+                try:
+                    self.purge()
+                except Exception as e:
+                    print(f"⚠️ 清理任务记录失败: {e}")
+
+
+task_store = TaskStore()
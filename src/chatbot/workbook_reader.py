@@ -0,0 +1,142 @@
+"""
+多工作表 Excel 报告的流式读取。
+
+统计类分析只需要每个工作表的表头、count 列的第一行和数据行数，不需要把所有行加载成 DataFrame。
+这里逐行遍历工作表（优先使用 python-calamine，未安装时使用 openpyxl 只读模式），
+只保留表头、行数和指定列；工作表较多且文件较大时，各工作表在进程池中并行处理。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+# auto: 安装了 python-calamine 时使用 calamine，否则使用 openpyxl
+WORKBOOK_READER_ENGINE = os.getenv("WORKBOOK_READER_ENGINE", "auto").lower()
+WORKBOOK_READER_WORKERS = int(os.getenv("WORKBOOK_READER_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 小文件在当前进程中顺序读取即可，进程池的启动和传输开销反而更大
+WORKBOOK_PARALLEL_MIN_BYTES = int(float(os.getenv("WORKBOOK_PARALLEL_MIN_MB", "5")) * 1024 * 1024)
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+@dataclass
+class SheetSummary:
+    name: str
+    columns: List[str] = field(default_factory=list)
+    row_count: int = 0
+    # 表头中第一个包含 "count" 的列名及其第一行的值
+    count_column: Optional[str] = None
+    count_value: object = None
+    # 调用方指定需要的列: {列名: [值, ...]}
+    selected: Dict[str, list] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def _resolve_engine() -> str:
+    if WORKBOOK_READER_ENGINE == "calamine" or (WORKBOOK_READER_ENGINE == "auto" and CalamineWorkbook is not None):
+        if CalamineWorkbook is None:
+            raise RuntimeError("WORKBOOK_READER_ENGINE=calamine，但未安装 python-calamine。")
+        return "calamine"
+    return "openpyxl"
+
+
+def _is_empty_row(row: Sequence) -> bool:
+    return all(value is None or value == "" for value in row)
+
+
+def _iter_sheet_rows(path: str, sheet_name: str, engine: str):
+    if engine == "calamine":
+        sheet = CalamineWorkbook.from_path(path).get_sheet_by_name(sheet_name)
+        rows = sheet.iter_rows() if hasattr(sheet, "iter_rows") else sheet.to_python()
+        yield from rows
+        return
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook[sheet_name].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def list_sheet_names(path: str, engine: Optional[str] = None) -> List[str]:
+    engine = engine or _resolve_engine()
+    if engine == "calamine":
+        return list(CalamineWorkbook.from_path(path).sheet_names)
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def summarize_sheet(path: str, sheet_name: str, columns: Sequence[str] = (),
+                    engine: Optional[str] = None) -> SheetSummary:
+    """
+    逐行读取一个工作表，返回表头、数据行数、count 列第一行的值以及 columns 指定列的全部值。
+    与 pandas.read_excel 一致：第一行为表头，整行为空的行不计入行数。
+    """
+    engine = engine or _resolve_engine()
+    summary = SheetSummary(name=sheet_name)
+    rows = _iter_sheet_rows(path, sheet_name, engine)
+    try:
+        header = next(rows, None)
+        if header is None or _is_empty_row(header):
+            return summary
+        summary.columns = [str(value) if value is not None else f"Unnamed: {i}" for i, value in enumerate(header)]
+        count_index = next((i for i, column in enumerate(summary.columns) if "count" in column.lower()), None)
+        if count_index is not None:
+            summary.count_column = summary.columns[count_index]
+        selected_indexes = {column: summary.columns.index(column) for column in columns if column in summary.columns}
+        summary.selected = {column: [] for column in selected_indexes}
+
+        for row in rows:
+            if _is_empty_row(row):
+                continue
+            summary.row_count += 1
+            if summary.row_count == 1 and count_index is not None:
+                summary.count_value = row[count_index] if count_index < len(row) else None
+            for column, index in selected_indexes.items():
+                summary.selected[column].append(row[index] if index < len(row) else None)
+    except Exception as e:
+        summary.error = f"{type(e).__name__}: {e}"
+    finally:
+        # 提前结束遍历时也要关闭只读工作簿的文件句柄
+        rows.close()
+    return summary
+
+
+def _summarize_sheet_job(args) -> SheetSummary:
+    return summarize_sheet(*args)
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=WORKBOOK_READER_WORKERS)
+    return _process_pool
+
+
+def close_reader_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def summarize_workbook(path: str, columns: Sequence[str] = ()) -> List[SheetSummary]:
+    """
+    读取工作簿中所有工作表的摘要，按工作表原有顺序返回。
+    """
+    engine = _resolve_engine()
+    sheet_names = list_sheet_names(path, engine)
+    jobs = [(path, sheet_name, tuple(columns), engine) for sheet_name in sheet_names]
+    if len(jobs) > 1 and WORKBOOK_READER_WORKERS > 1 and os.path.getsize(path) >= WORKBOOK_PARALLEL_MIN_BYTES:
+        print(f"⚙️ 正在使用 {WORKBOOK_READER_WORKERS} 个进程并行读取 {len(jobs)} 个工作表 ({engine})...")
+        return list(_get_process_pool().map(_summarize_sheet_job, jobs))
+    return [_summarize_sheet_job(job) for job in jobs]
@@ -0,0 +1,32 @@
+from sql_cache import SqlCache, normalize_query
+
+
+def test_normalize_query_keeps_operators_and_decimals():
+    """测试用例: 规范化只折叠空白/全半角/大小写，比较符和小数点保留在缓存键中"""
+    assert normalize_query("金额<100的拜访") != normalize_query("金额>100的拜访")
+    assert normalize_query("时长大于1.5小时") != normalize_query("时长大于15小时")
+    assert normalize_query("  查询 ＡＢＣ 的拜访 ") == normalize_query("查询abc的拜访")
+
+
+def test_sql_cache_does_not_mix_up_comparisons(tmp_path):
+    """测试用例: "金额<100" 不能命中为 "金额>100" 缓存的 SQL"""
+    cache = SqlCache(path=tmp_path / "sql_cache.json")
+    cache.put("金额>100的拜访", "v1", "SELECT * FROM visits WHERE amount > 100")
+    cache.put("时长大于1.5小时的拜访", "v1", "SELECT * FROM visits WHERE hours > 1.5")
+
+    assert cache.get("金额<100的拜访", "v1") is None
+    assert cache.get("时长大于15小时的拜访", "v1") is None
+    assert cache.get("金额 > 100 的拜访", "v1")["tier"] == "exact"
+
+
+def test_sql_cache_merges_entries_from_other_workers(tmp_path):
+    """测试用例: 两个 worker 共用缓存文件时，保存不会覆盖对方写入的条目"""
+    path = tmp_path / "sql_cache.json"
+    worker_a = SqlCache(path=path)
+    worker_b = SqlCache(path=path)
+    worker_a.put("拜访次数", "v1", "SELECT COUNT(*) FROM visits")
+    worker_b.put("客户数量", "v1", "SELECT COUNT(*) FROM accounts")
+
+    reloaded = SqlCache(path=path)
+    assert reloaded.get("拜访次数", "v1")["tier"] == "exact"
+    assert reloaded.get("客户数量", "v1")["tier"] == "exact"